@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+#
+# Event-driven counterparts to Gpg.gpg() & Openssl.openssl(): many operations
+# run at once from a single thread, multiplexed with poll() over their pipes --
+# no thread per operation. Roughly what asyncio subprocesses give Python 3:
+#
+#   loop = aio.Loop()
+#   ops = [loop.gpg('enc', stdin=msg, symmetric=True, passwd=pw) for msg in msgs]
+#   loop.run()
+#   for op in ops:
+#       result = op.result()    # returncode, stdout, status, timings, etc
+#
+# Only engines that run a child process can take part; NativeOpenssl works
+# in-process & so isn't available here.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+from os import read, write, close, kill, O_NONBLOCK
+from errno import EAGAIN, EINTR, EPIPE
+from fcntl import fcntl, F_GETFL, F_SETFL
+from select import poll, POLLIN, POLLOUT, POLLHUP, POLLERR, POLLNVAL, error as SelectError
+from signal import SIGTERM
+from collections import deque
+from time import time
+# Custom Modules:
+from crypt_interface import (Gpg, Openssl, CHUNKSIZE, cloexec_pipe, spawn_child,
+                             iter_chunks, needs_secret_key)
+from gpg_status import StatusParser
+
+# Default cap on children running at once; further operations wait their turn
+MAX_RUNNING = 32
+# How often (seconds) to check on a child whose pipes have all closed but that
+#   hasn't been reaped yet
+REAP_INTERVAL = 0.01
+
+
+
+def set_nonblocking(fd):
+    """Put file descriptor fd in non-blocking mode."""
+    fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | O_NONBLOCK)
+
+
+
+class Result():
+    """Outcome of one Operation.
+    
+    returncode      Child's exit status (None if it never launched; negative if
+                    it was killed, e.g. by Operation.cancel())
+    stdout          Output data (None if it was written to a file object instead)
+    stderr          Everything the child wrote to stderr
+    status          GpgResult for gpg operations (see gpg_status); else None
+    bytes_in        Input bytes fed to the child through its stdin pipe
+    bytes_out       Output bytes read back from its stdout pipe
+    submitted, started, finished    time() when it was queued, launched & done
+    wait, elapsed   Seconds spent queued & running
+    cancelled       True if cancel() was called on it
+    error           Exception that kept it from launching, if any
+    
+    """
+    
+    def __init__(self):
+        self.returncode = None
+        self.stdout     = None
+        self.stderr     = ''
+        self.status     = None
+        self.bytes_in   = 0
+        self.bytes_out  = 0
+        self.submitted  = self.started = self.finished = None
+        self.wait       = self.elapsed = None
+        self.cancelled  = False
+        self.error      = None
+    
+    
+    def ok(self):
+        """Return True if the operation ran and succeeded."""
+        return self.returncode == 0
+
+
+
+class Operation():
+    """One engine operation submitted to a Loop; like a Future.
+    
+    Created by Loop.gpg() & Loop.openssl(), never directly. Operations are
+    started in submission order as running ones finish; the Loop only makes
+    progress while one of its run methods is being called.
+    
+    """
+    
+    def __init__(self, loop, backend, action, io, opts):
+        self.loop       = loop
+        self.backend    = backend
+        self.action     = action
+        self.io         = io
+        self.opts       = opts
+        self.child      = None
+        self._result    = Result()
+        self._result.submitted = time()
+        self._done      = False
+        self._callbacks = []
+        # Pipe plumbing, set up by Loop._start()
+        self._fds       = set()
+        self._chunks    = None
+        self._pending   = ''
+        self._collected = None
+        self._errors    = []
+        self._parser    = None
+        # Leased keyring snapshot (see crypt_interface.KeyringSnapshots), if any
+        self._snapshots = None
+        self._homedir   = None
+    
+    
+    def done(self):
+        """Return True once the operation has finished (or was cancelled/failed)."""
+        return self._done
+    
+    
+    def result(self):
+        """Return the Result; raise RuntimeError if the operation isn't done yet."""
+        if not self._done:
+            raise RuntimeError("operation still pending; run the loop first")
+        return self._result
+    
+    
+    def add_done_callback(self, fn):
+        """Arrange for fn(operation) to be called by the loop when it's done."""
+        if self._done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+    
+    
+    def cancel(self):
+        """Drop the operation if still queued, or kill its child if running.
+        
+        Return False if it had already finished.
+        
+        """
+        if self._done:
+            return False
+        self._result.cancelled = True
+        if self.child is None:
+            self.loop._dequeue(self)
+        elif self.child.returncode is None:
+            try:
+                kill(self.child.pid, SIGTERM)
+            except OSError:
+                pass
+        return True
+
+
+
+class Loop():
+    """Runs engine operations concurrently from a single thread.
+    
+    At most max_running children exist at once; the rest are queued, so
+    submitting thousands of operations costs memory for their inputs only.
+    Input is written to each child only as fast as it reads it (from a
+    string, a file-like object or an iterator, as with Gpg.gpg()), and output
+    goes to io-style destinations: collected into Result.stdout, or written to a
+    file object as it arrives. A file object with a real descriptor is handed
+    straight to the child, as the blocking engines do.
+    
+    """
+    
+    def __init__(self, backend='gpg2', max_running=MAX_RUNNING, chunksize=CHUNKSIZE):
+        self.backend        = backend
+        self.max_running    = max_running
+        self.chunksize      = chunksize
+        self._engines       = {}
+        self._queue         = deque()
+        self._running       = set()
+        self._reaping       = set()
+        self._fdmap         = {}
+        self._poller        = poll()
+    
+    
+    #---------------------------------------------------------------- SUBMITTING
+    
+    def gpg(self, action, stdin='', stdout='', infile=0, outfile=0, **opts):
+        """Queue a gpg operation; return its Operation.
+        
+        action & opts are as for Gpg.gpg(); the other args are the io dict keys of
+        the same name. Status output is always collected & parsed (Result.status).
+        
+        """
+        return self._submit(self.backend, action, stdin, stdout, infile, outfile, opts)
+    
+    
+    def openssl(self, action, passwd, stdin='', stdout='', infile=0, outfile=0,
+                base64=True, cipher=None):
+        """Queue an openssl operation; return its Operation (args as for gpg())."""
+        opts = dict(passwd=passwd, base64=base64, cipher=cipher)
+        return self._submit('openssl', action, stdin, stdout, infile, outfile, opts)
+    
+    
+    def pending(self):
+        """Return number of operations queued or running."""
+        return len(self._queue) + len(self._running)
+    
+    
+    #------------------------------------------------------------------- RUNNING
+    
+    def run(self, operations=None):
+        """Run until operations (default: everything submitted) are all done."""
+        if operations is None:
+            while self.pending():
+                self.run_once()
+        else:
+            while not all(op.done() for op in operations):
+                self.run_once()
+    
+    
+    def run_once(self, timeout=None):
+        """Wait up to timeout seconds (None: indefinitely) for pipe activity & handle it."""
+        if self._reaping:
+            timeout = REAP_INTERVAL if timeout is None else min(timeout, REAP_INTERVAL)
+        if self._fdmap:
+            try:
+                events = self._poller.poll(None if timeout is None else timeout * 1000)
+            except SelectError as e:
+                if e.args[0] != EINTR:
+                    raise
+                events = []
+            for fd, event in events:
+                op, kind = self._fdmap[fd]
+                if kind == 'in':
+                    self._feed(op, fd, event)
+                else:
+                    self._drain(op, fd, kind)
+        for op in list(self._reaping):
+            if op.child.poll() is not None:
+                self._reaping.discard(op)
+                self._finish(op)
+    
+    
+    #------------------------------------------------------------------ INTERNAL
+    
+    def _engine(self, backend):
+        if backend not in self._engines:
+            if backend == 'openssl':
+                self._engines[backend] = Openssl(show_version=False)
+            else:
+                self._engines[backend] = Gpg(show_version=False, firstchoice=backend)
+        return self._engines[backend]
+    
+    
+    def _submit(self, backend, action, stdin, stdout, infile, outfile, opts):
+        io = dict(stdin=stdin, stdout=stdout, stderr=0, gstatus=0, infile=infile,
+                  outfile=outfile)
+        op = Operation(self, backend, action, io, opts)
+        self._queue.append(op)
+        self._start_queued()
+        return op
+    
+    
+    def _dequeue(self, op):
+        self._queue.remove(op)
+        self._complete(op)
+    
+    
+    def _start_queued(self):
+        while self._queue and len(self._running) < self.max_running:
+            self._start(self._queue.popleft())
+    
+    
+    def _start(self, op):
+        """Launch op's child and register its pipes with the poller."""
+        
+        io = op.io
+        io['stderr'] = cloexec_pipe()
+        fd_pwd_R = None
+        try:
+            x = self._engine(op.backend)
+            if isinstance(x, Gpg):
+                io['gstatus'] = cloexec_pipe()
+                op._parser = StatusParser()
+                opts = dict(op.opts)
+                if opts.get('fastpath'):
+                    # As Gpg.gpg() does: gpg won't check the trustdb itself now
+                    x.session.maintain_trustdb()
+                # Likewise, run against a leased keyring snapshot; released by _complete()
+                if opts.pop('snapshot', False) and not needs_secret_key(
+                        op.action, opts.get('encsign')):
+                    op._snapshots = x.session.snapshots()
+                    op._homedir = op._snapshots.lease()
+                cmd, fd_pwd_R = x.gpg_command(io, op.action, homedir=op._homedir, **opts)
+                pass_fds = [fd for fd in (fd_pwd_R, io['gstatus'][1]) if fd]
+            else:
+                cmd, fd_pwd_R = x.openssl_command(io, op.action, **op.opts)
+                pass_fds = [fd_pwd_R]
+            op.child = spawn_child(cmd, io, pass_fds)
+        except Exception as e:
+            op._result.error = e
+            for fds in io['stderr'], io['gstatus']:
+                if fds:
+                    close(fds[0])
+            self._complete(op)
+            return
+        finally:
+            # Child has its copies now (or there's no child)
+            if fd_pwd_R:  close(fd_pwd_R)
+            for fds in io['stderr'], io['gstatus']:
+                if fds:
+                    close(fds[1])
+        
+        op._result.started = time()
+        self._running.add(op)
+        if op.child.stdin:
+            op._chunks = iter_chunks(io['stdin'], self.chunksize)
+            self._register(op, op.child.stdin.fileno(), 'in', POLLOUT)
+        if op.child.stdout:
+            if not hasattr(io['stdout'], 'write'):
+                op._collected = []
+            self._register(op, op.child.stdout.fileno(), 'out', POLLIN)
+        self._register(op, io['stderr'][0], 'err', POLLIN)
+        if io['gstatus']:
+            self._register(op, io['gstatus'][0], 'status', POLLIN)
+    
+    
+    def _register(self, op, fd, kind, events):
+        set_nonblocking(fd)
+        self._fdmap[fd] = op, kind
+        self._poller.register(fd, events)
+        op._fds.add(fd)
+    
+    
+    def _unregister(self, op, fd):
+        """Stop watching fd & close it; once op has no pipes left, reap its child."""
+        self._poller.unregister(fd)
+        kind = self._fdmap.pop(fd)[1]
+        op._fds.discard(fd)
+        if kind == 'in':
+            op.child.stdin.close()
+        elif kind == 'out':
+            op.child.stdout.close()
+        else:
+            close(fd)
+        if not op._fds:
+            if op.child.poll() is None:
+                self._reaping.add(op)
+            else:
+                self._finish(op)
+    
+    
+    def _feed(self, op, fd, event):
+        """Write as much input as the child's stdin pipe will take right now."""
+        if event & (POLLERR | POLLHUP | POLLNVAL):
+            # Child closed its stdin; its returncode will tell whether that's bad
+            self._unregister(op, fd)
+            return
+        while True:
+            if not op._pending:
+                try:
+                    op._pending = next(op._chunks, '')
+                except Exception as e:
+                    op._result.error = e
+                    op.cancel()
+                    op._pending = ''
+                if not op._pending:
+                    self._unregister(op, fd)
+                    return
+            try:
+                n = write(fd, op._pending)
+            except OSError as e:
+                if e.errno == EAGAIN:
+                    return
+                if e.errno != EPIPE:
+                    raise
+                self._unregister(op, fd)
+                return
+            op._result.bytes_in += n
+            op._pending = op._pending[n:]
+    
+    
+    def _drain(self, op, fd, kind):
+        """Read what's waiting in one of op's output pipes."""
+        try:
+            data = read(fd, self.chunksize)
+        except OSError as e:
+            if e.errno == EAGAIN:
+                return
+            raise
+        if not data:
+            self._unregister(op, fd)
+        elif kind == 'out':
+            op._result.bytes_out += len(data)
+            if op._collected is None:
+                op.io['stdout'].write(data)
+            else:
+                op._collected.append(data)
+        elif kind == 'err':
+            op._errors.append(data)
+        else:
+            op._parser.feed(data)
+    
+    
+    def _finish(self, op):
+        """Fill in op's Result once its child has exited & its pipes are drained."""
+        r = op._result
+        r.returncode = op.child.returncode
+        r.stderr = ''.join(op._errors)
+        if op._collected is not None:
+            r.stdout = ''.join(op._collected)
+        if op._parser:
+            r.status = op._parser.close()
+        op.io['stdin'] = ''
+        self._running.discard(op)
+        self._complete(op)
+        self._start_queued()
+    
+    
+    def _complete(self, op):
+        r = op._result
+        r.finished = time()
+        r.wait = (r.started or r.finished) - r.submitted
+        r.elapsed = r.finished - r.started if r.started else 0.0
+        op._done = True
+        if op._homedir:
+            op._snapshots.release(op._homedir)
+            op._snapshots = op._homedir = None
+        # Don't hold on to potentially huge buffers
+        op._chunks = op._collected = op._errors = op._parser = None
+        callbacks, op._callbacks = op._callbacks, []
+        for fn in callbacks:
+            fn(op)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import argparse
+import json
+from sys import stdin, stdout, stderr
+from os import walk
+from os.path import join, isfile
+from fnmatch import fnmatch
+from multiprocessing import cpu_count
+from time import time
+# Custom Modules:
+import crypt_interface
+import sniff
+import threadpool
+from progress import Progress, describe
+
+# Actions accepted by the batch subcommand, same names as Gpg.gpg() uses
+ACTIONS = ('enc', 'dec', 'embedsign', 'clearsign', 'detachsign', 'verify')
+
+
+
+def read_manifest(f):
+    """Yield (infile, outfile) tuples from an open manifest file.
+    
+    One job per line: an input path, optionally followed by a TAB and an output
+    path. Blank lines and lines starting with '#' are ignored.
+    
+    """
+    for line in f:
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        if '\t' in line:
+            infile, outfile = line.split('\t', 1)
+            yield infile, outfile or None
+        else:
+            yield line, None
+
+
+def walk_tree(topdir, pattern='*'):
+    """Return sorted list of (infile, None) tuples for files under topdir matching pattern."""
+    jobs = []
+    for dirpath, dirnames, filenames in walk(topdir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if fnmatch(name, pattern):
+                jobs.append((join(dirpath, name), None))
+    return jobs
+
+
+def add_engine_arguments(parser):
+    """Add backend/crypto options shared by the headless subcommands to parser."""
+    
+    parser.add_argument('-b', '--backend', choices=('gpg2', 'gpg', 'openssl'),
+                        default='gpg2', help="backend program to use as encryption engine")
+    
+    parser.add_argument('-N', '--native', action='store_true',
+                        help="with openssl backend, en/decrypt in-process via libcrypto "
+                             "instead of running the openssl program")
+    
+    parser.add_argument('-c', '--symmetric', action='store_true',
+                        help="enable symmetric encryption mode")
+    
+    parser.add_argument('-P', '--passphrase-file', metavar='FILE',
+                        help="read passphrase for symmetric mode from first line of FILE")
+    
+    parser.add_argument('-r', '--recipients', metavar='RECIP',
+                        help="recipients for asymmetric mode (semicolon-separated)")
+    
+    parser.add_argument('-S', '--enctoself', action='store_true',
+                        help="add default key as a recipient")
+    
+    parser.add_argument('-s', '--sign', action='store_true',
+                        help="sign while encrypting")
+    
+    parser.add_argument('-k', '--defaultkey', metavar='KEYUID',
+                        help="override default gpg private key")
+    
+    parser.add_argument('--cipher', help="cipher, e.g.: aes256, 3des, camellia128")
+    
+    parser.add_argument('--digest', help="digest, e.g.: sha256, sha512")
+    
+    parser.add_argument('--binary', action='store_true',
+                        help="write binary output instead of ascii-armored")
+    
+    parser.add_argument('--compress', type=compress_policy, default='auto',
+                        metavar='auto|never|default|0-9',
+                        help="gpg compression: skip for input that already looks compressed "
+                             "(auto; the default), never, gpg's own default, or a level")
+    
+    parser.add_argument('--snapshot', action='store_true',
+                        help="with gpg, encrypt/verify against private copies of the public "
+                             "keyring, so parallel gpg processes don't wait on its locks")
+    
+    parser.add_argument('-F', '--fastpath', action='store_true',
+                        help="with gpg, skip its trustdb check & key auto-retrieval on every "
+                             "operation (the trustdb is checked in the background instead)")
+    
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="pass --verbose to gpg")
+
+
+def compress_policy(text):
+    """Return compression policy (see crypt_interface.compression_args) for option text."""
+    if text in {'auto', 'never'}:
+        return text
+    if text == 'default':
+        return None
+    if text.isdigit() and 0 <= int(text) <= 9:
+        return int(text)
+    raise argparse.ArgumentTypeError("expected auto, never, default or 0-9")
+
+
+def check_engine_arguments(parser, args):
+    """Exit via parser.error() if args leave the engine without a passphrase it needs.
+    
+    Headless runs have nobody to ask, so better to fail once here than on every file.
+    
+    """
+    if args.passphrase_file:
+        return
+    if args.backend == 'openssl':
+        parser.error("openssl backend needs -P/--passphrase-file")
+    if args.symmetric and not stdin.isatty():
+        parser.error("-c/--symmetric needs -P/--passphrase-file when stdin isn't a terminal")
+
+
+def worker_count(text):
+    """Return number of workers for option text (a positive integer)."""
+    try:
+        n = int(text)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError("expected a positive integer")
+    return n
+
+
+def engine_opts(args):
+    """Return engine keyword args (see crypt_interface.run_engine) built from parsed args."""
+    
+    passwd = None
+    if args.passphrase_file:
+        with open(args.passphrase_file) as f:
+            passwd = f.readline().rstrip('\r\n')
+    
+    if args.backend == 'openssl':
+        return dict(passwd=passwd, base64=not args.binary, cipher=args.cipher)
+    return dict(
+        encsign=args.sign, digest=args.digest, localuser=args.defaultkey,
+        base64=not args.binary, symmetric=args.symmetric, passwd=passwd,
+        asymmetric=bool(args.recipients or args.enctoself), recip=args.recipients,
+        enctoself=args.enctoself, cipher=args.cipher, verbose=args.verbose,
+        alwaystrust=True, compress=args.compress, snapshot=args.snapshot,
+        fastpath=args.fastpath)
+
+
+
+class Batch:
+    """Run one gpg/openssl operation over many files with a pool of workers.
+    
+    All workers share one Gpg or Openssl instance, each file getting its own
+    crypt_interface.Job, so up to 'workers' child processes run at once.
+    The results of each job are returned as a dict -- see run_job().
+    
+    If auto_armor is set, encrypted/signed output is ascii-armored only for
+    input files that look like text (see sniff.is_binary), as in the GUI.
+    
+    Set on_progress to a function to have it called as on_progress(infile,
+    snapshot) about once a second while each file is processed (see
+    progress.Progress.snapshot()).
+    
+    """
+    
+    
+    def __init__(self, action, backend='gpg', workers=None, native=False, **opts):
+        if action not in ACTIONS:
+            raise ValueError("action must be one of: {}".format(', '.join(ACTIONS)))
+        if backend == 'openssl' and action not in {'enc', 'dec'}:
+            raise ValueError("OpenSSL only supports enc & dec actions")
+        self.action     = action
+        self.backend    = backend
+        self.workers    = workers or cpu_count()
+        self.native     = native
+        self.opts       = opts
+        self.on_progress = None
+        self.auto_armor = False
+        # Fail early (i.e., before spinning up the pool) if backend is missing
+        self.x          = crypt_interface.new_engine(backend, native)
+    
+    
+    def file_opts(self, infile):
+        """Return engine keyword args for infile, i.e., with auto_armor applied."""
+        opts = self.opts
+        if self.auto_armor and self.action in {'enc', 'embedsign', 'detachsign'}:
+            try:
+                opts = dict(opts, base64=not sniff.is_binary(infile))
+            except (OSError, IOError):
+                pass  # Reported by run_job()
+        return opts
+    
+    
+    def run_job(self, job):
+        """Process one (infile, outfile) job and return a dict describing the result."""
+        
+        infile, outfile = job
+        opts = self.file_opts(infile)
+        if not outfile:
+            outfile = crypt_interface.default_outfile(
+                infile, self.action, opts.get('base64', True), self.backend)
+        result = dict(infile=infile, outfile=outfile, action=self.action)
+        start = time()
+        
+        if not isfile(infile):
+            result.update(returncode=None, ok=False, seconds=0.0,
+                          stderr="No such file: {}".format(infile))
+            return result
+        
+        op = crypt_interface.Job(infile=infile, outfile=outfile or 0)
+        if self.on_progress:
+            op.progress = Progress(callback=lambda p: self.on_progress(infile, p),
+                                   interval=1.0)
+        returncode, errors = crypt_interface.run_engine(self.x, self.action, job=op, **opts)
+        result.update(returncode=returncode, ok=returncode == 0,
+                      seconds=round(time() - start, 4), stderr=errors)
+        if op.status:
+            result['status'] = op.status.as_dict()
+        return result
+    
+    
+    def run(self, jobs, callback):
+        """Run all jobs on the worker pool, calling callback(result) as each finishes.
+        
+        Returns number of jobs that failed.
+        
+        """
+        failed = 0
+        for result in threadpool.imap_unordered(self.run_job, jobs, self.workers):
+            if not result['ok']:
+                failed += 1
+            callback(result)
+        return failed
+
+
+
+def main(argv):
+    """Entry point for 'pyrite batch' subcommand; return exit status."""
+    
+    parser = argparse.ArgumentParser(
+        prog='pyrite batch',
+        description="Headless: encrypt, decrypt, sign, or verify many files in "
+                    "parallel, printing one JSON result per file to stdout.")
+    
+    parser.add_argument('action', choices=ACTIONS,
+                        help="operation to perform on each file")
+    
+    g1 = parser.add_mutually_exclusive_group(required=True)
+    
+    g1.add_argument('-m', '--manifest', metavar='FILE',
+                    help="file listing one INPUT[<TAB>OUTPUT] per line ('-' for stdin)")
+    
+    g1.add_argument('-D', '--dir', metavar='DIR',
+                    help="process every file under DIR (recursively)")
+    
+    parser.add_argument('-p', '--pattern', default='*',
+                        help="with --dir, only process filenames matching this glob")
+    
+    parser.add_argument('-j', '--workers', type=worker_count, default=cpu_count(),
+                        help="number of gpg/openssl processes to run at once "
+                             "(default: %(default)s)")
+    
+    parser.add_argument('-A', '--auto-armor', action='store_true',
+                        help="ascii-armor output only for input files that look like "
+                             "text (binary output for the rest)")
+    
+    parser.add_argument('--progress', action='store_true',
+                        help="report progress of each file on stderr every second")
+    
+    add_engine_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    check_engine_arguments(parser, args)
+    
+    opts = engine_opts(args)
+    
+    try:
+        batch = Batch(args.action, args.backend, args.workers, args.native, **opts)
+    except (ValueError, OSError) as e:
+        stderr.write("pyrite batch: {}\n".format(e))
+        return 2
+    
+    batch.auto_armor = args.auto_armor
+    
+    if args.progress:
+        def show_progress(infile, p):
+            stderr.write("pyrite batch: {}: {}\n".format(infile, describe(p)))
+        batch.on_progress = show_progress
+    
+    if args.dir:
+        jobs = walk_tree(args.dir, args.pattern)
+    elif args.manifest == '-':
+        jobs = list(read_manifest(stdin))
+    else:
+        with open(args.manifest) as f:
+            jobs = list(read_manifest(f))
+    
+    def report(result):
+        stdout.write(json.dumps(result, sort_keys=True) + "\n")
+        stdout.flush()
+    
+    failed = batch.run(jobs, report)
+    stderr.write("pyrite batch: {} files, {} failed\n".format(len(jobs), failed))
+    return 1 if failed else 0
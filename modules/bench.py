@@ -0,0 +1,744 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import argparse
+import json
+from sys import stderr, executable
+from os import environ, urandom
+from os.path import dirname, abspath, join
+from binascii import unhexlify
+from multiprocessing import cpu_count
+from random import Random
+from shutil import rmtree
+from subprocess import call, Popen, PIPE
+from tempfile import mkdtemp
+from time import time, strftime
+# Custom Modules:
+import aio
+import chunked
+import crypt_interface
+import gpg_status
+import keyindex
+
+
+
+def percentile(values, pct):
+    """Return nearest-rank pct-th percentile of a list of numbers."""
+    values = sorted(values)
+    if not values:
+        return None
+    k = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[k]
+
+
+def scratch_gnupghome():
+    """Point GNUPGHOME at a new throwaway dir and return its path."""
+    home = mkdtemp(prefix='pyrite-bench-')
+    environ['GNUPGHOME'] = home
+    return home
+
+
+def remove_gnupghome(home):
+    """Stop any gpg-agent started for throwaway home and delete it."""
+    try:
+        call(['gpgconf', '--homedir', home, '--kill', 'gpg-agent'])
+    except OSError:
+        pass
+    rmtree(home, ignore_errors=True)
+
+
+def generate_key(name='Pyrite Benchmark <bench@example.com>'):
+    """Create an unprotected 2048-bit RSA key in the current GNUPGHOME; return the uid.
+    
+    Raises OSError if gpg can't be run or fails.
+    
+    """
+    x = crypt_interface.new_engine('gpg2')
+    params = ("Key-Type: RSA\nKey-Length: 2048\nKey-Usage: sign\n"
+              "Subkey-Type: RSA\nSubkey-Length: 2048\nSubkey-Usage: encrypt\n"
+              "Name-Real: {}\nExpire-Date: 0\n".format(name))
+    if x.session.agent_builtin:
+        params += "%no-protection\n"
+    params += "%commit\n"
+    p = Popen([x.GPG_BINARY, '--batch', '--gen-key'], stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    err = p.communicate(params)[1]
+    if p.returncode != 0:
+        raise OSError("gpg --gen-key failed: {}".format(err.strip()))
+    x.session.invalidate()
+    return name
+
+
+def make_payload(path, size, seed=0):
+    """Write size bytes of reproducible, incompressible data to path."""
+    rand = Random(seed)
+    block = unhexlify('{:0{}x}'.format(rand.getrandbits(8 << 20), 2 << 20))
+    with open(path, 'wb') as f:
+        while size > 0:
+            f.write(block[:size])
+            size -= len(block)
+
+
+def load_engine(backend):
+    """Return an engine instance for backend name ('native' == in-process openssl)."""
+    if backend == 'native':
+        return crypt_interface.new_engine('openssl', native=True)
+    return crypt_interface.new_engine(backend)
+
+
+def timed_call(x, action, **opts):
+    """Run one engine operation per x.io; return (seconds, returncode).
+    
+    Time is measured from launch until the child has exited *and* its stderr
+    has been read to EOF, i.e., what a caller actually waits for.
+    
+    """
+    start = time()
+    returncode = crypt_interface.run_engine(x, action, **opts)[0]
+    return time() - start, returncode
+
+
+def report(name, samples):
+    """Print a one-line latency summary (in milliseconds) for samples."""
+    ms = [s * 1000 for s in samples]
+    print "{:<22} calls={:<5} min={:8.2f}  p50={:8.2f}  p95={:8.2f}  max={:8.2f}  mean={:8.2f}".format(
+        name, len(ms), min(ms), percentile(ms, 50), percentile(ms, 95), max(ms),
+        sum(ms) / len(ms))
+
+
+
+#------------------------------------------------------------------ BENCHMARKS
+
+def bench_latency(args):
+    """Per-call latency of small text-mode symmetric encryptions."""
+    
+    payload = urandom(args.size)
+    home = scratch_gnupghome()
+    try:
+        for backend in args.backend or ['gpg2', 'openssl']:
+            try:
+                x = load_engine(backend)
+            except OSError:
+                stderr.write("{} not available; skipping\n".format(backend))
+                continue
+            samples = []
+            for i in xrange(args.calls):
+                x.io.update(stdin=payload, stdout='')
+                if backend in {'openssl', 'native'}:
+                    seconds, rc = timed_call(x, 'enc', passwd='benchmark')
+                else:
+                    seconds, rc = timed_call(x, 'enc', symmetric=True, passwd='benchmark')
+                if rc != 0:
+                    stderr.write("{} call failed with returncode {}\n".format(backend, rc))
+                    return 1
+                samples.append(seconds)
+            report(backend, samples)
+    finally:
+        remove_gnupghome(home)
+    return 0
+
+
+def bench_fastpath(args):
+    """Per-call latency of tiny public-key gpg operations with & without the fast path."""
+    
+    payload = urandom(args.size)
+    home = scratch_gnupghome()
+    try:
+        try:
+            recipient = generate_key()
+            x = load_engine(args.backend)
+        except OSError as e:
+            stderr.write("{}\n".format(e))
+            return 1
+        # Something to verify
+        x.io.update(stdin=payload, stdout='')
+        if timed_call(x, 'clearsign')[1] != 0:
+            stderr.write("couldn't sign with the benchmark key\n")
+            return 1
+        signed = x.io['stdout']
+        for action, data, opts in (
+                ('enc', payload, dict(asymmetric=True, recip=recipient)),
+                ('verify', signed, {})):
+            for fastpath in False, True:
+                samples = []
+                # The first call is a warm-up and isn't counted
+                for i in xrange(args.calls + 1):
+                    x.io.update(stdin=data, stdout='')
+                    seconds, rc = timed_call(x, action, fastpath=fastpath, **opts)
+                    if rc != 0:
+                        stderr.write("{} call failed with returncode {}\n".format(action, rc))
+                        return 1
+                    if i:
+                        samples.append(seconds)
+                report("{} {}".format(action, 'fastpath' if fastpath else 'default'), samples)
+    finally:
+        remove_gnupghome(home)
+    return 0
+
+
+def bench_native(args):
+    """Check in-process engine against openssl binary (all ciphers) & compare latency."""
+    
+    payload = urandom(args.size)
+    try:
+        binary = load_engine('openssl')
+        native = load_engine('native')
+    except OSError:
+        stderr.write("need both openssl and libcrypto for this benchmark\n")
+        return 1
+    
+    def crypt(x, action, data, base64, cipher):
+        x.io.update(stdin=data, stdout='')
+        seconds, rc = timed_call(x, action, passwd='benchmark', base64=base64,
+                                 cipher=cipher)
+        return seconds, rc, x.io['stdout']
+    
+    failed = 0
+    for cipher in sorted(c for c in crypt_interface.OPENSSL_CIPHERS if c):
+        for base64 in True, False:
+            name = "{}{}".format(cipher, '/a' if base64 else '')
+            # Interop: each engine must decrypt what the other one encrypted
+            s, rc_b, from_binary = crypt(binary, 'enc', payload, base64, cipher)
+            s, rc_n, from_native = crypt(native, 'enc', payload, base64, cipher)
+            if rc_b != 0 and rc_n != 0:
+                print "{:<15} skipped (cipher unavailable in this OpenSSL)".format(name)
+                continue
+            s, rc1, out1 = crypt(native, 'dec', from_binary, base64, cipher)
+            s, rc2, out2 = crypt(binary, 'dec', from_native, base64, cipher)
+            if not (rc1 == rc2 == 0 and out1 == out2 == payload):
+                print "{:<15} INTEROP FAILURE".format(name)
+                failed += 1
+                continue
+            # Latency
+            for label, x in ('openssl', binary), ('native', native):
+                samples = [crypt(x, 'enc', payload, base64, cipher)[0]
+                           for i in xrange(args.calls)]
+                report("{} {}".format(name, label), samples)
+    return 1 if failed else 0
+
+
+def bench_status(args):
+    """Throughput of the gpg status parser as the stream grows (should stay flat)."""
+    
+    sig = ("[GNUPG:] NEWSIG\n"
+           "[GNUPG:] GOODSIG 76C0DD9313284A06 Test User <test@example.com>\n"
+           "[GNUPG:] VALIDSIG 706108294353811D4B1FBE0576C0DD9313284A06 2013-09-15 "
+           "1379203200 0 4 0 1 10 00 706108294353811D4B1FBE0576C0DD9313284A06\n"
+           "[GNUPG:] TRUST_ULTIMATE 0 pgp\n")
+    progress = "[GNUPG:] PROGRESS /some/file ? {} 104857600 B\n"
+    rand = Random(0)
+    
+    lines = args.lines
+    for i in xrange(args.steps):
+        # A very verbose run: mostly progress lines with signatures sprinkled in
+        stream = ''.join(sig if n % 100 == 0 else progress.format(n * 4096)
+                         for n in xrange(lines))
+        # Chop it up at random, like reads from a pipe would
+        chunks, pos = [], 0
+        while pos < len(stream):
+            size = rand.randint(1, 8192)
+            chunks.append(stream[pos:pos+size])
+            pos += size
+        samples = []
+        for r in xrange(args.repeat):
+            start = time()
+            parser = gpg_status.StatusParser()
+            for chunk in chunks:
+                parser.feed(chunk)
+            result = parser.close()
+            samples.append(time() - start)
+        if len(result.signatures) != (lines + 99) // 100:
+            stderr.write("parser miscounted signatures\n")
+            return 1
+        best = min(samples)
+        print "{:<22} lines={:<8} bytes={:<10} best={:8.2f} ms  per-line={:6.2f} us".format(
+            'status parser', result.lines, len(stream), best * 1000,
+            best / result.lines * 1e6)
+        lines *= 4
+    return 0
+
+
+def bench_startup(args):
+    """Cold-start time of headless imports & a CLI encrypt vs. loading the GUI."""
+    
+    topdir = dirname(dirname(abspath(__file__)))
+    
+    def python(args, input=None):
+        p = Popen([executable] + args, cwd=topdir, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        out = p.communicate(input)[0]
+        return p.returncode, out
+    
+    # Headless modules mustn't pull in GTK+ behind our backs
+    rc, out = python(['-c', "import sys, modules.cfg, modules.crypt_interface, "
+                            "modules.batch, modules.chunked\n"
+                            "print ' '.join(m for m in ('gtk', 'gobject', 'glib') "
+                            "if m in sys.modules)"])
+    if rc != 0 or out.strip():
+        stderr.write("headless import failed or loaded: {}\n".format(out.strip()))
+        return 1
+    
+    tmpdir = mkdtemp(prefix='pyrite-bench-')
+    payload, passfile = join(tmpdir, 'payload'), join(tmpdir, 'passphrase')
+    with open(payload, 'wb') as f:
+        f.write(urandom(args.size))
+    with open(passfile, 'w') as f:
+        f.write("benchmark\n")
+    cases = [
+        ('import crypt_interface', ['-c', 'import modules.crypt_interface'], None),
+        ('cli encrypt', ['pyrite.py', 'batch', 'enc', '-m', '-', '-b', 'openssl', '-N',
+                         '-P', passfile], "{}\t{}.enc\n".format(payload, payload)),
+        ('import gui (core)', ['-c', 'import modules.core'], None)]
+    try:
+        for name, cmd, input in cases:
+            samples = []
+            for i in xrange(args.runs):
+                start = time()
+                rc = python(cmd, input)[0]
+                samples.append(time() - start)
+                if rc != 0:
+                    break
+            if rc != 0:
+                print "{:<22} failed with returncode {}{}".format(
+                    name, rc, " (GTK+ not installed?)" if 'gui' in name else '')
+                continue
+            report(name, samples)
+    finally:
+        rmtree(tmpdir, ignore_errors=True)
+    return 0
+
+
+def bench_aio(args):
+    """Throughput of many small encryptions run from one thread with aio.Loop."""
+    
+    payload = urandom(args.size)
+    home = scratch_gnupghome()
+    try:
+        for backend in args.backend or ['openssl', 'gpg2']:
+            for running in args.concurrency or [1, 4, 16, 64]:
+                loop = aio.Loop(backend, max_running=running)
+                start = time()
+                if backend == 'openssl':
+                    ops = [loop.openssl('enc', 'benchmark', stdin=payload)
+                           for i in xrange(args.calls)]
+                else:
+                    ops = [loop.gpg('enc', stdin=payload, symmetric=True, passwd='benchmark')
+                           for i in xrange(args.calls)]
+                loop.run()
+                seconds = time() - start
+                failed = [op for op in ops if not op.result().ok()]
+                if failed:
+                    r = failed[0].result()
+                    stderr.write("{} call failed: {}\n".format(
+                        backend, r.error or "returncode {}".format(r.returncode)))
+                    return 1
+                print "{:<22} calls={:<5} max-running={:<4} total={:8.2f} s  calls/s={:8.1f}".format(
+                    backend, args.calls, running, seconds, args.calls / seconds)
+    finally:
+        remove_gnupghome(home)
+    return 0
+
+
+def bench_keyindex(args):
+    """Build & lookup cost of the recipient index on synthetic keyrings of growing size."""
+    
+    keys = args.keys
+    for i in xrange(args.steps):
+        # What 'gpg --list-keys --with-colons --with-fingerprint' prints per key
+        listing = ''.join(
+            "pub:u:3072:1:{0:016X}:1379203200:::u:::scESC::::::23::0:\n"
+            "fpr:::::::::{1:024X}{0:016X}:\n"
+            "uid:u::::1379203200::{0:040X}::User {2} <user{2}@example.com>::::::::::0:\n"
+            "sub:u:3072:1:{3:016X}:1379203200::::::e::::::23:\n"
+            "fpr:::::::::{1:024X}{3:016X}:\n".format(n * 7919 + 1, n, n, n * 7919 + 2)
+            for n in xrange(keys))
+        start = time()
+        index = keyindex.KeyIndex(listing)
+        build = time() - start
+        names = ["user{}@example.com".format(n) for n in xrange(0, keys, max(1, keys // 100))]
+        start = time()
+        fprs = index.resolve(names)
+        lookup = (time() - start) / len(names)
+        if len(fprs) != len(names):
+            stderr.write("index resolved {} of {} names\n".format(len(fprs), len(names)))
+            return 1
+        print "{:<22} keys={:<8} build={:8.2f} ms  per-email-lookup={:7.2f} us".format(
+            'recipient index', keys, build * 1000, lookup * 1e6)
+        keys *= 4
+    return 0
+
+
+#------------------------------------------------------------------ MATRIX
+
+# What each matrix worker runs: a fresh interpreter per case, so that peak RSS
+#   (ours & the engine children's) belongs to that case alone
+WORKER = ("import sys, json; sys.path.insert(0, sys.argv[1]); import bench; "
+          "print json.dumps(bench.run_case(json.load(sys.stdin)))")
+
+# Fields that identify a matrix case (for comparing result files)
+CASE_KEY = ('backend', 'action', 'crypto', 'cipher', 'digest', 'armor', 'mode', 'size')
+
+
+def matrix_cases(args, sizes):
+    """Yield a dict for every combination of the axes selected by args."""
+    ciphers = args.cipher or sorted(c for c in crypt_interface.OPENSSL_CIPHERS if c)
+    for backend in args.backend or ['gpg2', 'openssl']:
+        openssl = backend in {'openssl', 'native'}
+        for crypto in ['symmetric'] if openssl else args.crypto or ['symmetric', 'asymmetric']:
+            # Digests only matter when there's a signature
+            for digest in args.digest or ['sha256'] if crypto == 'signed' else [None]:
+                for cipher in ciphers:
+                    for armor in args.armor or [True, False]:
+                        for size in sizes:
+                            for mode in args.mode or ['text', 'file']:
+                                for action in args.action or ['enc', 'dec']:
+                                    yield dict(backend=backend, action=action,
+                                               crypto=crypto, cipher=cipher,
+                                               digest=digest, armor=armor,
+                                               mode=mode, size=size,
+                                               calls=args.calls)
+
+
+def case_opts(case, action):
+    """Return engine keyword args for case & action ('enc' or 'dec')."""
+    opts = dict(passwd='benchmark', base64=case['armor'], cipher=case['cipher'])
+    if case['backend'] in {'openssl', 'native'}:
+        return opts
+    if case['crypto'] == 'symmetric':
+        opts.update(symmetric=True)
+    else:
+        del opts['passwd']
+        if action == 'enc':
+            opts.update(asymmetric=True, recip=case['recipient'], alwaystrust=True)
+            if case['crypto'] == 'signed':
+                opts.update(encsign=True, digest=case['digest'])
+    return opts
+
+
+def run_case(case):
+    """Time one matrix case in this process; return its result record.
+    
+    Called by a worker interpreter (see WORKER). The first call is a warm-up and
+    isn't counted.
+    
+    """
+    from resource import getrusage, RUSAGE_SELF, RUSAGE_CHILDREN
+    record = dict((k, case[k]) for k in CASE_KEY)
+    x = load_engine(case['backend'])
+    opts = case_opts(case, case['action'])
+    output = join(case['workdir'], 'output')
+    if case['mode'] == 'text':
+        with open(case['input'], 'rb') as f:
+            data = f.read()
+    samples = []
+    for i in xrange(case['calls'] + 1):
+        if case['mode'] == 'text':
+            x.io.update(stdin=data, stdout='', infile=0, outfile=0)
+        else:
+            x.io.update(stdin='', stdout='', infile=case['input'], outfile=output)
+        seconds, rc = timed_call(x, case['action'], **opts)
+        if rc != 0:
+            record['error'] = "returncode {}".format(rc)
+            return record
+        if i:
+            samples.append(seconds)
+    ms = [s * 1000 for s in samples]
+    p50 = percentile(ms, 50)
+    record.update(
+        latency_ms=dict(min=min(ms), p50=p50, p95=percentile(ms, 95), max=max(ms),
+                        mean=sum(ms) / len(ms)),
+        throughput_mbs=case['size'] / 1e6 / (p50 / 1000) if p50 else None,
+        rss_kb=dict(pyrite=getrusage(RUSAGE_SELF).ru_maxrss,
+                    engine=getrusage(RUSAGE_CHILDREN).ru_maxrss))
+    return record
+
+
+def run_worker(case):
+    """Run case in a fresh interpreter; return its result record."""
+    p = Popen([executable, '-c', WORKER, dirname(abspath(__file__))],
+              stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    out, err = p.communicate(json.dumps(case))
+    try:
+        return json.loads(out)
+    except ValueError:
+        record = dict((k, case[k]) for k in CASE_KEY)
+        record['error'] = "worker failed: {}".format(err.strip().splitlines()[-1:])
+        return record
+
+
+def encrypt_for_case(case, workdir, payloads, cache):
+    """Return path of payload encrypted per case, or None if that can't be done.
+    
+    Decryption cases need it as input; encryption cases use it to find out up
+    front whether the cipher is available at all. Made once per combination.
+    
+    """
+    key = tuple(case[k] for k in CASE_KEY if k not in {'action', 'mode'})
+    if key not in cache:
+        path = join(workdir, 'encrypted-{}'.format(len(cache)))
+        x = load_engine(case['backend'])
+        x.io.update(stdin='', stdout='', infile=payloads[case['size']], outfile=path)
+        rc = crypt_interface.run_engine(x, 'enc', **case_opts(case, 'enc'))[0]
+        cache[key] = path if rc == 0 else None
+    return cache[key]
+
+
+def describe_case(r):
+    return "{} {} {}{} {} {} {} {}".format(
+        r['backend'], r['action'], r['crypto'], '/' + r['digest'] if r['digest'] else '',
+        r['cipher'], 'armor' if r['armor'] else 'binary', r['mode'], r['size'])
+
+
+def environment():
+    """Return dict describing what the benchmark ran on."""
+    import platform
+    import cfg
+    info = dict(pyrite=cfg.VERSION, python=platform.python_version(),
+                platform=platform.platform(), cpus=cpu_count(),
+                date=strftime('%Y-%m-%dT%H:%M:%S'))
+    for name, cmd in ('gpg', ['gpg2', '--version']), ('gpg', ['gpg', '--version']), (
+            'openssl', ['openssl', 'version']):
+        if name not in info:
+            try:
+                info[name] = Popen(cmd, stdout=PIPE, stderr=PIPE).communicate()[0].splitlines()[0]
+            except (OSError, IndexError):
+                pass
+    return info
+
+
+def bench_matrix(args):
+    """Throughput, latency & peak RSS across sizes, ciphers, digests, armor, crypto & modes."""
+    
+    sizes = [chunked.parse_size(s) for s in args.sizes.split(',')]
+    home = scratch_gnupghome()
+    workdir = mkdtemp(prefix='pyrite-bench-')
+    results = []
+    failed = 0
+    try:
+        recipient = None
+        if any(b not in {'openssl', 'native'} for b in args.backend or ['gpg2']):
+            recipient = generate_key()
+        payloads = {}
+        for size in sizes:
+            payloads[size] = join(workdir, 'payload-{}'.format(size))
+            make_payload(payloads[size], size)
+        encrypted = {}
+        for case in matrix_cases(args, sizes):
+            case.update(recipient=recipient, workdir=workdir)
+            ciphertext = encrypt_for_case(case, workdir, payloads, encrypted)
+            if ciphertext is None:
+                print "{:<60} skipped (unavailable)".format(describe_case(case))
+                continue
+            case['input'] = ciphertext if case['action'] == 'dec' else payloads[case['size']]
+            r = run_worker(case)
+            results.append(r)
+            if 'error' in r:
+                failed += 1
+                print "{:<60} FAILED: {}".format(describe_case(r), r['error'])
+                continue
+            print "{:<60} p50={:9.2f} ms  p95={:9.2f} ms  {:8.1f} MB/s  rss={}/{} KiB".format(
+                describe_case(r), r['latency_ms']['p50'], r['latency_ms']['p95'],
+                r['throughput_mbs'] or 0, r['rss_kb']['pyrite'], r['rss_kb']['engine'])
+    finally:
+        remove_gnupghome(home)
+        rmtree(workdir, ignore_errors=True)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(environment=environment(), args=vars(args), results=results),
+                      f, indent=1, sort_keys=True)
+            f.write('\n')
+    return 1 if failed else 0
+
+
+def bench_compare(args):
+    """Compare two matrix result files; fail if any case got slower than the threshold."""
+    
+    def load(path):
+        with open(path) as f:
+            doc = json.load(f)
+        return dict((tuple(r[k] for k in CASE_KEY), r) for r in doc['results']
+                    if 'error' not in r)
+    
+    old, new = load(args.old), load(args.new)
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        before = old[key]['latency_ms']['p50']
+        after = new[key]['latency_ms']['p50']
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print "{:<60} p50 {:9.2f} -> {:9.2f} ms  {:+7.1f}%{}".format(
+            describe_case(new[key]), before, after, change, flag)
+    for label, only in ('only in old', set(old) - set(new)), ('only in new', set(new) - set(old)):
+        if only:
+            print "{} cases {}".format(len(only), label)
+    return 1 if regressions else 0
+
+
+BENCHMARKS = dict(
+    aio=bench_aio,
+    compare=bench_compare,
+    fastpath=bench_fastpath,
+    keyindex=bench_keyindex,
+    latency=bench_latency,
+    matrix=bench_matrix,
+    native=bench_native,
+    status=bench_status,
+    startup=bench_startup)
+
+
+
+def main(argv):
+    """Entry point for 'pyrite bench' subcommand; return exit status."""
+    
+    parser = argparse.ArgumentParser(
+        prog='pyrite bench',
+        description="Benchmarks for Pyrite's gpg/openssl backends.")
+    
+    sub = parser.add_subparsers(dest='benchmark')
+    
+    p = sub.add_parser('latency', help=bench_latency.__doc__)
+    
+    p.add_argument('-n', '--calls', type=int, default=50,
+                   help="operations per backend (default: %(default)s)")
+    
+    p.add_argument('-s', '--size', type=int, default=1024,
+                   help="payload size in bytes (default: %(default)s)")
+    
+    p.add_argument('-b', '--backend', choices=('gpg2', 'gpg', 'openssl', 'native'),
+                   action='append',
+                   help="backend to measure; may be repeated (default: gpg2 & openssl)")
+    
+    p = sub.add_parser('fastpath', help=bench_fastpath.__doc__)
+    
+    p.add_argument('-n', '--calls', type=int, default=50,
+                   help="operations per action & profile (default: %(default)s)")
+    
+    p.add_argument('-s', '--size', type=int, default=256,
+                   help="payload size in bytes (default: %(default)s)")
+    
+    p.add_argument('-b', '--backend', choices=('gpg2', 'gpg'), default='gpg2',
+                   help="backend to measure (default: %(default)s)")
+    
+    p = sub.add_parser('native', help=bench_native.__doc__)
+    
+    p.add_argument('-n', '--calls', type=int, default=20,
+                   help="operations per cipher & engine (default: %(default)s)")
+    
+    p.add_argument('-s', '--size', type=int, default=1024,
+                   help="payload size in bytes (default: %(default)s)")
+    
+    p = sub.add_parser('status', help=bench_status.__doc__)
+    
+    p.add_argument('-l', '--lines', type=int, default=5000,
+                   help="status lines in the first (smallest) stream (default: %(default)s)")
+    
+    p.add_argument('--steps', type=int, default=4,
+                   help="number of stream sizes, each 4x the last (default: %(default)s)")
+    
+    p.add_argument('-n', '--repeat', type=int, default=3,
+                   help="parses per stream size; best is reported (default: %(default)s)")
+    
+    p = sub.add_parser('startup', help=bench_startup.__doc__)
+    
+    p.add_argument('-n', '--runs', type=int, default=10,
+                   help="fresh interpreters per case (default: %(default)s)")
+    
+    p.add_argument('-s', '--size', type=int, default=1024,
+                   help="size in bytes of the file to encrypt (default: %(default)s)")
+    
+    p = sub.add_parser('aio', help=bench_aio.__doc__)
+    
+    p.add_argument('-n', '--calls', type=int, default=100,
+                   help="operations per backend & concurrency level (default: %(default)s)")
+    
+    p.add_argument('-s', '--size', type=int, default=1024,
+                   help="payload size in bytes (default: %(default)s)")
+    
+    p.add_argument('-b', '--backend', choices=('gpg2', 'gpg', 'openssl'), action='append',
+                   help="backend to measure; may be repeated (default: openssl & gpg2)")
+    
+    p.add_argument('-c', '--concurrency', type=int, action='append',
+                   help="max running children; may be repeated (default: 1, 4, 16, 64)")
+    
+    p = sub.add_parser('keyindex', help=bench_keyindex.__doc__)
+    
+    p.add_argument('-k', '--keys', type=int, default=2500,
+                   help="keys in the first (smallest) keyring (default: %(default)s)")
+    
+    p.add_argument('--steps', type=int, default=3,
+                   help="number of keyring sizes, each 4x the last (default: %(default)s)")
+    
+    p = sub.add_parser('matrix', help=bench_matrix.__doc__)
+    
+    p.add_argument('-o', '--output', metavar='FILE',
+                   help="save results (plus versions & platform) as JSON")
+    
+    p.add_argument('-n', '--calls', type=int, default=3,
+                   help="timed operations per case, after one warm-up (default: %(default)s)")
+    
+    p.add_argument('-s', '--sizes', default='1K,1M,16M',
+                   help="comma-separated payload sizes, e.g. 1K,64M,4G (default: %(default)s)")
+    
+    p.add_argument('-b', '--backend', choices=('gpg2', 'gpg', 'openssl', 'native'),
+                   action='append',
+                   help="backend; may be repeated (default: gpg2 & openssl)")
+    
+    p.add_argument('-c', '--cipher', action='append',
+                   help="cipher (gpg-style name); may be repeated (default: all in the "
+                        "OpenSSL mapping table)")
+    
+    p.add_argument('-d', '--digest', action='append',
+                   help="digest for signed cases; may be repeated (default: sha256)")
+    
+    p.add_argument('--crypto', choices=('symmetric', 'asymmetric', 'signed'), action='append',
+                   help="gpg mode; may be repeated (default: symmetric & asymmetric; "
+                        "signed == asymmetric + signature)")
+    
+    p.add_argument('--armor', type=lambda s: s.lower() in {'1', 'yes', 'true', 'armor'},
+                   action='append', metavar='YES|NO',
+                   help="ascii-armored or binary; may be repeated (default: both)")
+    
+    p.add_argument('-m', '--mode', choices=('text', 'file'), action='append',
+                   help="data through Python pipes or engine reading files itself; "
+                        "may be repeated (default: both)")
+    
+    p.add_argument('-a', '--action', choices=('enc', 'dec'), action='append',
+                   help="may be repeated (default: both)")
+    
+    p = sub.add_parser('compare', help=bench_compare.__doc__)
+    
+    p.add_argument('old', help="earlier 'bench matrix -o' results")
+    
+    p.add_argument('new', help="later results")
+    
+    p.add_argument('-t', '--threshold', type=float, default=10.0,
+                   help="percent p50 latency increase counted as a regression "
+                        "(default: %(default)s)")
+    
+    args = parser.parse_args(argv)
+    return BENCHMARKS[args.benchmark](args)
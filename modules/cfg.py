@@ -23,25 +23,46 @@
 #
 #------------------------------------------------------------------------------
 
-import gtk
 from os import getenv
 
 # Important variables
 VERSION                 = 'v1.0.2'
 ASSETDIR                = '/usr/share/pyrite/'
 USERPREF_FILE           = getenv('HOME') + '/.pyrite'
-USERPREF_FORMAT_INFO    = {'version':'Must6fa'}
+USERPREF_FORMAT_INFO    = {'version':'Must8fp'}
+
+# gpg compression policy for each row of the Preferences compression combobox
+#   (see crypt_interface.compression_args)
+COMPRESSION             = ['auto', 'never', None, 1, 9]
+
+# Task Status keeps only this many lines of engine output, & redraws at most
+#   every TASK_STATUS_REFRESH ms; output pipes are read this many bytes at a time
+TASK_STATUS_MAXLINES    = 5000
+TASK_STATUS_REFRESH     = 200
+PIPE_READSIZE           = 65536
+
+# Gtk constants are given by name & looked up with gtk_constant() when needed,
+#   so that headless code can import cfg without loading GTK+
 
 # List of possible Infobar message types
 MSGTYPES = [0,
-            gtk.MESSAGE_INFO,      # 1
-            gtk.MESSAGE_QUESTION,  # 2
-            gtk.MESSAGE_WARNING,   # 3
-            gtk.MESSAGE_ERROR]     # 4
+            'MESSAGE_INFO',      # 1
+            'MESSAGE_QUESTION',  # 2
+            'MESSAGE_WARNING',   # 3
+            'MESSAGE_ERROR']     # 4
 
 # List of possible images to show in Infobar
-IMGTYPES = [gtk.STOCK_APPLY,            # 0
-            gtk.STOCK_DIALOG_INFO,      # 1
-            gtk.STOCK_DIALOG_QUESTION,  # 2
-            gtk.STOCK_DIALOG_WARNING,   # 3
-            gtk.STOCK_DIALOG_ERROR]     # 4
+IMGTYPES = ['STOCK_APPLY',            # 0
+            'STOCK_DIALOG_INFO',      # 1
+            'STOCK_DIALOG_QUESTION',  # 2
+            'STOCK_DIALOG_WARNING',   # 3
+            'STOCK_DIALOG_ERROR']     # 4
+
+
+
+def gtk_constant(name):
+    """Return gtk.<name> for a name from the lists above (other values pass through)."""
+    if not isinstance(name, basestring):
+        return name
+    import gtk
+    return getattr(gtk, name)
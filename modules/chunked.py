@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#
+# Chunked container format -- a huge file split into independently-encrypted
+# segments so that they can be en/decrypted on all cores, and so that a slice of
+# the plaintext can be restored without decrypting everything before it:
+#
+#   PYRITE-CHUNKED 2\n
+#   {"backend": ..., "nonce": X, "segsize": N, "segments": M, "size": S, ...}\n
+#   M index entries, each "<offset:016x> <length:016x>\n" (34 bytes)
+#   M segments, each a complete gpg or openssl message of segsize plaintext bytes
+#     (the last one may be shorter)
+#
+# The index has a fixed size, so it is reserved up front and filled in once all
+# segments have been written.
+#
+# Neither the header nor the index is encrypted, so each segment's plaintext
+# starts with a fixed-size prefix (see segment_prefix()) naming the container
+# (a random nonce), the segment's number and the container's geometry. It is
+# checked on decryption, so segments that were swapped, duplicated or spliced
+# in from another container are refused rather than yielding reordered data.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import argparse
+import json
+from sys import stderr
+from os import urandom
+from os.path import getsize
+from itertools import chain
+from threading import Semaphore
+from multiprocessing import cpu_count
+# Custom Modules:
+import crypt_interface
+import threadpool
+from batch import add_engine_arguments, engine_opts, worker_count, check_engine_arguments
+
+MAGIC           = 'PYRITE-CHUNKED 2\n'
+ENTRY_FORMAT    = '{:016x} {:016x}\n'
+ENTRY_LEN       = 34
+PREFIX_FORMAT   = 'PYRITE-SEGMENT {} {:016x} {:016x} {:016x} {:016x}\n'
+PREFIX_LEN      = 116
+SEGSIZE         = 64 * 1024 * 1024
+EXTENSION       = '.chunked'
+
+
+
+class ChunkedError(Exception):
+    pass
+
+
+
+def parse_size(text):
+    """Return number of bytes for text like '4096', '512K', '64M', '1G'."""
+    text = text.strip().upper()
+    for i, unit in enumerate('KMGT'):
+        if text.endswith(unit) or text.endswith(unit + 'B'):
+            return int(text.rstrip('B')[:-1]) * 1024 ** (i + 1)
+    return int(text)
+
+
+def read_range(path, offset, length, chunksize=crypt_interface.CHUNKSIZE):
+    """Yield the data of path[offset:offset+length] in chunksize pieces."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            data = f.read(min(chunksize, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+class Window:
+    """Cap how many segments a pool may have in flight (i.e., held in memory).
+    
+    Feed the pool with feed(iterable) and call done() once each result has been
+    written; call close() when bailing out early, or the thread feeding the pool
+    could be left waiting on us forever.
+    
+    """
+    
+    
+    def __init__(self, size):
+        self.semaphore  = Semaphore(size)
+        self.closed     = False
+    
+    
+    def feed(self, iterable):
+        for item in iterable:
+            self.semaphore.acquire()
+            if self.closed:
+                return
+            yield item
+    
+    
+    def done(self):
+        self.semaphore.release()
+    
+    
+    def close(self):
+        self.closed = True
+        self.semaphore.release()
+
+
+def segment_prefix(meta, i):
+    """Return the plaintext prefix of segment i of the container described by meta."""
+    return PREFIX_FORMAT.format(meta['nonce'], i, meta['segments'], meta['segsize'],
+                                meta['size'])
+
+
+def read_header(f):
+    """Return (meta dict, list of (offset, length) index entries) from open container f."""
+    if f.readline() != MAGIC:
+        raise ChunkedError("not a Pyrite chunked container")
+    try:
+        meta = json.loads(f.readline())
+    except ValueError:
+        raise ChunkedError("corrupt container header")
+    index = []
+    for i in xrange(meta['segments']):
+        entry = f.read(ENTRY_LEN)
+        try:
+            offset, length = entry.split()
+            index.append((int(offset, 16), int(length, 16)))
+        except ValueError:
+            raise ChunkedError("corrupt container index")
+    return meta, index
+
+
+
+class Chunked:
+    """En/decrypt chunked containers with a pool of gpg/openssl workers.
+    
+    opts are the engine keyword args (see crypt_interface.run_engine); workers
+    share one engine instance, each segment being a crypt_interface.Job, like Batch.
+    
+    """
+    
+    
+    def __init__(self, backend='gpg2', workers=None, native=False, **opts):
+        self.backend    = backend
+        self.workers    = workers or cpu_count()
+        self.native     = native
+        self.opts       = opts
+        # Fail early if backend is missing
+        self.x          = crypt_interface.new_engine(backend, native)
+    
+    
+    def crypt_segment(self, action, source, opts=None):
+        """Run action over source (string/iterator); return output."""
+        op = crypt_interface.Job(stdin=source)
+        returncode, errors = crypt_interface.run_engine(self.x, action, job=op,
+                                                        **(opts or self.opts))
+        if returncode != 0:
+            raise ChunkedError(errors.strip() or "{} failed".format(action))
+        return op.io['stdout']
+    
+    
+    def encrypt(self, infile, outfile, segsize=SEGSIZE):
+        """Encrypt infile into a new chunked container at outfile."""
+        
+        if infile == outfile:
+            raise ChunkedError("infile, outfile must be different")
+        size = getsize(infile)
+        nsegments = max(1, -(-size // segsize))
+        meta = dict(
+            backend='openssl' if self.backend == 'openssl' else 'gpg',
+            base64=self.opts.get('base64', True),
+            cipher=self.opts.get('cipher'),
+            nonce=urandom(16).encode('hex'),
+            segsize=segsize, segments=nsegments, size=size)
+        
+        def job(i):
+            return self.crypt_segment('enc', chain([segment_prefix(meta, i)],
+                                                   read_range(infile, i * segsize, segsize)))
+        
+        window = Window(self.workers * 2)
+        try:
+            with open(outfile, 'wb') as out:
+                out.write(MAGIC + json.dumps(meta, sort_keys=True) + '\n')
+                index_offset = out.tell()
+                out.write(ENTRY_FORMAT.format(0, 0) * nsegments)
+                index = []
+                # imap hands results back in order, so segments are laid out sequentially
+                for data in threadpool.imap(job, window.feed(xrange(nsegments)),
+                                            self.workers):
+                    index.append((out.tell(), len(data)))
+                    out.write(data)
+                    window.done()
+                out.seek(index_offset)
+                out.write(''.join(ENTRY_FORMAT.format(*e) for e in index))
+        finally:
+            window.close()
+        return meta
+    
+    
+    def decrypt(self, infile, outfile, start=0, length=None):
+        """Decrypt container infile (or just plaintext bytes [start:start+length]) to outfile.
+        
+        Only the segments overlapping the requested range get decrypted; they are
+        handled in parallel and written straight to their place in outfile.
+        
+        """
+        
+        if infile == outfile:
+            raise ChunkedError("infile, outfile must be different")
+        with open(infile, 'rb') as f:
+            meta, index = read_header(f)
+        
+        segsize, size = meta['segsize'], meta['size']
+        end = size if length is None else min(size, start + length)
+        if start >= end:
+            segments = []
+        else:
+            segments = range(start // segsize, (end - 1) // segsize + 1)
+        
+        opts = dict(self.opts)
+        if meta['backend'] == 'openssl':
+            # Needed to decrypt and not secret, so the container records them
+            opts.update(base64=meta['base64'], cipher=meta['cipher'])
+        
+        def job(i):
+            data = self.crypt_segment('dec', read_range(infile, *index[i]), opts)
+            if data[:PREFIX_LEN] != segment_prefix(meta, i):
+                raise ChunkedError("segment {} doesn't belong at this place in this "
+                                   "container".format(i))
+            seg_start = i * segsize
+            if len(data) - PREFIX_LEN != min(segsize, size - seg_start):
+                raise ChunkedError("segment {} has wrong length after decryption".format(i))
+            a, b = max(start, seg_start), min(end, seg_start + len(data) - PREFIX_LEN)
+            return a - start, data[PREFIX_LEN + a - seg_start:PREFIX_LEN + b - seg_start]
+        
+        window = Window(self.workers * 2)
+        try:
+            with open(outfile, 'wb') as out:
+                out.truncate(end - start if end > start else 0)
+                for offset, data in threadpool.imap_unordered(job, window.feed(segments),
+                                                              self.workers):
+                    out.seek(offset)
+                    out.write(data)
+                    window.done()
+        finally:
+            window.close()
+        return meta
+
+
+
+def main(argv):
+    """Entry point for 'pyrite chunked' subcommand; return exit status."""
+    
+    parser = argparse.ArgumentParser(
+        prog='pyrite chunked',
+        description="Headless: encrypt a huge file as independently-encrypted segments "
+                    "(using every core), or decrypt all or part of such a container.")
+    
+    parser.add_argument('action', choices=('enc', 'dec'),
+                        help="encrypt INPUT into a container, or decrypt a container")
+    
+    parser.add_argument('input', metavar='INPUT', help="input file")
+    
+    parser.add_argument('-o', '--output', metavar='OUTPUT',
+                        help="output file (default: INPUT{0} when encrypting, INPUT "
+                             "minus {0} when decrypting)".format(EXTENSION))
+    
+    parser.add_argument('-z', '--segment-size', default='64M',
+                        help="plaintext bytes per segment when encrypting, e.g.: 16M, 1G "
+                             "(default: %(default)s)")
+    
+    parser.add_argument('--range', metavar='START:END',
+                        help="when decrypting, only restore plaintext bytes START to END "
+                             "(either may be omitted; sizes like 10G are ok)")
+    
+    parser.add_argument('-j', '--workers', type=worker_count, default=cpu_count(),
+                        help="number of gpg/openssl processes to run at once "
+                             "(default: %(default)s)")
+    
+    add_engine_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    check_engine_arguments(parser, args)
+    
+    outfile = args.output
+    if not outfile:
+        if args.action == 'enc':
+            outfile = args.input + EXTENSION
+        elif args.input.endswith(EXTENSION):
+            outfile = args.input[:-len(EXTENSION)]
+        else:
+            parser.error("can't guess OUTPUT for INPUT without {} extension".format(EXTENSION))
+    
+    try:
+        chunked = Chunked(args.backend, args.workers, args.native, **engine_opts(args))
+        if args.action == 'enc':
+            chunked.encrypt(args.input, outfile, parse_size(args.segment_size))
+        else:
+            start, length = 0, None
+            if args.range:
+                a, b = args.range.split(':')
+                start = parse_size(a) if a else 0
+                if b:
+                    length = parse_size(b) - start
+            chunked.decrypt(args.input, outfile, start, length)
+    except (ChunkedError, ValueError, IOError, OSError) as e:
+        stderr.write("pyrite chunked: {}\n".format(e))
+        return 1
+    
+    stderr.write("pyrite chunked: wrote {}\n".format(outfile))
+    return 0
@@ -25,22 +25,23 @@
 
 # StdLib:
 import gtk
-gtk.gdk.threads_init()
 import glib
-glib.threads_init()
 from threading import Thread
 from sys import stderr
 from pango import FontDescription
 from os import access, R_OK, read, close, pipe
-from os.path import isfile
+from os.path import isfile, getsize
+from collections import deque
 from urllib import url2pathname
-from shlex import split
-from subprocess import check_output
 from time import sleep
 # Custom Modules:
 import cfg
 import prefs
 import crypt_interface
+import sniff
+import pager
+from progress import Progress
+from statusbuf import StatusBuffer
 from messages import MESSAGE_DICT
 
 # Important variables
@@ -65,6 +66,11 @@ class Pyrite:
     def __init__(self, cmdlineargs):
         """Build GUI interface from XML, etc."""        
         
+        # Engines run in threads; done here rather than at import time, so that
+        #   merely importing this module has no side effects
+        gtk.gdk.threads_init()
+        glib.threads_init()
+        
         # Use GtkBuilder to build our GUI from the XML file 
         builder = gtk.Builder()
         try: builder.add_from_file(cfg.ASSETDIR + 'ui/main.glade') 
@@ -122,6 +128,7 @@ class Pyrite:
         self.g_bsave        = builder.get_object('btn_save')
         self.g_bcopyall     = builder.get_object('btn_copyall')
         self.g_msgtxtview   = builder.get_object('textview1')
+        self.g_msgscroll    = builder.get_object('scrolledwindow1')
         self.buff           = self.g_msgtxtview.get_buffer()
         self.vbox_ibar      = builder.get_object('vbox_ibar')
         self.vbox_ibar2     = builder.get_object('vbox_ibar2')
@@ -150,6 +157,7 @@ class Pyrite:
         
         # Other class attributes
         self.ib_filemode    = None
+        self.pager          = None
         self.engine         = 'missing_backend'
         self.quiting        = False
         self.working_widgets_filemode = [
@@ -169,7 +177,7 @@ class Pyrite:
         #   that makes their icons stay insensitive-looking forever
         self.g_pass.set_sensitive           (False)
         self.g_recip.set_sensitive          (False)
-
+        
         #------------------------------ LOAD PREFERENCES AND SET WIDGET STATES!
         self.preferences = prefs.Preferences()
         
@@ -193,7 +201,7 @@ class Pyrite:
         #---------------------------------------------------- CMDLINE ARGUMENTS
         if cmdlineargs:
             a = cmdlineargs
-
+            
             if a.input:
                 # Direct-file mode arg broken until GtkFileChooserButton bug gets fixed
                 if a.direct_file:
@@ -224,8 +232,8 @@ class Pyrite:
         # Find the needed dictionary inside our message dict, by id
         MSG = MESSAGE_DICT[id]
         # Use value from MSG type & icon to lookup Gtk constant, e.g. gtk.MESSAGE_INFO
-        msgtype = cfg.MSGTYPES[ MSG['type'] ]
-        imgtype = cfg.IMGTYPES[ MSG['icon'] ]
+        msgtype = cfg.gtk_constant(cfg.MSGTYPES[ MSG['type'] ])
+        imgtype = cfg.gtk_constant(cfg.IMGTYPES[ MSG['icon'] ])
         # Replace variables in message text & change text color
         message = ("<span foreground='#2E2E2E'>" +
                    MSG['text'].format(filename=filename, customtext=customtext) +
@@ -300,7 +308,10 @@ class Pyrite:
             for w in self.g_encrypt, self.g_decrypt:  w.set_sensitive(False)
             class dummy:  pass
             self.x = dummy()
-            self.x.io = dict(stdin='', stdout='', gstatus=0, infile=0, outfile=0)
+        
+        # I/O etc of the current operation (or the file picked for direct-file mode);
+        #   kept apart from the engine, which only needs it while running one
+        self.job = crypt_interface.Job()
         
         # Get it done!
         if preferred in 'openssl':
@@ -356,7 +367,7 @@ class Pyrite:
         
         if self.p['opmode']:
             self.g_signverify.set_active    (True)
-
+        
         if not self.g_expander.get_expanded():
             self.g_expander.set_expanded    (self.p['expander'])
         
@@ -451,16 +462,20 @@ class Pyrite:
     
     
     def test_file_isbinary(self, filename):
-        """Utilize nix file cmd to determine if filename is binary or text."""
-        cmd = split("file -b -e soft '{}'".format(filename))
-        if check_output(cmd)[:4] in {'ASCI', 'UTF-'}:
-            return False
-        return True
+        """Determine if filename is binary or text (see sniff.is_binary)."""
+        try:
+            return sniff.is_binary(filename)
+        except (OSError, IOError):
+            return True
     
     
     def open_in_txtview(self, filename):
         """Replace contents of msg TextView's TextBuffer with contents of file."""
         try:
+            if getsize(filename) > pager.LARGE_FILE:
+                # Too big for a TextBuffer; work on it directly instead
+                self.open_large_file(filename)
+                return
             with open(filename) as f:  self.buff.set_text(f.read())
             if self.buff.get_char_count() < 1:
                 self.infobar('txtview_fileopen_binary_error')
@@ -468,6 +483,78 @@ class Pyrite:
             self.infobar('txtview_fileopen_error', filename)
     
     
+    def open_large_file(self, filename):
+        """Open filename in direct-file mode, with a paged preview in the Message area."""
+        self.initiate_filemode(filename)
+        if not self.ib_filemode:
+            return
+        self.g_chooserbtn.set_filename(filename)
+        self.pager = pager.FilePager(filename)
+        # Page numbers of first & last pages in buffer, & length (chars) of each
+        self.pager_first = self.pager_last = 0
+        text = self.pager.page(0)
+        self.pager_lengths = deque([len(text)])
+        self.buff.set_text(text)
+        self.pager_busy = False
+        vadj = self.g_msgscroll.get_vadjustment()
+        self.pager_handler = vadj.connect('value-changed', self.pager_scrolled)
+        self.infobar('txtview_largefile_filemode', filename,
+                     customtext="{:.1f} MiB".format(self.pager.size / 1048576.0))
+    
+    
+    def close_pager(self):
+        """Stop paged preview started by open_large_file, if any, and empty Message area."""
+        if not self.pager:
+            return
+        self.g_msgscroll.get_vadjustment().disconnect(self.pager_handler)
+        self.pager.close()
+        self.pager = None
+        self.buff.set_text('')
+    
+    
+    # CB for vadjustment value-changed, connected by open_large_file()
+    def pager_scrolled(self, vadj):
+        """Page in more of the preview near either end of it; drop pages at the other end."""
+        
+        if self.pager_busy:
+            return
+        self.pager_busy = True
+        value, page = vadj.get_value(), vadj.get_page_size()
+        
+        if (value + 2 * page >= vadj.get_upper() and
+                self.pager_last + 1 < self.pager.npages):
+            # Near the bottom: append next page
+            self.pager_last += 1
+            text = self.pager.page(self.pager_last)
+            self.pager_lengths.append(len(text))
+            self.buff.insert(self.buff.get_end_iter(), text)
+            if len(self.pager_lengths) > pager.WINDOW_PAGES:
+                # Drop first page, scrolling up by its height so the view doesn't jump
+                end = self.buff.get_iter_at_offset(self.pager_lengths.popleft())
+                height = self.g_msgtxtview.get_iter_location(end).y
+                self.buff.delete(self.buff.get_start_iter(), end)
+                self.pager_first += 1
+                vadj.set_value(max(0, value - height))
+        
+        elif value <= page and self.pager_first > 0:
+            # Near the top: prepend previous page
+            self.pager_first -= 1
+            text = self.pager.page(self.pager_first)
+            self.pager_lengths.appendleft(len(text))
+            self.buff.insert(self.buff.get_start_iter(), text)
+            height = self.g_msgtxtview.get_iter_location(
+                self.buff.get_iter_at_offset(len(text))).y
+            if len(self.pager_lengths) > pager.WINDOW_PAGES:
+                # Drop last page
+                start = self.buff.get_iter_at_offset(
+                    self.buff.get_char_count() - self.pager_lengths.pop())
+                self.buff.delete(start, self.buff.get_end_iter())
+                self.pager_last -= 1
+            vadj.set_value(value + height)
+        
+        self.pager_busy = False
+    
+    
     # This is called when entering & exiting direct-file mode
     def filemode_enablewidgets(self, x=True):
         """Enable/disable certain widgets due to working in direct-file mode."""
@@ -490,7 +577,7 @@ class Pyrite:
     def confirm_overwrite_callback(self, chooser):
         """In filechooser, disallow output file being the input file."""
         outfile = chooser.get_filename()
-        if self.x.io['infile'] == outfile:
+        if self.job.io['infile'] == outfile:
             self.show_errmsg(
                 "Simultaneously reading from & writing to a file is a baaad idea. "
                 "Choose a different output filename.", parent=chooser)
@@ -544,19 +631,22 @@ class Pyrite:
         """Use FileChooser to get an output filename for direct enc/dec."""
         
         # Prompt for output file
-        outfile = self.chooser_grab_filename('save', self.x.io['infile'])
+        outfile = self.chooser_grab_filename('save', self.job.io['infile'])
         
         # Kick off processing unless user canceled
         if outfile:
-            self.x.io['outfile'] = outfile
+            self.job.io['outfile'] = outfile
             self.launchxface(mode)
     
     
-    def initiate_filemode(self):
-        """Ensure read access of file set by chooserwidget and notify user of next steps."""
+    def initiate_filemode(self, infile=None):
+        """Ensure read access of file set by chooserwidget (or infile) and notify user of next steps."""
+        
+        # Stop previewing the previous large file, if any
+        self.close_pager()
         
         # Prompt for filename but err out if file can't be read
-        infile = self.g_chooserbtn.get_filename()
+        infile = infile or self.g_chooserbtn.get_filename()
         if not access(infile, R_OK):
             self.infobar('filemode_fileopen_error', infile)
             return
@@ -600,11 +690,12 @@ class Pyrite:
         self.ib_filemode = self.infobar('filemode_blue_banner', infile, vbox=self.vbox_ibar2)
         
         # Set input file
-        self.x.io['infile'] = infile
+        self.job.io['infile'] = infile
     
     
     def cleanup_filemode(self, *args):
         """Revert the changes (to widgets, etc) that filemode causes."""
+        self.close_pager()
         # Restore message buffer
         self.buff.set_text(self.filemode_saved_buff)
         del self.filemode_saved_buff
@@ -624,12 +715,12 @@ class Pyrite:
         #while gtk.events_pending():
         gtk.main_iteration()
         # Reset filenames
-        self.x.io['infile'] = 0
-        self.x.io['outfile'] = 0
+        self.job.io['infile'] = 0
+        self.job.io['outfile'] = 0
         # Disable plaintext CheckButton
         self.g_plaintext.set_sensitive      (False)
         self.g_plaintext.set_active         (True)
-            
+    
     
     #--------------------------------------------------- HERE BE GTK SIGNAL CBs
     
@@ -637,10 +728,10 @@ class Pyrite:
     def action_quit(self, w):
         """Shutdown application and any child process."""
         self.quiting = True
-        if self.x.childprocess and self.x.childprocess.returncode == None:
+        if self.job.childprocess and self.job.childprocess.returncode == None:
             if self.paused:
-                self.x.childprocess.send_signal(SIGCONT)
-            self.x.childprocess.terminate()
+                self.job.childprocess.send_signal(SIGCONT)
+            self.job.childprocess.terminate()
             stderr.write("<Quiting>\n")
             #sleep(0.2)
         gtk.main_quit()
@@ -710,25 +801,25 @@ class Pyrite:
                 # If success, destroy pref window, import new prefs, show infobar
                 self.preferences.window.destroy()
                 self.p = self.preferences.p
-                if self.x.io['infile']:  self.cleanup_filemode()
+                if self.job.io['infile']:  self.cleanup_filemode()
                 self.instantiate_xface(startup=True)
                 self.infobar('preferences_apply_success', cfg.USERPREF_FILE)
         
         # Connect signals
         self.preferences.btn_save.connect  ('clicked', savepref)
         self.preferences.btn_apply.connect ('clicked', applypref)
-        
+    
     
     # Called by Clear toolbar btn or menu item
     def action_clear(self, w):
         """Reset Statusbar, filemode stuff, TextView buffers."""
-        if self.x.io['infile']:
+        if self.job.io['infile']:
             self.cleanup_filemode()
         else:
             self.set_stdstatus()
         self.buff.set_text                  ('')
         self.buff2.set_text                 ('')
-        self.x.io = dict(stdin='', stdout='', gstatus=0, infile=0, outfile=0)
+        self.job = crypt_interface.Job()
     
     
     # Called when user clicks the entry_icon in any of the entry widgets
@@ -985,7 +1076,7 @@ class Pyrite:
             # Sensitize sigmode combobox
             self.g_sigmode.set_sensitive    (True)
             # Set sigmode combobox via user prefs
-            if self.x.io['infile']:
+            if self.job.io['infile']:
                 self.g_sigmode.set_active       (self.p['file_sigmode'])
                 self.g_chk_outfile.set_visible  (True)
             else:
@@ -1019,7 +1110,7 @@ class Pyrite:
     # Called by 'Add Signature' checkbox toggle
     def action_toggle_signature(self, w):
         """Hide/show some widgets when toggling adding of a signature to input."""
-
+        
         sig_widgets = [self.g_sigmode, self.g_digest, self.g_digestlabel]
         
         if w.get_active():
@@ -1065,11 +1156,11 @@ class Pyrite:
         self.g_progbar.set_text ("Canceling Operation...")
         self.g_activityspin.stop()
         gtk.main_iteration()
-        while not self.x.childprocess:
+        while not self.job.childprocess:
             gtk.main_iteration()
         if self.paused:
-            self.x.childprocess.send_signal(SIGCONT)
-        self.x.childprocess.terminate()
+            self.job.childprocess.send_signal(SIGCONT)
+        self.job.childprocess.terminate()
         self.show_working_progress(False)
     
     
@@ -1078,7 +1169,7 @@ class Pyrite:
         """Suspend/resume gpg/openssl subprocess with SIGSTOP/SIGCONT."""
         
         # We can't pause childprocess until it actually starts
-        while not self.x.childprocess:
+        while not self.job.childprocess:
             gtk.main_iteration()
         
         if self.paused:
@@ -1088,7 +1179,7 @@ class Pyrite:
             btn.set_relief          (gtk.RELIEF_NONE)
             self.g_progbar.set_text ("{} working...".format(self.engine))
             self.g_activityspin.start()
-            self.x.childprocess.send_signal(SIGCONT)
+            self.job.childprocess.send_signal(SIGCONT)
         else:
             # Time to pause
             stderr.write            ("<Pausing>\n")
@@ -1096,15 +1187,20 @@ class Pyrite:
             btn.set_relief          (gtk.RELIEF_NORMAL)
             self.g_progbar.set_text ("Operation PAUSED")
             self.g_activityspin.stop()
-            self.x.childprocess.send_signal(SIGSTOP)
+            self.job.childprocess.send_signal(SIGSTOP)
     
     
     #------------------------------------------------------ MAIN XFACE FUNCTION
     def launchxface(self, action):
-        """Manage I/O between Gtk objects and our GpgXface or OpensslXface object."""
+        """Manage I/O between Gtk objects and our GpgXface or OpensslXface object.
+        
+        Prepares args & widgets and starts the engine in a thread, then returns to
+        the GTK+ main loop; launchxface_complete() takes over when the child is done.
+        
+        """
         self.canceled       = False
         self.paused         = False
-        self.x.childprocess = None
+        self.job.childprocess = None
         
         ### PREPARE Xface ARGS
         passwd      = None
@@ -1120,15 +1216,24 @@ class Pyrite:
                     return
                 passwd = None  # If passwd was '' , set to None, which will trigger gpg-agent if necessary
         
+        # Look up recipients now, so bad names are reported before anything starts
+        if (action in 'enc' and self.engine not in 'OpenSSL' and
+                self.g_asymmetric.get_active() and self.g_recip.get_text()):
+            try:
+                self.x.session.resolve_recipients(self.g_recip.get_text())
+            except crypt_interface.RecipientError as e:
+                self.infobar('x_bad_recip', customtext=glib.markup_escape_text(str(e)))
+                return
+        
         # INTERLUDE: If operating in textinput mode, check for input text
-        if not self.x.io['infile']:
+        if not self.job.io['infile']:
             # Make sure textview has a proper message in it
             if self.test_msgbuff_isempty("Input your message text first."):
                 return False
             # Make TextView immutable to changes
             self.g_msgtxtview.set_sensitive(False)
             self.fix_msgtxtviewcolor(False)
-            
+        
         # enctoself
         enctoself = self.g_enctoself.get_active()
         # recip
@@ -1151,25 +1256,20 @@ class Pyrite:
         # alwaystrust (setting True would allow encrypting to untrusted keys,
         #   which is how the nautilus-encrypt tool from seahorse-plugins works)
         alwaystrust = True
+        # compress (per Preferences; 'auto' skips compressing already-compressed input)
+        compress = cfg.COMPRESSION[self.p['compress']]
+        # fastpath (per Preferences; no trustdb check etc by gpg on every operation)
+        fastpath = self.p['fastpath']
         # localuser
         if self.g_chk_defkey.get_active():
             localuser = self.g_defaultkey.get_text()
             if not localuser:  localuser = None
         
         # INITIAL FILE INPUT MODE PREP
-        if self.x.io['infile'] and not self.x.io['outfile']:
+        if self.job.io['infile'] and not self.job.io['outfile']:
             
-            if base64 or action in 'clearsign':
-                outfile = self.x.io['infile'] + '.asc'
-            elif self.engine in 'OpenSSL':
-                outfile = self.x.io['infile']
-            elif action in 'detachsign':
-                outfile = self.x.io['infile'] + '.sig'
-            else:
-                outfile = self.x.io['infile'] + '.gpg'
-            
-            if action in 'dec':
-                outfile = self.x.io['infile'][:-4]
+            outfile = crypt_interface.default_outfile(
+                self.job.io['infile'], action, base64, self.engine)
             
             if action not in 'verify':
                 if self.g_signverify.get_active() and not self.g_chk_outfile.get_active():
@@ -1177,16 +1277,16 @@ class Pyrite:
                 else:
                     outfile = self.chooser_grab_filename('save', outfile)
                     if outfile:
-                        self.x.io['outfile'] = outfile
+                        self.job.io['outfile'] = outfile
                     else:
                         return
-
+            
             working_widgets = self.working_widgets_filemode
             for w in working_widgets:  w.set_sensitive(False)
             self.ib_filemode.hide()
         
         # FILE INPUT MODE PREP WHEN ALREADY HAVE OUTPUT FILE
-        elif self.x.io['infile'] and self.x.io['outfile']:
+        elif self.job.io['infile'] and self.job.io['outfile']:
             
             working_widgets = self.working_widgets_filemode
             for w in working_widgets:  w.set_sensitive(False)
@@ -1199,52 +1299,64 @@ class Pyrite:
             for w in working_widgets:  w.set_sensitive(False)
             
             # Save textview buffer to Xface stdin
-            self.x.io['stdin'] = self.buff.get_text(self.buff.get_start_iter(),
+            self.job.io['stdin'] = self.buff.get_text(self.buff.get_start_iter(),
                                                     self.buff.get_end_iter())
         
         # Set working status + spinner + progress bar
         self.show_working_progress(True, action)
-        # Clear Task Status
+        # Clear Task Status; output is collected in a StatusBuffer & drawn by a timer
         self.buff2.set_text('')
+        self.task_status = StatusBuffer(cfg.TASK_STATUS_MAXLINES)
+        self.status_timer = glib.timeout_add(cfg.TASK_STATUS_REFRESH, self.flush_task_status)
+        
+        # Completion is event-driven: launchxface_complete() runs once the engine
+        #   thread has returned AND every pipe we're watching has hit EOF
+        self.xface_pending = 2
+        self.xface_complete_args = (action, working_widgets, cipher, asymmetric,
+                                    recip, enctoself)
+        self.job.progress = Progress()
+        self.g_progbar.set_fraction(0.0)
+        self.pulse_timer = glib.timeout_add(100, self.pulse_progbar)
         
         # Setup stderr file descriptors & update task status while processing
-        self.x.io['stderr'] = pipe()
+        self.job.io['stderr'] = pipe()
         glib.io_add_watch(
-            self.x.io['stderr'][0],
+            self.job.io['stderr'][0],
             glib.IO_IN | glib.IO_HUP,
             self.update_task_status)
         
         if self.engine in 'OpenSSL':
             # ATTEMPT EN-/DECRYPTION w/OPENSSL
             Thread(
-                target=self.x.openssl,
-                args=(action, passwd, base64, cipher)
+                target=self.xface_thread,
+                args=(self.x.openssl, action, passwd, base64, cipher)
                 ).start()
         
         else:
             # GPG
             if verbose:
                 # Setup gpg-status file descriptors & update terminal while processing
-                self.x.io['gstatus'] = pipe()
+                self.xface_pending += 1
+                self.job.io['gstatus'] = pipe()
                 glib.io_add_watch(
-                    self.x.io['gstatus'][0],
+                    self.job.io['gstatus'][0],
                     glib.IO_IN | glib.IO_HUP,
                     self.update_task_status, 'term')
+            else:
+                self.job.io['gstatus'] = 0
             # ATTEMPT EN-/DECRYPTION w/GPG
             Thread(
-                target=self.x.gpg,
-                args=(action, encsign, digest, localuser, base64, symmetric, passwd,
-                      asymmetric, recip, enctoself, cipher, verbose, alwaystrust)
+                target=self.xface_thread,
+                args=(self.x.gpg, action, encsign, digest, localuser, base64, symmetric,
+                      passwd, asymmetric, recip, enctoself, cipher, verbose, alwaystrust,
+                      True, compress, False, fastpath)
                 ).start()
+    
+    
+    # Called (via xface_step_done) when gpg/openssl has finished or been canceled
+    def launchxface_complete(self, action, working_widgets, cipher, asymmetric, recip, enctoself):
+        """Restore widgets & report results of the operation started by launchxface."""
         
-        # Wait for subprocess to finish or for Cancel button to be clicked
-        c = 0
-        while not self.x.childprocess or self.x.childprocess.returncode == None:
-            if self.canceled:  break
-            if c % 15 == 0 and not self.paused:
-                self.g_progbar.pulse()
-            gtk.main_iteration()
-            c += 1
         if self.quiting:
             # If application is shutting down
             return
@@ -1252,11 +1364,16 @@ class Pyrite:
         for w in working_widgets:  w.set_sensitive(True)
         self.show_working_progress(False)
         
+        if self.job.childprocess:
+            returncode = self.job.childprocess.returncode
+        else:
+            returncode = None  # Engine failed before it could even launch
+        
         # FILE INPUT MODE CLEANUP
-        if self.x.io['infile']:
+        if self.job.io['infile']:
             
             if self.canceled:  # User Canceled!
-            
+                
                 self.ib_filemode.show()
                 
                 if action in {'enc', 'dec'}:
@@ -1265,22 +1382,22 @@ class Pyrite:
                     action = "Sign"
                 elif action in 'verify':
                     action = action.title()
-                    
+                
                 self.infobar('x_canceled_filemode', customtext=action)
             
-            elif self.x.childprocess.returncode == 0:  # File Success!
-
+            elif returncode == 0:  # File Success!
+                
                 if self.engine in 'OpenSSL' and action in 'enc':
-                    self.infobar('x_opensslenc_success_filemode', self.x.io['outfile'], cipher)
-
+                    self.infobar('x_opensslenc_success_filemode', self.job.io['outfile'], cipher)
+                
                 elif action in {'enc', 'dec'}:
-                    self.infobar('x_crypt_success_filemode', self.x.io['outfile'], action)
+                    self.infobar('x_crypt_success_filemode', self.job.io['outfile'], action)
                 
                 elif action in {'embedsign', 'clearsign'}:
-                    self.infobar('x_sign_success_filemode', self.x.io['outfile'])
+                    self.infobar('x_sign_success_filemode', self.job.io['outfile'])
                 
                 elif action in 'detachsign':
-                    self.infobar('x_detachsign_success_filemode', self.x.io['outfile'])
+                    self.infobar('x_detachsign_success_filemode', self.job.io['outfile'])
                 
                 elif action in 'verify':
                     self.infobar('x_verify_success')
@@ -1317,17 +1434,17 @@ class Pyrite:
                     action = "Sign"
                 elif action in 'verify':
                     action = action.title()
-                    
+                
                 self.infobar('x_canceled_textmode', customtext=action)
             
-            elif self.x.childprocess.returncode == 0:  # Text Success!
+            elif returncode == 0:  # Text Success!
                 
                 if action in 'verify':
                     self.infobar('x_verify_success')
                 else:
                     # Set TextBuffer to gpg stdout
-                    self.buff.set_text(self.x.io['stdout'])
-                    self.x.io['stdout'] = 0
+                    self.buff.set_text(self.job.io['stdout'])
+                    self.job.io['stdout'] = 0
                     if self.engine in 'OpenSSL' and action in 'enc':
                         self.infobar('x_opensslenc_success_textmode', customtext=cipher)
             
@@ -1348,26 +1465,89 @@ class Pyrite:
     
     #------------------------------------------ HELPERS FOR MAIN XFACE FUNCTION
     
+    # Thread target set up by launchxface()
+    def xface_thread(self, method, *args):
+        """Run Xface method in this thread, then notify main loop that it's done."""
+        try:
+            method(*args, job=self.job)
+        except Exception as e:
+            stderr.write("Engine error: {}\n".format(e))
+            # Engine bailed before closing its ends of our pipes; close them so
+            #   the watchers see EOF
+            for fds in self.job.io['stderr'], self.job.io.get('gstatus'):
+                if fds:
+                    try: close(fds[1])
+                    except OSError: pass
+        finally:
+            glib.idle_add(self.xface_step_done)
+    
+    
+    # CB for glib.idle_add() + called by update_task_status()
+    def xface_step_done(self):
+        """Count down launchxface's pending events; call its continuation at zero."""
+        self.xface_pending -= 1
+        if self.xface_pending == 0:
+            glib.source_remove(self.pulse_timer)
+            glib.source_remove(self.status_timer)
+            self.flush_task_status()
+            self.launchxface_complete(*self.xface_complete_args)
+        return False
+    
+    
+    # CB for glib.timeout_add()
+    def pulse_progbar(self):
+        """Show progress of gpg/openssl (or just pulse if that's unknown) unless paused."""
+        if not self.paused:
+            p = self.job.progress.snapshot()
+            if p['fraction'] is not None and p['bytes']:
+                self.g_progbar.set_fraction(p['fraction'])
+                self.g_progbar.set_text("{} working... {}".format(
+                    self.engine, self.job.progress.describe()))
+            else:
+                self.g_progbar.pulse()
+        return True
+    
+    
     # CB for glib.io_add_watch()
     def update_task_status(self, fd, condition, output='task'):
-        """Read data waiting in file descriptor; close fd if other end hangs up."""
-        
-        # If there's data to be read, let's read it
-        if condition == glib.IO_IN:
-            if output in 'task':
-                # Output to Task Status
-                self.buff2.insert(self.buff2.get_end_iter(), read(fd, 1024))
-            else:
-                # Output to stderr (will show if run from terminal)
-                stderr.write(read(fd, 1024))
+        """Read data waiting in file descriptor; close fd once it hits EOF."""
+        
+        # If there's data to be read, let's read it (IO_IN & IO_HUP can arrive together)
+        if condition & glib.IO_IN:
+            data = read(fd, cfg.PIPE_READSIZE)
+            if data:
+                if output in 'task':
+                    # Collect for Task Status (flush_task_status() draws it)
+                    self.task_status.feed(data)
+                else:
+                    # Output to stderr (will show if run from terminal)
+                    stderr.write(data)
+                return True
+        
+        # Pipe is drained & other end hung up: close our fd and destroy the watcher
+        if output in 'term':
+            stderr.write("\n")
+        close(fd)
+        self.xface_step_done()
+        return False
+    
+    
+    # CB for glib.timeout_add() + called by xface_step_done()
+    def flush_task_status(self):
+        """Draw output collected since last call in Task Status, keeping it to the line cap."""
+        if not self.task_status.pending():
             return True
-        
-        # If other end of pipe hangs up, close our fd and destroy the watcher
-        elif condition == glib.IO_HUP:
-            if output in 'term':
-                stderr.write("\n")
-            close(fd)
-            return False
+        replace, text = self.task_status.take()
+        if replace:
+            self.buff2.set_text(text)
+        else:
+            self.buff2.insert(self.buff2.get_end_iter(), text)
+            # Drop lines off the top once over the cap
+            excess = self.buff2.get_line_count() - cfg.TASK_STATUS_MAXLINES - 1
+            if excess > 0:
+                self.buff2.delete(self.buff2.get_start_iter(),
+                                  self.buff2.get_iter_at_line(excess))
+        return True
     
     
     # Called when gpg/openssl begins and ends processing
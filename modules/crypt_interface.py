@@ -24,10 +24,48 @@
 #------------------------------------------------------------------------------
 
 from sys import stderr
-from os import pipe, write, close
-from shlex import split
-from subprocess import Popen, PIPE, check_output
+from os import pipe, write, close, read, environ, stat, unlink
+from os.path import expanduser, join, isfile
+from tempfile import mkdtemp
+from shutil import copy2, rmtree
+import atexit
 from time import sleep
+import re
+from subprocess import Popen, PIPE, check_output
+from signal import SIGTERM, SIGCONT
+from threading import Thread, Lock
+from itertools import chain
+from fcntl import fcntl, F_GETFD, F_SETFD, FD_CLOEXEC
+# Custom Modules:
+from gpg_status import StatusParser
+from keyindex import KeyIndex, RecipientError, read_groups
+import sniff
+from progress import watch_child_input
+
+# Size of each read/write when streaming data through a child process
+CHUNKSIZE = 64 * 1024
+
+# Seconds between trustdb checks run in the background for fastpath operations,
+#   which tell gpg not to check it itself (see GpgSession.maintain_trustdb)
+TRUSTDB_INTERVAL = 6 * 3600
+
+# Map gpg-style cipher names (as shown in the GUI) to openssl enc cipher names
+OPENSSL_CIPHERS = {
+    None:           'aes-256-cbc',
+    '3des':         'des-ede3-cbc',
+    'cast5':        'cast5-cbc',
+    'blowfish':     'bf-cbc',
+    'aes':          'aes-128-cbc',
+    'aes192':       'aes-192-cbc',
+    'aes256':       'aes-256-cbc',
+    'camellia128':  'camellia-128-cbc',
+    'camellia192':  'camellia-192-cbc',
+    'camellia256':  'camellia-256-cbc'}
+
+# Serializes pipe creation + process creation so that, when several engines run
+#   in parallel threads, no child inherits another child's pipes (which would
+#   hold them open and delay everyone's EOF)
+_spawn_lock = Lock()
 
 
 
@@ -38,6 +76,652 @@ def flatten_list_to_stderr(list):
     stderr.write("\n\n")
 
 
+def get_fileno(obj):
+    """Return os-level file descriptor behind obj, or None if it has none."""
+    try:
+        return obj.fileno()
+    except (AttributeError, IOError, ValueError):
+        return None
+
+
+def set_cloexec(fd, cloexec=True):
+    """Set or clear the close-on-exec flag of file descriptor fd."""
+    flags = fcntl(fd, F_GETFD)
+    if cloexec:
+        fcntl(fd, F_SETFD, flags | FD_CLOEXEC)
+    else:
+        fcntl(fd, F_SETFD, flags & ~FD_CLOEXEC)
+
+
+def cloexec_pipe():
+    """Return a pipe() tuple whose ends won't leak into unrelated children.
+    
+    Use this instead of os.pipe() when engines might be run from more than one
+    thread; spawn_child() takes care of handing the right ends to the right child.
+    
+    """
+    with _spawn_lock:
+        fds = pipe()
+        for fd in fds:
+            set_cloexec(fd)
+    return fds
+
+
+def drain_fd(fd, sink, chunksize=CHUNKSIZE, errors=None):
+    """Read fd until EOF, passing data to sink (e.g., somelist.append); then close fd.
+    
+    EOF arrives once every holder of the pipe's write end has closed it, i.e.,
+    once the child has exited and the engine has closed its own copy -- so a
+    joined drain_fd thread means the stream has been read in its entirety.
+    
+    If sink raises, the rest of the stream is read & thrown away (so the child
+    can't block on a full pipe) and the exception is described in errors (a list).
+    
+    """
+    try:
+        while True:
+            data = read(fd, chunksize)
+            if not data:
+                break
+            if sink:
+                try:
+                    sink(data)
+                except Exception as e:
+                    sink = None
+                    if errors is not None:
+                        errors.append("{}\n".format(e))
+    finally:
+        close(fd)
+
+
+def openssl_cipher(cipher):
+    """Return openssl name for gpg-style cipher name (unknown names pass through)."""
+    if cipher:  cipher = cipher.lower()
+    return OPENSSL_CIPHERS.get(cipher, cipher)
+
+
+def new_engine(backend='gpg2', native=False):
+    """Return a quiet Gpg, Openssl or (if native) NativeOpenssl instance for backend name."""
+    if backend == 'openssl' and native:
+        import openssl_native
+        return openssl_native.NativeOpenssl(show_version=False)
+    elif backend == 'openssl':
+        return Openssl(show_version=False)
+    return Gpg(show_version=False, firstchoice=backend)
+
+
+def needs_secret_key(action, encsign=False):
+    """Return True if gpg action (as for Gpg.gpg()) uses a secret key."""
+    return action in {'dec', 'embedsign', 'clearsign', 'detachsign'} or (
+        action == 'enc' and encsign)
+
+
+def run_engine(x, action, job=None, **opts):
+    """Run one operation synchronously on engine x (per job.io); return (returncode, stderr).
+    
+    For headless callers: sets up job.io['stderr'] and drains it in a helper
+    thread. job is a Job; if None, the engine's own io etc are used (see Job).
+    opts are Gpg.gpg() keyword args; only passwd, base64 & cipher are used for
+    openssl. returncode is None if the engine couldn't even launch.
+    
+    With gpg, its status output is parsed along the way and the GpgResult is left
+    in job.status (see gpg_status); openssl has no such thing, so it's None.
+    
+    """
+    job = job or x
+    job.io['stderr'] = cloexec_pipe()
+    job.childprocess = None
+    job.status = None
+    errors = []
+    drainers = [Thread(target=drain_fd, args=(job.io['stderr'][0], errors.append))]
+    if isinstance(x, Gpg):
+        job.io['gstatus'] = cloexec_pipe()
+        parser = StatusParser()
+        drainers.append(Thread(target=drain_fd, args=(job.io['gstatus'][0], parser.feed),
+                               kwargs=dict(errors=errors)))
+    for t in drainers:
+        t.daemon = True
+        t.start()
+    try:
+        if isinstance(x, Openssl):
+            x.openssl(action, opts.get('passwd'), opts.get('base64', True), opts.get('cipher'),
+                      job=job)
+        else:
+            x.gpg(action=action, job=job, **opts)
+    except Exception as e:
+        errors.append("{}\n".format(e))
+        # Engine bailed before closing its ends of the pipes; do it so drainers see EOF
+        for fds in job.io['stderr'], job.io.get('gstatus'):
+            if fds:
+                try: close(fds[1])
+                except OSError: pass
+    for t in drainers:
+        t.join()
+    if isinstance(x, Gpg):
+        job.status = parser.close()
+        job.io['gstatus'] = 0
+    returncode = job.childprocess.returncode if job.childprocess else None
+    return returncode, ''.join(errors)
+
+
+def default_outfile(infile, action, base64=True, engine='gpg'):
+    """Return the output filename Pyrite suggests for infile + action.
+    
+    Encrypted/signed output gets .asc if ascii-armored, otherwise .gpg (.sig for
+    detached signatures, .enc for OpenSSL). Decrypting strips the last 4 chars
+    (i.e., the extension added when encrypting). Verifying produces no output.
+    
+    """
+    if action in 'verify':
+        return None
+    if action in 'dec':
+        return infile[:-4]
+    if base64 or action in 'clearsign':
+        return infile + '.asc'
+    elif engine.lower() in 'openssl':
+        return infile + '.enc'
+    elif action in 'detachsign':
+        return infile + '.sig'
+    return infile + '.gpg'
+
+
+def is_stream(obj):
+    """Return True if obj is a file-like object or iterator rather than a string."""
+    return not isinstance(obj, basestring)
+
+
+def iter_chunks(source, chunksize=CHUNKSIZE):
+    """Yield successive chunks of data from a string, file-like object or iterator."""
+    if isinstance(source, basestring):
+        for i in xrange(0, len(source), chunksize):
+            yield source[i:i+chunksize]
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunksize)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in source:
+            if chunk:
+                yield chunk
+
+
+def input_sample(io, size=sniff.SAMPLE_SIZE):
+    """Return up to size bytes from the start of io's input without using it up.
+    
+    Peeking at a file-like object needs it to be seekable; an iterator has its
+    first chunks pulled & put back in front (io['stdin'] is replaced). Returns
+    None if there's no way to look, e.g. for a pipe.
+    
+    """
+    source = io['stdin']
+    if io['infile']:
+        with open(io['infile'], 'rb') as f:
+            return f.read(size)
+    if isinstance(source, basestring):
+        return source[:size]
+    if hasattr(source, 'read'):
+        try:
+            pos = source.tell()
+            data = source.read(size)
+            source.seek(pos)
+            return data
+        except (AttributeError, IOError):
+            return None
+    pulled, got = [], 0
+    source = iter(source)
+    for chunk in source:
+        pulled.append(chunk)
+        got += len(chunk)
+        if got >= size:
+            break
+    io['stdin'] = chain(pulled, source)
+    return ''.join(pulled)[:size]
+
+
+def compression_args(policy, io):
+    """Return gpg options implementing compression policy for io's input.
+    
+    policy is None (leave it to gpg & gpg.conf), 'never', a level from 0 (none)
+    to 9 (smallest), or 'auto': like None, except that input which already looks
+    compressed or encrypted (see sniff.sample_is_compressed()) isn't compressed
+    again -- where gpg spends most of its time otherwise.
+    
+    """
+    if policy is None:
+        return []
+    if policy == 'never':
+        return ['--compress-algo', 'none']
+    if policy == 'auto':
+        if io['infile']:
+            compressed = sniff.is_compressed(io['infile'])
+        else:
+            sample = input_sample(io)
+            compressed = sample is not None and sniff.sample_is_compressed(sample)
+        return ['--compress-algo', 'none'] if compressed else []
+    level = int(policy)
+    if not 0 <= level <= 9:
+        raise ValueError("compression level must be 0-9, not {}".format(level))
+    return ['--compress-level', str(level)]
+
+
+def spawn_child(cmd, io, pass_fds=()):
+    """Return a Popen instance for cmd with stdin/stdout wired up per io dict.
+    
+    If io['stdin'] or io['stdout'] are file objects backed by a real file
+    descriptor, they are handed straight to the child so that data never passes
+    through Python at all. pass_fds are extra descriptors the child must inherit
+    (passphrase, status); they are marked close-on-exec again once it's running.
+    
+    """
+    stdin = stdout = PIPE
+    if io['infile']:
+        stdin = None
+    elif is_stream(io['stdin']) and get_fileno(io['stdin']) is not None:
+        stdin = io['stdin']
+    if hasattr(io['stdout'], 'write') and get_fileno(io['stdout']) is not None:
+        io['stdout'].flush()
+        stdout = io['stdout']
+    with _spawn_lock:
+        for fd in pass_fds:
+            set_cloexec(fd, False)
+        try:
+            childprocess = Popen(cmd, stdin=stdin, stdout=stdout, stderr=io['stderr'][1])
+        finally:
+            for fd in pass_fds:
+                set_cloexec(fd)
+        for f in childprocess.stdin, childprocess.stdout:
+            if f:
+                set_cloexec(f.fileno())
+    return childprocess
+
+
+def communicate_child(childprocess, io, chunksize=CHUNKSIZE, progress=None):
+    """Exchange data with childprocess per io dict, waiting for it to exit.
+    
+    When io['stdin'] is a string and io['stdout'] isn't a writable object, this
+    is the classic Popen.communicate() and io['stdout'] is replaced with the
+    output string. Otherwise data is moved in chunksize pieces: input is fed
+    from a helper thread while output is written to io['stdout'] as it arrives
+    (or collected into a string if io['stdout'] isn't writable), so memory use
+    stays bounded regardless of the size of the data.
+    
+    If progress (a progress.Progress) is given, it's told about input bytes as
+    the child consumes them, whether they're fed through the pipe here or the
+    child reads them from a file itself.
+    
+    """
+    
+    watcher = None
+    if progress:
+        progress.begin(None if is_stream(io['stdin']) or io['infile'] else len(io['stdin']))
+        watcher = watch_child_input(childprocess, io, progress)
+    
+    try:
+        _communicate_child(childprocess, io, chunksize, progress)
+    finally:
+        if watcher:
+            watcher.set()
+        if progress:
+            progress.finish(childprocess.returncode == 0)
+
+
+def _communicate_child(childprocess, io, chunksize, progress):
+    """Do the actual work of communicate_child()."""
+    
+    if not is_stream(io['stdin']) and not hasattr(io['stdout'], 'write'):
+        io['stdout'] = childprocess.communicate(input=io['stdin'])[0]
+        return
+    
+    def feed():
+        try:
+            for chunk in iter_chunks(io['stdin'], chunksize):
+                childprocess.stdin.write(chunk)
+                if progress:
+                    progress.add(len(chunk))
+        except IOError:
+            pass  # Child went away early (EPIPE); its returncode will tell the tale
+        finally:
+            try: childprocess.stdin.close()
+            except IOError: pass
+    
+    feeder = None
+    if childprocess.stdin:
+        feeder = Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+    
+    if childprocess.stdout:
+        if hasattr(io['stdout'], 'write'):
+            sink = io['stdout'].write
+        else:
+            collected = []
+            sink = collected.append
+        fd = childprocess.stdout.fileno()
+        while True:
+            chunk = read(fd, chunksize)
+            if not chunk:
+                break
+            sink(chunk)
+        childprocess.stdout.close()
+        if not hasattr(io['stdout'], 'write'):
+            io['stdout'] = ''.join(collected)
+    
+    if feeder:
+        feeder.join()
+    childprocess.wait()
+
+
+
+class Job():
+    """Per-operation state, so that one engine can run many operations at once.
+    
+    io is the dict described in Gpg.gpg() -- input & output, plus the stderr &
+    gstatus pipes once launched; childprocess is set as soon as the child is
+    running (e.g., to pause or cancel it); status is set by run_engine() (with
+    gpg); progress, if set beforehand, is kept up to date as input is consumed.
+    
+    Pass a Job to run_engine() or the engine's gpg()/openssl() methods (job=...)
+    and the engine keeps nothing of the operation itself. Without one, the
+    engine's own io, childprocess, status & progress attributes are used, i.e.,
+    the engine is its own job -- fine for one operation at a time.
+    
+    """
+    
+    def __init__(self, stdin='', stdout='', infile=0, outfile=0, progress=None):
+        self.io = dict(stdin=stdin, stdout=stdout, stderr=0, gstatus=0,
+                       infile=infile, outfile=outfile)
+        self.childprocess   = None
+        self.status         = None
+        self.progress       = progress
+    
+    
+    def signal(self, signum):
+        """Send signum to the job's child; return False if it isn't running."""
+        child = self.childprocess
+        if not child or child.returncode is not None:
+            return False
+        try:
+            child.send_signal(signum)
+        except OSError:
+            return False
+        return True
+    
+    
+    def terminate(self):
+        """Kill the job's child (resuming it first, in case it's stopped)."""
+        if self.signal(SIGCONT):
+            self.signal(SIGTERM)
+
+
+
+class GpgSession():
+    """Per-homedir gpg state that's expensive to rediscover for every operation.
+    
+    Detects which gpg binary to use (and its version) once, launches gpg-agent
+    up front so that the first operation needing a secret key doesn't pay for
+    agent startup, and caches the secret-keyring listing (default key, etc) &
+    an index of the public keyring (for resolving recipients). The caches are
+    thrown away whenever any keyring file's (or gpg.conf's) mtime changes.
+    
+    Use get_session() rather than instantiating this directly, so that every Gpg
+    instance working with the same homedir shares the same session.
+    
+    """
+    
+    # Files whose modification means cached keyring info is stale
+    KEYRING_FILES = ('pubring.kbx', 'pubring.gpg', 'secring.gpg', 'trustdb.gpg',
+                     'private-keys-v1.d', 'gpg.conf')
+    
+    
+    def __init__(self, firstchoice='gpg2', homedir=None):
+        """Find gpg or gpg2 (raising OSError if neither exists); start agent."""
+        
+        order = ['gpg2', 'gpg']
+        if firstchoice == 'gpg':
+            order.reverse()
+        for binary in order:
+            try:
+                self.vers = Popen([binary, '--version'], stdout=PIPE).communicate()[0]
+                self.GPG_BINARY = binary
+                break
+            except OSError:
+                continue
+        else:
+            stderr.write("gpg, gpg2 not found on your system.\n\n")
+            raise OSError("gpg, gpg2 not found")
+        
+        m = re.search(r'(\d+)\.(\d+)', self.vers)
+        self.version = (int(m.group(1)), int(m.group(2))) if m else (0, 0)
+        # gpg >= 2 always uses the agent and has no --use-agent/--no-use-agent
+        self.agent_builtin = self.version >= (2, 0)
+        
+        self.homedir = homedir or environ.get('GNUPGHOME') or expanduser('~/.gnupg')
+        self._lock = Lock()
+        self._stamp = None
+        self._secret_keys = None
+        self._index_stamp = None
+        self._index = None
+        self._snapshots = None
+        self._trustdb_thread = None
+        
+        if self.agent_builtin:
+            self.warm_agent()
+    
+    
+    def warm_agent(self):
+        """Make sure gpg-agent is up now, instead of during the first real operation."""
+        for cmd in (['gpgconf', '--homedir', self.homedir, '--launch', 'gpg-agent'],
+                    ['gpg-connect-agent', '--homedir', self.homedir, '/bye']):
+            try:
+                with open('/dev/null', 'w') as devnull:
+                    if Popen(cmd, stdout=devnull, stderr=devnull).wait() == 0:
+                        return True
+            except OSError:
+                continue
+        return False
+    
+    
+    def keyring_stamp(self):
+        """Return tuple of mtimes of keyring files (None for missing ones)."""
+        stamp = []
+        for name in self.KEYRING_FILES:
+            try:
+                stamp.append(stat(join(self.homedir, name)).st_mtime)
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+    
+    
+    def secret_keys(self):
+        """Return list of dicts (keyid, fingerprint, uids) for each secret key.
+        
+        Result is cached until the keyring changes on disk.
+        
+        """
+        with self._lock:
+            stamp = self.keyring_stamp()
+            if self._secret_keys is None or stamp != self._stamp:
+                self._secret_keys = self._list_secret_keys()
+                self._stamp = stamp
+            return self._secret_keys
+    
+    
+    def _list_secret_keys(self):
+        keys = []
+        listing = check_output([self.GPG_BINARY, '--homedir', self.homedir,
+                                '--list-secret-keys', '--with-colons',
+                                '--fast-list-mode', '--with-fingerprint'])
+        for line in listing.splitlines():
+            f = line.split(':')
+            if f[0] == 'sec':
+                keys.append(dict(keyid=f[4], fingerprint=None, uids=[]))
+            elif keys and f[0] == 'fpr' and not keys[-1]['fingerprint']:
+                keys[-1]['fingerprint'] = f[9]
+            elif keys and f[0] == 'uid':
+                keys[-1]['uids'].append(f[9])
+        return keys
+    
+    
+    def default_key(self):
+        """Return key id of first secret key in gpg keyring."""
+        keys = self.secret_keys()
+        if not keys:
+            raise Exception("no secret keys in gpg keyring")
+        return keys[0]['keyid']
+    
+    
+    def recipient_index(self):
+        """Return a KeyIndex of the public keyring; rebuilt only when the keyring changes."""
+        with self._lock:
+            stamp = self.keyring_stamp()
+            if self._index is None or stamp != self._index_stamp:
+                listing = check_output([self.GPG_BINARY, '--homedir', self.homedir,
+                                        '--list-keys', '--with-colons', '--fast-list-mode',
+                                        # Twice: gpg1 only prints subkey fingerprints then
+                                        '--with-fingerprint', '--with-fingerprint'])
+                self._index = KeyIndex(listing, read_groups(join(self.homedir, 'gpg.conf')))
+                self._index_stamp = stamp
+            return self._index
+    
+    
+    def resolve_recipients(self, recip):
+        """Return fingerprints for recip (names separated by ';'); raise RecipientError."""
+        names = [r.strip() for r in recip.split(';') if r.strip()]
+        return self.recipient_index().resolve(names)
+    
+    
+    def check_trustdb(self):
+        """Run 'gpg --check-trustdb' (a no-op unless a check is due); return True if it worked."""
+        try:
+            with open('/dev/null', 'w') as devnull:
+                return Popen([self.GPG_BINARY, '--homedir', self.homedir, '--batch',
+                              '--check-trustdb'], stdout=devnull, stderr=devnull).wait() == 0
+        except OSError:
+            return False
+    
+    
+    def maintain_trustdb(self, interval=TRUSTDB_INTERVAL):
+        """Check the trustdb now & every interval seconds from a background thread.
+        
+        This is what fastpath operations rely on instead of gpg's own automatic
+        check; calling it again does nothing while the thread is running.
+        
+        """
+        with self._lock:
+            if self._trustdb_thread:
+                return
+            self._trustdb_thread = Thread(target=self._maintain_trustdb, args=(interval,))
+        self._trustdb_thread.daemon = True
+        self._trustdb_thread.start()
+    
+    
+    def _maintain_trustdb(self, interval):
+        while True:
+            self.check_trustdb()
+            sleep(interval)
+    
+    
+    def snapshots(self):
+        """Return the KeyringSnapshots of this homedir, creating it if needed."""
+        with self._lock:
+            if self._snapshots is None:
+                self._snapshots = KeyringSnapshots(self)
+            return self._snapshots
+    
+    
+    def invalidate(self):
+        """Forget cached keyring info."""
+        with self._lock:
+            self._secret_keys = None
+            self._index = None
+
+
+
+class KeyringSnapshots():
+    """Private copies of a session's public keyring, one per gpg running at once.
+    
+    gpg takes a lock on the keyring (and trustdb) for every operation, so many
+    children sharing one homedir mostly wait on each other. Operations that
+    only need public keys (encrypting to recipients, verifying) can instead be
+    pointed at a snapshot: a temporary homedir holding copies of the public
+    keyring, trustdb & gpg.conf. Each is leased to one child at a time, so
+    nobody contends for its locks, and is refreshed at lease time whenever the
+    real keyring has changed on disk. Secret keys are never copied -- anything
+    needing them runs against the real homedir (and its agent) as usual.
+    
+    Snapshots are removed when the program exits.
+    
+    """
+    
+    # Copied into each snapshot (whichever of them exist in the real homedir)
+    PUBLIC_FILES = ('pubring.kbx', 'pubring.gpg', 'trustdb.gpg', 'gpg.conf')
+    
+    
+    def __init__(self, session, tmpdir=None):
+        self.session    = session
+        self.tmpdir     = tmpdir
+        self._lock      = Lock()
+        self._free      = []
+        self._stamps    = {}
+        atexit.register(self.cleanup)
+    
+    
+    def lease(self):
+        """Return path of an up-to-date snapshot that's now yours until release()."""
+        stamp = self.session.keyring_stamp()
+        with self._lock:
+            homedir = self._free.pop() if self._free else None
+        if homedir is None:
+            homedir = mkdtemp(prefix='pyrite-gnupg-', dir=self.tmpdir)
+            with self._lock:
+                self._stamps[homedir] = None
+        if self._stamps[homedir] != stamp:
+            self.refresh(homedir)
+            # Stamp from before copying: if keyring changed meanwhile, we copy again next time
+            self._stamps[homedir] = stamp
+        return homedir
+    
+    
+    def release(self, homedir):
+        """Give back a snapshot returned by lease()."""
+        with self._lock:
+            self._free.append(homedir)
+    
+    
+    def refresh(self, homedir):
+        """Replace the contents of snapshot homedir with copies of the real public files."""
+        for name in self.PUBLIC_FILES:
+            source, copy = join(self.session.homedir, name), join(homedir, name)
+            if isfile(source):
+                copy2(source, copy)
+            elif isfile(copy):
+                unlink(copy)
+    
+    
+    def cleanup(self):
+        """Remove all snapshots (leased or not)."""
+        with self._lock:
+            for homedir in self._stamps:
+                rmtree(homedir, ignore_errors=True)
+            self._stamps.clear()
+            self._free = []
+
+
+
+_sessions = {}
+_sessions_lock = Lock()
+
+def get_session(firstchoice='gpg2', homedir=None):
+    """Return the shared GpgSession for firstchoice + homedir, creating it if needed."""
+    homedir = homedir or environ.get('GNUPGHOME') or expanduser('~/.gnupg')
+    with _sessions_lock:
+        if (firstchoice, homedir) not in _sessions:
+            _sessions[firstchoice, homedir] = GpgSession(firstchoice, homedir)
+        return _sessions[firstchoice, homedir]
+
+
 
 class Gpg():
     """GPG/GPG2 interface for encryption/decryption/signing/verifying.
@@ -56,31 +740,12 @@ class Gpg():
     """
     
     
-    def __init__(self, show_version=True, firstchoice='gpg2'):
-        """Confirm we can run gpg or gpg2."""
-        
-        def gpg1():
-            self.vers = Popen(['gpg', '--version'], stdout=PIPE).communicate()[0]
-            self.GPG_BINARY = 'gpg'
-        
-        def gpg2():
-            self.vers = Popen(['gpg2', '--version'], stdout=PIPE).communicate()[0]
-            self.GPG_BINARY = 'gpg2'
+    def __init__(self, show_version=True, firstchoice='gpg2', session=None):
+        """Confirm we can run gpg or gpg2 (via a shared GpgSession)."""
         
-        if firstchoice == 'gpg':
-            try: gpg1()
-            except:
-                try: gpg2()
-                except:
-                    stderr.write("gpg, gpg2 not found on your system.\n\n")
-                    raise
-        else:
-            try: gpg2()
-            except:
-                try: gpg1()
-                except:
-                    stderr.write("gpg, gpg2 not found on your system.\n\n")
-                    raise
+        self.session    = session or get_session(firstchoice)
+        self.vers       = self.session.vers
+        self.GPG_BINARY = self.session.GPG_BINARY
         
         # To show or not to show version info
         if show_version:
@@ -88,14 +753,16 @@ class Gpg():
         
         # I/O dictionary obj
         self.io = dict(
-            stdin='',   # Stores input text for subprocess
-            stdout='',  # Stores stdout stream from subprocess
+            stdin='',   # Stores input text (or readable file obj/iterator) for subprocess
+            stdout='',  # Stores stdout stream from subprocess (or writable file obj)
             stderr=0,   # Stores tuple of r/w file descriptors for stderr stream
             gstatus=0,  # Stores tuple of r/w file descriptors for gpg-status stream
             infile=0,   # Input filename for subprocess
             outfile=0)  # Output filename for subprocess
         
         self.childprocess = None
+        self.status = None      # GpgResult of last run_engine() call
+        self.progress = None    # Set to a progress.Progress to follow input consumption
     
     
     # Main gpg interface method
@@ -114,12 +781,17 @@ class Gpg():
         cipher=     None,   # One of: aes256, 3des, etc; None == use gpg defaults
         verbose=    False,  # Add '--verbose'?
         alwaystrust=False,  # Add '--trust-model always'?
-        yes=        True    # Add '--yes'? (will overwrite files)
+        yes=        True,   # Add '--yes'? (will overwrite files)
+        compress=   'auto', # One of: auto, never, 0-9, None (see compression_args())
+        snapshot=   False,  # Use a private copy of the public keyring, if possible?
+        fastpath=   False,  # Skip gpg's per-call trustdb check & key auto-retrieval?
+        job=        None    # Job holding io etc for this run; None == use self
         ):
         """Build a gpg cmdline and then launch gpg/gpg2, saving output appropriately.
         
-        This method inspects the contents of class attr 'io' -- a dict object that should
-        contain all of the following keys, at least initialized to 0 or '':
+        This method inspects the contents of job.io (or class attr 'io' if no job is
+        given; see Job) -- a dict object that should contain all of the following keys,
+        at least initialized to 0 or '':
             stdin       # Input text for subprocess
             infile      # Input filename for subprocess, in place of stdin
             outfile     # Output filename if infile was given
@@ -127,9 +799,27 @@ class Gpg():
         must contain the input data. If using infile, outfile is not necessarily required,
         but it's probably a good idea unless you're doing sign-only.
         
+        Streaming: io['stdin'] may also be a readable file-like object or an iterator of
+        strings, and io['stdout'] may be set to a writable file-like object beforehand.
+        Data then moves through the child in CHUNKSIZE pieces instead of being held in
+        memory all at once (see communicate_child()).
+        
         Additional highlights:
         recip: Use a single semicolon to separate recipients. Superfluous leading/
-            trailing semicolons or spaces are stripped.
+            trailing semicolons or spaces are stripped. Names are looked up in the
+            session's recipient index before gpg is launched; RecipientError is
+            raised if any of them doesn't identify exactly one usable key.
+        compress: 'auto' (the default) skips compressing input that already looks
+            compressed or encrypted, which is otherwise where most of gpg's time goes;
+            see compression_args() for the other choices.
+        snapshot: Run gpg against a snapshot of the public keyring (see KeyringSnapshots)
+            instead of the shared homedir, so that many gpg children can run at once
+            without waiting on each other's keyring locks. Ignored for operations that
+            need a secret key, i.e., decrypting & signing.
+        fastpath: Pass '--no-auto-check-trustdb' & turn off automatic key retrieval/
+            location (which can mean network lookups), so that gpg does only the
+            operation asked for. The trustdb is instead checked in the background
+            every TRUSTDB_INTERVAL seconds (see GpgSession.maintain_trustdb()).
         enctoself: Self is assumed to be first key returned by gpg --list-secret-keys;
             however, if localuser is provided, that is used as self instead.
         
@@ -144,30 +834,104 @@ class Gpg():
         
         Nothing is returned -- it is expected that this method is being run as a separate
         thread and therefore the responsibility to determine success or failure falls on
-        the caller (i.e., by examining the Popen instance's returncode attribute).
+        the caller (i.e., by examining the returncode of job.childprocess, a Popen).
+        
+        Completion: this method returns as soon as the child exits, after closing its
+        own copies of the stderr/status pipe write ends; the caller's readers will see
+        EOF once they've consumed everything left in the pipes (see drain_fd()).
+        
+        """
+        
+        job = job or self
+        if fastpath:
+            self.session.maintain_trustdb()
+        snapshots = homedir = fd_pwd_R = None
+        if snapshot and not needs_secret_key(action, encsign):
+            snapshots = self.session.snapshots()
+            homedir = snapshots.lease()
+        
+        try:
+            cmd, fd_pwd_R = self.gpg_command(
+                job.io, action, encsign, digest, localuser, base64, symmetric, passwd,
+                asymmetric, recip, enctoself, cipher, verbose, alwaystrust, yes, compress,
+                homedir, fastpath)
+            
+            # Print a separator + the command-arguments to stderr
+            flatten_list_to_stderr(cmd)
+            
+            # Popen instance gets no stdin if working direct with files; otherwise
+            #   a pipe, or the caller's own file if it has a real descriptor
+            pass_fds = [fd for fd in (fd_pwd_R, job.io['gstatus'] and job.io['gstatus'][1])
+                        if fd]
+            job.childprocess = spawn_child(cmd, job.io, pass_fds)
+            
+            # Time to communicate! Save (or stream) output for later
+            communicate_child(job.childprocess, job.io, progress=job.progress)
+        
+        finally:
+            # Even if the child couldn't be started, or talking to it failed
+            if fd_pwd_R:  close(fd_pwd_R)
+            if homedir:
+                snapshots.release(homedir)
+        
+        # Clear stdin from our dictionary asap, in case it's huge
+        job.io['stdin'] = ''
+        
+        # Close os file descriptors -- child has exited, so once our copies of the
+        #   write ends are gone, readers hit EOF as soon as they've drained the pipes
+        close(job.io['stderr'][1])
+        if job.io['gstatus']:
+            close(job.io['gstatus'][1])
+    
+    
+    def gpg_command(
+        self, io, action=None, encsign=False, digest=None, localuser=None, base64=True,
+        symmetric=False, passwd=None, asymmetric=False, recip=None, enctoself=False,
+        cipher=None, verbose=False, alwaystrust=False, yes=True, compress='auto',
+        homedir=None, fastpath=False):
+        """Return (cmdline, passphrase fd or None) for a gpg() operation on io dict.
+        
+        Arguments are as for gpg(), plus homedir: a leased KeyringSnapshots path
+        to use instead of the default homedir. The passphrase (if any) has already
+        been written into a pipe whose read end is returned; the caller must let
+        the child inherit it and close it afterwards.
         
         """
         
-        if self.io['infile'] and self.io['infile'] == self.io['outfile']:
+        if io['infile'] and io['infile'] == io['outfile']:
             stderr.write("Same file for both input and output, eh? Is it going "
                          "to work? ... NOPE. Chuck Testa.\n")
             raise Exception("infile, outfile must be different")
         
         fd_pwd_R    = None
-        fd_pwd_W    = None
         useagent    = True
         cmd         = [self.GPG_BINARY]
+        recipients  = []
+        
+        # Work out recipients before opening the passphrase pipe, so that the
+        #   errors these can raise don't leave it open
+        if action in 'enc':
+            if enctoself:
+                recipients.append(localuser or self.get_gpgdefaultkey())
+            if recip:
+                # Resolved up front (raising RecipientError for bad names), so gpg
+                #   gets fingerprints & needn't search the keyring for each name
+                recipients.extend(self.session.resolve_recipients(recip))
+        
+        if homedir:
+            # Snapshot is ours alone while leased, so gpg needn't lock anything in it
+            cmd.extend(['--homedir', homedir, '--lock-never'])
         
-        if self.io['gstatus']:
+        if io['gstatus']:
             # Status to file descriptor option
             cmd.append('--status-fd')
-            cmd.append(str(self.io['gstatus'][1]))
+            cmd.append(str(io['gstatus'][1]))
         
         # Setup passphrase file descriptor for symmetric enc/dec
         if (action in 'enc' and symmetric and passwd and not encsign) or (
             action in 'dec' and symmetric and passwd):
                 useagent=False
-                fd_pwd_R, fd_pwd_W = pipe()
+                fd_pwd_R, fd_pwd_W = cloexec_pipe()
                 write(fd_pwd_W, passwd)
                 close(fd_pwd_W)
                 cmd.append('--passphrase-fd')
@@ -188,19 +952,9 @@ class Gpg():
             if cipher:
                 cmd.append('--cipher-algo')
                 cmd.append(cipher)
-            if enctoself:
+            for r in recipients:
                 cmd.append('--recipient')
-                if localuser:
-                    cmd.append(localuser)
-                else:
-                    cmd.append(self.get_gpgdefaultkey())
-            if recip:
-                while recip[-1] == ' ' or recip[-1] == ';':
-                    recip = recip.strip()
-                    recip = recip.strip(';')
-                for r in recip.split(';'):
-                    cmd.append('--recipient')
-                    cmd.append(r)
+                cmd.append(r)
         
         # Decrypt opts
         elif action in 'dec':
@@ -219,6 +973,10 @@ class Gpg():
         elif action in 'verify':
             cmd.append('--verify')
         
+        # Only these 2 compress anything
+        if action in {'enc', 'embedsign'}:
+            cmd.extend(compression_args(compress, io))
+        
         # Wouldn't hurt to use armor for all, but it only works with these 3
         if action in {'enc', 'embedsign', 'detachsign'}:
             if base64:
@@ -226,10 +984,10 @@ class Gpg():
         
         # Action-independent opts
         if useagent:
-            if self.GPG_BINARY in 'gpg':
+            if not self.session.agent_builtin:
                 cmd.append('--use-agent')
         else:
-            if self.GPG_BINARY in 'gpg':
+            if not self.session.agent_builtin:
                 cmd.append('--no-use-agent')
             else:
                 cmd.append('--batch')
@@ -244,41 +1002,25 @@ class Gpg():
             cmd.append('always')
         if verbose:
             cmd.append('--verbose')
-        if self.io['outfile']:
+        if fastpath:
+            # Not if the agent may have to ask for a passphrase (gpg1 won't, in batch mode)
+            if not useagent and '--batch' not in cmd:
+                cmd.append('--batch')
+            cmd.append('--no-auto-check-trustdb')
+            cmd.append('--no-auto-key-retrieve')
+            cmd.append('--no-auto-key-locate')
+        if io['outfile']:
             cmd.append('--output')
-            cmd.append(self.io['outfile'])
-        if self.io['infile']:
-            cmd.append(self.io['infile'])
-        
-        # Print a separator + the command-arguments to stderr
-        flatten_list_to_stderr(cmd)
+            cmd.append(io['outfile'])
+        if io['infile']:
+            cmd.append(io['infile'])
         
-        # If working direct with files, setup our Popen instance with no stdin
-        if self.io['infile']:
-            self.childprocess = Popen(cmd, stdout=PIPE, stderr=self.io['stderr'][1])
-        # Otherwise, only difference for Popen is we need the stdin pipe
-        else:
-            self.childprocess = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=self.io['stderr'][1])
-        
-        # Time to communicate! Save output for later
-        self.io['stdout'] = self.childprocess.communicate(input=self.io['stdin'])[0]
-        
-        # Clear stdin from our dictionary asap, in case it's huge
-        self.io['stdin'] = ''
-        
-        # Close os file descriptors
-        if fd_pwd_R:  close(fd_pwd_R)
-        sleep(0.1)  # Sleep a bit to ensure everything gets read
-        close(self.io['stderr'][1])
-        if self.io['gstatus']:
-            close(self.io['gstatus'][1])
+        return cmd, fd_pwd_R
     
     
     def get_gpgdefaultkey(self):
-        """Return key id of first secret key in gpg keyring.""" 
-        return check_output(split(
-            "{} --list-secret-keys --with-colons --fast-list-mode"
-            .format(self.GPG_BINARY))).split(':', 5)[4]
+        """Return key id of first secret key in gpg keyring (cached by session).""" 
+        return self.session.default_key()
 
 
 
@@ -312,13 +1054,14 @@ class Openssl():
         
         # I/O dictionary obj
         self.io = dict(
-            stdin='',   # Stores input text for subprocess
-            stdout='',  # Stores stdout stream from subprocess
+            stdin='',   # Stores input text (or readable file obj/iterator) for subprocess
+            stdout='',  # Stores stdout stream from subprocess (or writable file obj)
             stderr=0,   # Stores tuple of r/w file descriptors for stderr stream
             infile=0,   # Input filename for subprocess
             outfile=0)  # Output filename for subprocess
         
         self.childprocess = None
+        self.progress = None    # Set to a progress.Progress to follow input consumption
     
     
     # Main openssl interface method
@@ -328,50 +1071,80 @@ class Openssl():
         passwd,         # Passphrase for symmetric
         base64=True,    # Add '-a' when encrypting/decrypting?
         cipher=None,    # Cipher in gpg-format; None = use aes256
+        job=None,       # Job holding io etc for this run; None == use self
         ):
         """Build an openssl cmdline and then launch it, saving output appropriately.
-
-        This method inspects the contents of class attr 'io' -- a dict object that should
-        contain all of the following keys, at least initialized to 0 or '':
+        
+        This method inspects the contents of job.io (or class attr 'io' if no job is
+        given; see Job) -- a dict object that should contain all of the following keys,
+        at least initialized to 0 or '':
             stdin       # Input text for subprocess
             infile      # Input filename for subprocess, in place of stdin
             outfile     # Output filename -- required if infile was given
         io['infile'] should contain a filename OR be set to 0, in which case io'[stdin']
         must contain the input data.
         
+        Streaming: as with Gpg.gpg(), io['stdin'] may be a readable file-like object or
+        an iterator of strings, and io['stdout'] may be a writable file-like object.
+        
         Whether reading input from infile or stdin, each openssl command's stdout &
         stderr streams are saved to io['stdout'] and io['stderr'].
         
         Nothing is returned -- it is expected that this method is being run as a separate
         thread and therefore the responsibility to determine success or failure falls on
-        the caller (i.e., by examining the Popen instance's returncode attribute).
+        the caller (i.e., by examining the returncode of job.childprocess, a Popen).
+        
+        Completion: this method returns as soon as the child exits, after closing its
+        own copies of the stderr/status pipe write ends; the caller's readers will see
+        EOF once they've consumed everything left in the pipes (see drain_fd()).
+        
+        """
+        
+        job = job or self
+        cmd, fd_pwd_R = self.openssl_command(job.io, action, passwd, base64, cipher)
+        
+        # Print a separator + the command-arguments to stderr
+        flatten_list_to_stderr(cmd)
+        
+        try:
+            # Popen instance gets no stdin if working direct with files; otherwise
+            #   a pipe, or the caller's own file if it has a real descriptor
+            job.childprocess = spawn_child(cmd, job.io, [fd_pwd_R])
+            
+            # Time to communicate! Save (or stream) output for later
+            communicate_child(job.childprocess, job.io, progress=job.progress)
+        
+        finally:
+            # Even if the child couldn't be started, or talking to it failed
+            close(fd_pwd_R)
+        
+        # Clear stdin from our dictionary asap, in case it's huge
+        job.io['stdin'] = ''
+        
+        # Close os file descriptors -- child has exited, so once our copy of the
+        #   write end is gone, readers hit EOF as soon as they've drained the pipe
+        close(job.io['stderr'][1])
+    
+    
+    def openssl_command(self, io, action, passwd, base64=True, cipher=None):
+        """Return (cmdline, passphrase fd) for an openssl() operation on io dict.
+        
+        As with Gpg.gpg_command(), the caller must pass the passphrase fd on to
+        the child and close it afterwards.
         
         """
         
-        if self.io['infile'] and self.io['infile'] == self.io['outfile']:
+        if io['infile'] and io['infile'] == io['outfile']:
             stderr.write("Same file for both input and output, eh? Is it going "
                          "to work? ... NOPE. Chuck Testa.\n")
             raise Exception("infile, outfile must be different")
         
-        if cipher:  cipher = cipher.lower()
-        if   cipher == None:            cipher = 'aes-256-cbc'
-        elif cipher == '3des':          cipher = 'des-ede3-cbc'
-        elif cipher == 'cast5':         cipher = 'cast5-cbc'
-        elif cipher == 'blowfish':      cipher = 'bf-cbc'
-        elif cipher == 'aes':           cipher = 'aes-128-cbc'
-        elif cipher == 'aes192':        cipher = 'aes-192-cbc'
-        elif cipher == 'aes256':        cipher = 'aes-256-cbc'
-        elif cipher == 'camellia128':   cipher = 'camellia-128-cbc'
-        elif cipher == 'camellia192':   cipher = 'camellia-192-cbc'
-        elif cipher == 'camellia256':   cipher = 'camellia-256-cbc'
-        #else:                           cipher = 'aes-256-cbc'
+        cipher = openssl_cipher(cipher)
         
-        fd_pwd_R    = None
-        fd_pwd_W    = None
         cmd         = ['openssl', cipher, '-md', 'sha256', '-pass']
         
         # Setup passphrase file descriptors
-        fd_pwd_R, fd_pwd_W = pipe()
+        fd_pwd_R, fd_pwd_W = cloexec_pipe()
         write(fd_pwd_W, passwd)
         close(fd_pwd_W)
         cmd.append('fd:{}'.format(fd_pwd_R))
@@ -382,31 +1155,10 @@ class Openssl():
             cmd.append('-salt')
         elif action in 'dec':
             cmd.append('-d')
-        if self.io['infile']:
+        if io['infile']:
             cmd.append('-in')
-            cmd.append(self.io['infile'])
+            cmd.append(io['infile'])
             cmd.append('-out')
-            cmd.append(self.io['outfile'])
-        
-        # Print a separator + the command-arguments to stderr
-        flatten_list_to_stderr(cmd)
+            cmd.append(io['outfile'])
         
-        # If working direct with files, setup our Popen instance with no stdin
-        if self.io['infile']:
-            self.childprocess = Popen(cmd, stdout=PIPE, stderr=self.io['stderr'][1])
-        # Otherwise, only difference for Popen is we need the stdin pipe
-        else:
-            self.childprocess = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=self.io['stderr'][1])
-        
-        # Time to communicate! Save output for later
-        self.io['stdout'] = self.childprocess.communicate(input=self.io['stdin'])[0]
-        
-        # Clear stdin from our dictionary asap, in case it's huge
-        self.io['stdin'] = ''
-        
-        # Close os file descriptors
-        close(fd_pwd_R)
-        sleep(0.1)  # Sleep a bit to ensure everything gets read
-        close(self.io['stderr'][1])
-    
-    
+        return cmd, fd_pwd_R
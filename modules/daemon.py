@@ -0,0 +1,579 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+#
+# 'pyrite daemon': a local service running gpg/openssl jobs for other processes,
+# so that they don't each pay for starting Python & Pyrite.
+#
+# Protocol: over a Unix domain socket, one request per connection. Everything
+# is sent as frames -- a 1-byte type, a 4-byte big-endian length & that much
+# data. The client starts with a 'J' frame holding a JSON request:
+#
+#   {"op": "job", "action": "enc", "backend": "gpg2", "opts": {...}}
+#       Run an engine operation (opts are Gpg.gpg() keyword args, or passwd,
+#       base64 & cipher for openssl). Unless "infile" is given, input follows
+#       as 'D' frames ended by an empty one. The daemon answers 'A' {"job": id}
+#       when the job is queued (or 'E' {"error": ...} if the queue is full),
+#       then streams output as 'D' frames (unless "outfile" is given) and ends
+#       with 'R' {returncode, ok, stderr, status, cancelled, ...}.
+#   {"op": "cancel" | "pause" | "resume", "job": id}
+#   {"op": "stats"}
+#       Answered by a single 'R' (or 'E') frame.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import argparse
+import json
+import socket
+import struct
+from sys import stdin, stdout, stderr
+from os import environ, unlink, umask, getuid
+from os.path import expanduser, join, exists
+from signal import signal, SIGTERM, SIGSTOP, SIGCONT
+from threading import Thread, Lock
+from Queue import Queue, Full
+from multiprocessing import cpu_count
+from time import time
+# Custom Modules:
+import crypt_interface
+from batch import (ACTIONS, add_engine_arguments, engine_opts,
+                   worker_count, check_engine_arguments)
+
+FRAME = struct.Struct('>cI')
+# Largest frame either side will accept
+MAX_FRAME = 1024 * 1024
+
+
+
+def default_socket():
+    """Return default socket path: in $XDG_RUNTIME_DIR if set, else ~/.pyrite.sock."""
+    rundir = environ.get('XDG_RUNTIME_DIR')
+    if rundir:
+        return join(rundir, 'pyrite.sock')
+    return expanduser('~/.pyrite.sock')
+
+
+def send_frame(sock, kind, data=''):
+    """Send one frame of type kind (a single char)."""
+    sock.sendall(FRAME.pack(kind, len(data)))
+    if data:
+        sock.sendall(data)
+
+
+def send_json(sock, kind, obj):
+    send_frame(sock, kind, json.dumps(obj, sort_keys=True))
+
+
+def byte_strings(obj):
+    """Return obj (as loaded from JSON) with unicode strings turned into UTF-8 strs."""
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, list):
+        return [byte_strings(v) for v in obj]
+    if isinstance(obj, dict):
+        return dict((byte_strings(k), byte_strings(v)) for k, v in obj.iteritems())
+    return obj
+
+
+def recv_exact(sock, n):
+    """Return exactly n bytes from sock, or None if it's closed before then."""
+    parts = []
+    while n:
+        data = sock.recv(min(n, 65536))
+        if not data:
+            return None
+        parts.append(data)
+        n -= len(data)
+    return ''.join(parts)
+
+
+def recv_frame(sock):
+    """Return (kind, data) of the next frame, or (None, None) at end of stream."""
+    header = recv_exact(sock, FRAME.size)
+    if header is None:
+        return None, None
+    kind, length = FRAME.unpack(header)
+    if length > MAX_FRAME:
+        raise IOError("frame too large ({} bytes)".format(length))
+    data = recv_exact(sock, length) if length else ''
+    if data is None:
+        return None, None
+    return kind, data
+
+
+
+class Job():
+    """One engine operation requested over a connection."""
+    
+    def __init__(self, id, sock, request):
+        self.id         = id
+        self.sock       = sock
+        self.action     = request['action']
+        self.backend    = request.get('backend', 'gpg2')
+        self.native     = request.get('native', False)
+        self.opts       = request.get('opts', {})
+        self.infile     = request.get('infile') or 0
+        self.outfile    = request.get('outfile') or 0
+        self.state      = 'queued'
+        self.cancelled  = False
+        self.broken     = False
+        self.op         = None
+        self.bytes_in   = 0
+        self.bytes_out  = 0
+        self.submitted  = time()
+        self.started    = None
+    
+    
+    def input(self):
+        """Yield payload data as it arrives in 'D' frames.
+        
+        If the client goes away (or the job is cancelled) before the final empty
+        frame, the child is killed: it must not get to finish on partial input.
+        
+        """
+        while True:
+            try:
+                kind, data = recv_frame(self.sock)
+            except (IOError, socket.error):
+                kind = None
+            if kind != 'D' or self.cancelled:
+                self.broken = self.broken or not self.cancelled
+                self.kill()
+                raise IOError("input stream ended early")
+            if not data:
+                return
+            self.bytes_in += len(data)
+            yield data
+    
+    
+    def write(self, data):
+        """Send output data to the client (file-like, for io['stdout'])."""
+        if self.broken:
+            return
+        try:
+            send_frame(self.sock, 'D', data)
+            self.bytes_out += len(data)
+        except socket.error:
+            # Nobody to read it, so don't leave the child blocked on a full pipe
+            self.broken = True
+            self.kill()
+    
+    
+    def kill(self):
+        """Terminate the job's child, if it has one (same as the GUI's Cancel)."""
+        if self.op:
+            self.op.terminate()
+    
+    
+    def signal(self, signum):
+        """Send signum to the job's child; return False if there's none."""
+        return bool(self.op) and self.op.signal(signum)
+    
+    
+    def describe(self):
+        return dict(action=self.action, backend=self.backend, state=self.state,
+                    bytes_in=self.bytes_in, bytes_out=self.bytes_out,
+                    waited=round((self.started or time()) - self.submitted, 3),
+                    running=round(time() - self.started, 3) if self.started else None)
+
+
+
+class Daemon():
+    """Accept jobs on a Unix socket & run them with a bounded pool of worker threads.
+    
+    At most workers jobs run at once, each with its own engine child (workers
+    share engine instances, one per backend, each job being a Job); up to
+    queue_depth more wait their turn, and jobs beyond that are turned away
+    straight off (the client gets an 'E' frame saying so) instead of piling up.
+    
+    """
+    
+    def __init__(self, path, workers=None, queue_depth=None):
+        self.path           = path
+        self.workers        = workers or cpu_count()
+        self.queue_depth    = queue_depth or 4 * self.workers
+        self.queue          = Queue(self.queue_depth)
+        self.jobs           = {}
+        self.lock           = Lock()
+        self.next_id        = 1
+        self.started        = time()
+        self.totals         = dict(accepted=0, rejected=0, completed=0, failed=0,
+                                   cancelled=0, bytes_in=0, bytes_out=0)
+        self.listener       = None
+        self.engines        = {}
+    
+    
+    def listen(self):
+        """Create the socket (private to this user), replacing a stale one."""
+        if exists(self.path):
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                unlink(self.path)
+            else:
+                raise OSError("a daemon is already listening on {}".format(self.path))
+            finally:
+                probe.close()
+        self.listener = socket.socket(socket.AF_UNIX)
+        old = umask(0o077)
+        try:
+            self.listener.bind(self.path)
+        finally:
+            umask(old)
+        self.listener.listen(64)
+    
+    
+    def serve(self):
+        """Start workers & handle connections until interrupted."""
+        for i in xrange(self.workers):
+            t = Thread(target=self.work)
+            t.daemon = True
+            t.start()
+        try:
+            while True:
+                conn = self.listener.accept()[0]
+                t = Thread(target=self.handle, args=(conn,))
+                t.daemon = True
+                t.start()
+        finally:
+            self.listener.close()
+            unlink(self.path)
+    
+    
+    #---------------------------------------------------------------- REQUESTS
+    
+    def handle(self, conn):
+        """Read one request from conn & act on it (runs in its own thread)."""
+        try:
+            kind, data = recv_frame(conn)
+            if kind != 'J':
+                raise ValueError("expected a 'J' frame")
+            # Engines want byte strings (passphrases, filenames, etc)
+            request = byte_strings(json.loads(data))
+            op = request.get('op')
+            if op == 'job':
+                if self.submit(conn, request):
+                    return  # conn now belongs to the job
+            elif op in {'cancel', 'pause', 'resume'}:
+                send_json(conn, 'R', self.control(op, str(request.get('job'))))
+            elif op == 'stats':
+                send_json(conn, 'R', self.stats())
+            else:
+                raise ValueError("unknown op {!r}".format(op))
+        except (ValueError, KeyError, IOError, socket.error) as e:
+            try:
+                send_json(conn, 'E', dict(error=str(e)))
+            except socket.error:
+                pass
+        conn.close()
+    
+    
+    def submit(self, conn, request):
+        """Queue a job for request; return False (after telling client) if it can't be."""
+        if request.get('action') not in ACTIONS:
+            raise ValueError("action must be one of: {}".format(', '.join(ACTIONS)))
+        with self.lock:
+            job = Job(str(self.next_id), conn, request)
+            try:
+                self.queue.put_nowait(job)
+            except Full:
+                self.totals['rejected'] += 1
+                send_json(conn, 'E', dict(error="queue full ({} jobs waiting)".format(
+                    self.queue_depth)))
+                return False
+            self.next_id += 1
+            self.jobs[job.id] = job
+            self.totals['accepted'] += 1
+            # Acknowledge before a worker can start sending output
+            send_json(conn, 'A', dict(job=job.id))
+        return True
+    
+    
+    def control(self, op, id):
+        """Cancel, pause or resume job id; return reply dict."""
+        with self.lock:
+            job = self.jobs.get(id)
+        if not job:
+            raise ValueError("no such job: {}".format(id))
+        if op == 'cancel':
+            job.cancelled = True
+            job.kill()
+        else:
+            before, after, signum = ('running', 'paused', SIGSTOP) if op == 'pause' else \
+                                    ('paused', 'running', SIGCONT)
+            if job.state != before:
+                raise ValueError("job {} is {}".format(id, job.state))
+            if not job.signal(signum):
+                raise ValueError("job {} has no child process to {}".format(id, op))
+            job.state = after
+        return dict(job=id, state='cancelling' if job.cancelled else job.state)
+    
+    
+    def stats(self):
+        """Return dict describing the pool, the queue & every unfinished job."""
+        with self.lock:
+            jobs = dict((id, job.describe()) for id, job in self.jobs.iteritems())
+            totals = dict(self.totals)
+        return dict(workers=self.workers, queue_depth=self.queue_depth,
+                    queued=self.queue.qsize(),
+                    running=sum(1 for j in jobs.itervalues() if j['state'] != 'queued'),
+                    uptime=round(time() - self.started, 3), totals=totals, jobs=jobs)
+    
+    
+    #----------------------------------------------------------------- WORKERS
+    
+    def engine(self, backend, native):
+        """Return the (shared) engine instance for backend, creating it if needed."""
+        with self.lock:
+            if (backend, native) not in self.engines:
+                self.engines[backend, native] = crypt_interface.new_engine(backend, native)
+            return self.engines[backend, native]
+    
+    
+    def work(self):
+        """Worker thread: run queued jobs one at a time."""
+        while True:
+            job = self.queue.get()
+            try:
+                result = self.run(job)
+            except Exception as e:
+                result = dict(returncode=None, ok=False, stderr="{}\n".format(e))
+            self.finish(job, result)
+    
+    
+    def run(self, job):
+        """Run job on the engine for its backend; return result dict."""
+        x = self.engine(job.backend, job.native)
+        if job.cancelled:
+            return dict(returncode=None, ok=False, stderr='')
+        job.op = crypt_interface.Job(infile=job.infile, outfile=job.outfile,
+                                     stdout=job if not job.outfile else '')
+        if not job.infile:
+            job.op.io['stdin'] = job.input()
+        job.state = 'running'
+        job.started = time()
+        returncode, errors = crypt_interface.run_engine(x, job.action, job=job.op, **job.opts)
+        status = job.op.status
+        return dict(returncode=returncode, stderr=errors,
+                    ok=returncode == 0 and not job.cancelled and not job.broken,
+                    status=status.as_dict() if status else None,
+                    seconds=round(time() - job.started, 4))
+    
+    
+    def finish(self, job, result):
+        """Send job's result, close its connection & update totals."""
+        result.update(job=job.id, cancelled=job.cancelled,
+                      bytes_in=job.bytes_in, bytes_out=job.bytes_out)
+        try:
+            if not job.broken:
+                send_json(job.sock, 'R', result)
+        except socket.error:
+            pass
+        job.sock.close()
+        with self.lock:
+            del self.jobs[job.id]
+            if job.cancelled:
+                self.totals['cancelled'] += 1
+            elif result['ok']:
+                self.totals['completed'] += 1
+            else:
+                self.totals['failed'] += 1
+            self.totals['bytes_in'] += job.bytes_in
+            self.totals['bytes_out'] += job.bytes_out
+
+
+
+class Client():
+    """Talks to a running daemon (one connection per request)."""
+    
+    def __init__(self, path=None):
+        self.path = path or default_socket()
+    
+    
+    def connect(self, request):
+        sock = socket.socket(socket.AF_UNIX)
+        sock.connect(self.path)
+        send_json(sock, 'J', request)
+        return sock
+    
+    
+    def request(self, **request):
+        """Send a control/stats request; return the reply dict (raise IOError on 'E')."""
+        sock = self.connect(request)
+        try:
+            kind, data = recv_frame(sock)
+        finally:
+            sock.close()
+        reply = json.loads(data) if data else {}
+        if kind != 'R':
+            raise IOError(reply.get('error', "no reply from daemon"))
+        return reply
+    
+    
+    def stats(self):
+        return self.request(op='stats')
+    
+    
+    def cancel(self, job):
+        return self.request(op='cancel', job=job)
+    
+    
+    def pause(self, job):
+        return self.request(op='pause', job=job)
+    
+    
+    def resume(self, job):
+        return self.request(op='resume', job=job)
+    
+    
+    def run(self, action, source='', sink=None, on_accept=None, **request):
+        """Run a job; return its result dict (raise IOError if it's refused).
+        
+        source (string, file-like object or iterator) is sent as input from a
+        helper thread, unless request has an infile; output is passed to sink
+        (e.g., somefile.write) as it arrives, or collected into result['stdout'].
+        on_accept, if given, is called with the job id once it's been queued.
+        
+        """
+        request.update(op='job', action=action)
+        sock = self.connect(request)
+        try:
+            kind, data = recv_frame(sock)
+            reply = json.loads(data) if data else {}
+            if kind != 'A':
+                raise IOError(reply.get('error', "no reply from daemon"))
+            if on_accept:
+                on_accept(reply['job'])
+            
+            def feed():
+                try:
+                    for chunk in crypt_interface.iter_chunks(source):
+                        send_frame(sock, 'D', chunk)
+                    send_frame(sock, 'D')
+                except socket.error:
+                    pass
+            
+            if not request.get('infile'):
+                feeder = Thread(target=feed)
+                feeder.daemon = True
+                feeder.start()
+            collected = []
+            while True:
+                kind, data = recv_frame(sock)
+                if kind == 'D':
+                    (sink or collected.append)(data)
+                elif kind == 'R':
+                    result = json.loads(data)
+                    break
+                else:
+                    raise IOError("daemon closed connection")
+            if not sink:
+                result['stdout'] = ''.join(collected)
+            return result
+        finally:
+            sock.close()
+
+
+
+def main(argv):
+    """Entry point for 'pyrite daemon' subcommand; return exit status."""
+    
+    parser = argparse.ArgumentParser(
+        prog='pyrite daemon',
+        description="Headless: serve gpg/openssl jobs to local processes over a "
+                    "Unix socket, or talk to such a daemon.")
+    
+    parser.add_argument('-s', '--socket', default=default_socket(),
+                        help="socket path (default: %(default)s)")
+    
+    sub = parser.add_subparsers(dest='command')
+    
+    p = sub.add_parser('serve', help="run the daemon in the foreground")
+    
+    p.add_argument('-j', '--workers', type=worker_count, default=cpu_count(),
+                   help="jobs to run at once (default: %(default)s)")
+    
+    p.add_argument('-q', '--queue-depth', type=int,
+                   help="jobs allowed to wait for a worker; more are refused "
+                        "(default: 4 per worker)")
+    
+    p = sub.add_parser('submit', help="run one job: input from stdin, output to "
+                                      "stdout, result as JSON on stderr")
+    
+    p.add_argument('action', choices=ACTIONS)
+    
+    add_engine_arguments(p)
+    
+    p = sub.add_parser('stats', help="print daemon statistics as JSON")
+    
+    for command in 'cancel', 'pause', 'resume':
+        p = sub.add_parser(command, help="{} a running job".format(command))
+        p.add_argument('job', help="job id (as given by submit or stats)")
+    
+    args = parser.parse_args(argv)
+    if args.command == 'submit':
+        check_engine_arguments(parser, args)
+    
+    if args.command == 'serve':
+        daemon = Daemon(args.socket, args.workers, args.queue_depth)
+        try:
+            daemon.listen()
+        except (OSError, socket.error) as e:
+            stderr.write("pyrite daemon: {}\n".format(e))
+            return 2
+        # Exit (removing the socket) on SIGTERM just like on Ctrl-C
+        def interrupt(signum, frame):
+            raise KeyboardInterrupt
+        signal(SIGTERM, interrupt)
+        stderr.write("pyrite daemon: listening on {} with {} workers\n".format(
+            args.socket, daemon.workers))
+        try:
+            daemon.serve()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    
+    client = Client(args.socket)
+    try:
+        if args.command == 'submit':
+            opts = engine_opts(args)
+            def announce(id):
+                stderr.write("pyrite daemon: job {}\n".format(id))
+            result = client.run(args.action, stdin, stdout.write, on_accept=announce,
+                                backend=args.backend, native=args.native, opts=opts)
+            stdout.flush()
+            stderr.write(json.dumps(result, sort_keys=True) + "\n")
+            return 0 if result['ok'] else 1
+        elif args.command == 'stats':
+            result = client.stats()
+        else:
+            result = getattr(client, args.command)(args.job)
+    except (IOError, socket.error) as e:
+        stderr.write("pyrite daemon: {}\n".format(e))
+        return 1
+    stdout.write(json.dumps(result, indent=1, sort_keys=True) + "\n")
+    return 0
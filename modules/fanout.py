@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#
+# Encrypt once, deliver to many separate groups of recipients.
+#
+# An OpenPGP message is a run of "session key" packets -- each holding the same
+# random session key, wrapped for one recipient's public key (or a passphrase) --
+# followed by the data packet, which holds the actual (huge) ciphertext. So the
+# data is encrypted once, by gpg, for the union of all groups; then each group's
+# copy gets only the session-key packets of its own recipients in front of the
+# shared data packet. Every copy is a standard OpenPGP message, and no group
+# learns who else got the file. N groups cost one symmetric pass over the data
+# plus one public-key operation per recipient, instead of N full passes.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import argparse
+import struct
+from sys import stderr
+from os import unlink
+from binascii import b2a_base64, hexlify
+# Custom Modules:
+import crypt_interface
+from keyindex import RecipientError
+from batch import add_engine_arguments, engine_opts, check_engine_arguments
+
+# Packet tags: public-key & symmetric-key encrypted session key
+TAG_PKESK       = 1
+TAG_SKESK       = 3
+# Armor lines hold 76 base64 chars == 57 bytes
+ARMOR_LINE      = 57
+ARMOR_CHUNK     = ARMOR_LINE * 1024
+
+
+
+class FanoutError(Exception):
+    pass
+
+
+
+def packet_header(data, pos=0):
+    """Parse the OpenPGP packet header at data[pos:]; return (tag, header length, body length).
+    
+    Body length is None for packets of indeterminate/partial length (i.e., that
+    run on in pieces). Returns None if data ends before the header does.
+    
+    """
+    if pos >= len(data):
+        return None
+    b = ord(data[pos])
+    if not b & 0x80:
+        raise FanoutError("not an OpenPGP packet (byte 0x{:02x} at offset {})".format(b, pos))
+    if b & 0x40:
+        # New format: 1, 2 or 5 length octets
+        if pos + 1 >= len(data):
+            return None
+        tag, o = b & 0x3f, ord(data[pos + 1])
+        if o < 192:
+            return tag, 2, o
+        if o < 224:
+            if pos + 2 >= len(data):
+                return None
+            return tag, 3, ((o - 192) << 8) + ord(data[pos + 2]) + 192
+        if o == 255:
+            if pos + 6 > len(data):
+                return None
+            return tag, 6, struct.unpack('>I', data[pos + 2:pos + 6])[0]
+        return tag, 2, None
+    # Old format: length type in the low 2 bits
+    tag, lentype = (b >> 2) & 0xf, b & 3
+    if lentype == 3:
+        return tag, 1, None
+    fmt = ('>B', '>H', '>I')[lentype]
+    n = struct.calcsize(fmt)
+    if pos + 1 + n > len(data):
+        return None
+    return tag, 1 + n, struct.unpack(fmt, data[pos + 1:pos + 1 + n])[0]
+
+
+def pkesk_keyid(packet, hdrlen):
+    """Return hex key id a version 3 PKESK packet is wrapped for."""
+    body = packet[hdrlen:]
+    if not body or ord(body[0]) != 3:
+        raise FanoutError("unsupported session key packet version")
+    return hexlify(body[1:9]).upper()
+
+
+
+class Armorer():
+    """File-like wrapper writing ASCII-armored PGP MESSAGE to f.
+    
+    No CRC24 checksum line is written: it's optional (and discouraged by RFC
+    9580), and computing it in Python would cost more than the encryption.
+    
+    """
+    
+    def __init__(self, f):
+        self.f = f
+        self._pending = ''
+        f.write("-----BEGIN PGP MESSAGE-----\n\n")
+    
+    
+    def write(self, data):
+        data = self._pending + data
+        cut = len(data) - len(data) % ARMOR_LINE
+        self.f.write(''.join(b2a_base64(data[i:i + ARMOR_LINE])
+                             for i in xrange(0, cut, ARMOR_LINE)))
+        self._pending = data[cut:]
+    
+    
+    def close(self):
+        if self._pending:
+            self.f.write(b2a_base64(self._pending))
+        self.f.write("-----END PGP MESSAGE-----\n")
+
+
+
+class FanoutWriter():
+    """File-like sink for gpg's (binary) output that splits it among the groups.
+    
+    Session-key packets are held back until the data packet starts; then each
+    output gets the packets wrapped for its own group's keys (plus any that
+    belong to no group -- e.g., gpg.conf encrypt-to or a passphrase), and from
+    there on every chunk of ciphertext is written to all outputs as it arrives.
+    
+    groups is a list of sets of primary key fingerprints, outputs a matching list
+    of file-like objects, and owner a function returning the primary key
+    fingerprint for a key id.
+    
+    """
+    
+    def __init__(self, groups, outputs, owner):
+        self.groups     = groups
+        self.outputs    = outputs
+        self.owner      = owner
+        self.packets    = []
+        self._head      = ''
+    
+    
+    def write(self, data):
+        if self._head is None:
+            for out in self.outputs:
+                out.write(data)
+            return
+        self._head += data
+        pos = 0
+        while True:
+            header = packet_header(self._head, pos)
+            if header is None:
+                break
+            tag, hdrlen, length = header
+            if tag not in (TAG_PKESK, TAG_SKESK):
+                self._start_data(self._head[pos:])
+                return
+            if length is None or pos + hdrlen + length > len(self._head):
+                break
+            self.packets.append((tag, self._head[pos:pos + hdrlen + length], hdrlen))
+            pos += hdrlen + length
+        self._head = self._head[pos:]
+    
+    
+    def _start_data(self, data):
+        self._head = None
+        wrapped = []
+        for tag, packet, hdrlen in self.packets:
+            fpr = None
+            if tag == TAG_PKESK:
+                fpr = self.owner(pkesk_keyid(packet, hdrlen))
+            wrapped.append((fpr, packet))
+        for group, out in zip(self.groups, self.outputs):
+            mine = [p for fpr, p in wrapped
+                    if fpr in group or not any(fpr in g for g in self.groups)]
+            out.write(''.join(mine) + data)
+    
+    
+    def close(self):
+        if self._head is not None:
+            raise FanoutError("gpg output ended before the encrypted data")
+
+
+
+class Fanout():
+    """Encrypt one input for many recipient groups in a single gpg pass.
+    
+    opts are the engine keyword args (see crypt_interface.run_engine); recip &
+    asymmetric are filled in per run, and base64 decides whether outputs are
+    armored (gpg itself always writes binary here, so its output can be split).
+    
+    """
+    
+    def __init__(self, backend='gpg2', **opts):
+        if backend == 'openssl':
+            raise FanoutError("fan-out needs gpg: openssl has no public-key encryption")
+        self.opts       = opts
+        self.x          = crypt_interface.new_engine(backend)
+    
+    
+    def owner(self, keyid):
+        """Return primary key fingerprint for (sub)key id, or None if unknown."""
+        keys = self.x.session.recipient_index().lookup(keyid)
+        return keys[0]['fingerprint'] if len(keys) == 1 else None
+    
+    
+    def encrypt(self, source, groups, outfiles):
+        """Encrypt source (filename) once; write one message per group to outfiles.
+        
+        groups is a list of recipient strings (';'-separated names, as for
+        Gpg.gpg()), each naming one group's keys. Raises RecipientError if any
+        name can't be resolved, FanoutError if gpg fails.
+        
+        """
+        if len(set(outfiles)) != len(outfiles) or source in outfiles:
+            raise FanoutError("input & output files must all be different")
+        index = self.x.session.recipient_index()
+        fprs = [index.resolve([r.strip() for r in g.split(';') if r.strip()]) for g in groups]
+        # Exact-subkey ('!') recipients resolve to themselves; group by primary key
+        owned = [set(self.owner(f.rstrip('!')) for f in group) for group in fprs]
+        everyone = []
+        for group in fprs:
+            everyone.extend(f for f in group if f not in everyone)
+        
+        files = []
+        try:
+            for name in outfiles:
+                files.append(open(name, 'wb'))
+            outputs = [Armorer(f) if self.opts.get('base64', True) else f for f in files]
+            writer = FanoutWriter(owned, outputs, self.owner)
+            opts = dict(self.opts, base64=False, asymmetric=True, recip=';'.join(everyone))
+            with open(source, 'rb') as f:
+                op = crypt_interface.Job(stdin=f, stdout=writer)
+                returncode, errors = crypt_interface.run_engine(self.x, 'enc', job=op, **opts)
+            if returncode != 0:
+                raise FanoutError(errors.strip() or "gpg failed")
+            writer.close()
+            for out in outputs:
+                if out not in files:
+                    out.close()
+        except:
+            for f in files:
+                f.close()
+                unlink(f.name)
+            raise
+        for f in files:
+            f.close()
+        return dict(recipients=len(everyone), groups=len(groups),
+                    session_key_packets=len(writer.packets))
+
+
+
+def main(argv):
+    """Entry point for 'pyrite fanout' subcommand; return exit status."""
+    
+    parser = argparse.ArgumentParser(
+        prog='pyrite fanout',
+        description="Headless: encrypt INPUT once for several separate groups of "
+                    "recipients, writing one standard OpenPGP message per group.")
+    
+    parser.add_argument('input', metavar='INPUT', help="input file")
+    
+    parser.add_argument('-g', '--group', action='append', required=True, metavar='NAME[=RECIPS]',
+                        help="a group of recipients (semicolon-separated); just NAME "
+                             "means the gpg.conf group of that name. Give once per group")
+    
+    parser.add_argument('-o', '--output-pattern', metavar='PATTERN',
+                        help="output filenames, with {input} & {group} filled in "
+                             "(default: {input}.{group}.asc, or .gpg with --binary)")
+    
+    add_engine_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    check_engine_arguments(parser, args)
+    
+    if args.backend == 'openssl':
+        parser.error("fan-out needs a gpg backend")
+    pattern = args.output_pattern or '{input}.{group}' + ('.gpg' if args.binary else '.asc')
+    names, groups = [], []
+    for g in args.group:
+        name, _, recips = g.partition('=')
+        names.append(name)
+        groups.append(recips or name)
+    opts = engine_opts(args)
+    # Extra recipients would be given to every group
+    if args.recipients:
+        groups = [g + ';' + args.recipients for g in groups]
+    outfiles = [pattern.format(input=args.input, group=n) for n in names]
+    
+    try:
+        fanout = Fanout(args.backend, **opts)
+        fanout.encrypt(args.input, groups, outfiles)
+    except (FanoutError, RecipientError, IOError, OSError) as e:
+        stderr.write("pyrite fanout: {}\n".format(e))
+        return 1
+    
+    for name in outfiles:
+        stderr.write("pyrite fanout: wrote {}\n".format(name))
+    return 0
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#
+# Parser for gpg's machine-readable status output ('--status-fd N'), i.e.,
+# lines like:
+#
+#   [GNUPG:] GOODSIG 0123456789ABCDEF Some Person <person@example.com>
+#   [GNUPG:] DECRYPTION_OKAY
+#
+# See doc/DETAILS in the GnuPG source for the full list of keywords.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import re
+
+PREFIX = '[GNUPG:] '
+
+# Signature status keywords & what we call them
+SIG_STATUS = {
+    'GOODSIG':      'good',
+    'BADSIG':       'bad',
+    'EXPSIG':       'expired-sig',
+    'EXPKEYSIG':    'expired-key',
+    'REVKEYSIG':    'revoked-key',
+    'ERRSIG':       'error'}
+
+# gpg %-escapes control chars (and '%' itself) in user ids & filenames
+ESCAPED = re.compile(r'%([0-9A-Fa-f]{2})')
+
+TRUST_LEVELS = {
+    'TRUST_UNDEFINED':  'undefined',
+    'TRUST_NEVER':      'never',
+    'TRUST_MARGINAL':   'marginal',
+    'TRUST_FULLY':      'full',
+    'TRUST_ULTIMATE':   'ultimate'}
+
+
+
+class GpgResult():
+    """What a gpg run reported about itself via its status lines.
+    
+    signatures      List of dicts, one per signature verified: status (see
+                    SIG_STATUS), keyid, uid, fingerprint, timestamp, trust, etc
+    created         List of dicts, one per signature made: fingerprint, hash_algo,
+                    pubkey_algo, sig_class, timestamp
+    recipients      Key ids the data was encrypted to (when decrypting)
+    missing_keys    Key ids of those we had no secret key for
+    invalid_recipients  List of (reason code, name) for rejected recipients
+    decryption      None, 'ok' or 'failed'
+    integrity       None, True (MDC/AEAD checked out) or False (tampered with)
+    bad_passphrase  True if gpg said so
+    filename        Original filename stored in the message, if any
+    bytes           Plaintext length or latest progress count (bytes processed)
+    errors          List of (location, code) from ERROR & FAILURE lines
+    nodata          True if gpg found no OpenPGP data
+    lines           Number of status lines seen
+    
+    """
+    
+    def __init__(self):
+        self.signatures         = []
+        self.created            = []
+        self.recipients         = []
+        self.missing_keys       = []
+        self.invalid_recipients = []
+        self.decryption         = None
+        self.integrity          = None
+        self.bad_passphrase     = False
+        self.filename           = None
+        self.bytes              = None
+        self.errors             = []
+        self.nodata             = False
+        self.lines              = 0
+    
+    
+    def good_signatures(self):
+        """Return the signatures that verified as good."""
+        return [s for s in self.signatures if s['status'] == 'good']
+    
+    
+    def as_dict(self):
+        """Return a JSON-friendly dict of everything above."""
+        return dict(
+            signatures=self.signatures, created=self.created,
+            recipients=self.recipients, missing_keys=self.missing_keys,
+            invalid_recipients=self.invalid_recipients, decryption=self.decryption,
+            integrity=self.integrity, bad_passphrase=self.bad_passphrase,
+            filename=self.filename, bytes=self.bytes, errors=self.errors,
+            nodata=self.nodata, lines=self.lines)
+
+
+
+class StatusParser():
+    """Incremental parser turning a gpg status stream into a GpgResult.
+    
+    Feed it data exactly as read from the status fd -- chunks needn't line up
+    with lines. Each byte is looked at a constant number of times (only the
+    unfinished tail of the last chunk is carried over), so cost stays linear in
+    the size of the stream however verbose gpg gets.
+    
+    If callback is given, it's called with (keyword, args string) for every
+    status line as soon as it's complete, e.g. to follow PROGRESS as it happens.
+    
+    """
+    
+    def __init__(self, callback=None):
+        self.result     = GpgResult()
+        self.callback   = callback
+        self._partial   = []
+        self._sig       = None
+    
+    
+    def feed(self, data):
+        """Parse whatever complete lines data finishes; keep the rest for later."""
+        if '\n' not in data:
+            if data:
+                self._partial.append(data)
+            return
+        if self._partial:
+            self._partial.append(data)
+            data = ''.join(self._partial)
+            self._partial = []
+        lines = data.split('\n')
+        if lines[-1]:
+            self._partial.append(lines[-1])
+        for line in lines[:-1]:
+            self.parse_line(line)
+    
+    
+    def close(self):
+        """Parse any final unterminated line and return the GpgResult."""
+        if self._partial:
+            line = ''.join(self._partial)
+            self._partial = []
+            self.parse_line(line)
+        return self.result
+    
+    
+    def parse_line(self, line):
+        """Update result from one status line (non-status & malformed lines are ignored)."""
+        if not line.startswith(PREFIX):
+            return
+        keyword, _, args = line[len(PREFIX):].rstrip('\r').partition(' ')
+        self.result.lines += 1
+        try:
+            if keyword in SIG_STATUS:
+                self._verdict(keyword, args)
+            elif keyword in TRUST_LEVELS:
+                if self._sig:
+                    self._sig['trust'] = TRUST_LEVELS[keyword]
+            else:
+                handler = getattr(self, 'on_' + keyword.lower(), None)
+                if handler:
+                    handler(args.split(' ') if args else [])
+        except (ValueError, IndexError):
+            pass  # e.g., a number field that isn't one; skip the line, keep going
+        if self.callback:
+            self.callback(keyword, args)
+    
+    
+    #-------------------------------------------------------------- SIGNATURES
+    
+    def _new_sig(self):
+        self._sig = dict(status=None, keyid=None, uid=None, fingerprint=None,
+                         timestamp=None, expires=None, pubkey_algo=None,
+                         hash_algo=None, trust=None, error_code=None)
+        self.result.signatures.append(self._sig)
+        return self._sig
+    
+    
+    def on_newsig(self, args):
+        self._new_sig()
+    
+    
+    def _verdict(self, keyword, args):
+        # gpg < 2.1 doesn't send NEWSIG, so a second verdict means a second sig
+        sig = self._sig
+        if sig is None or sig['status'] is not None:
+            sig = self._new_sig()
+        sig['status'] = SIG_STATUS[keyword]
+        if keyword == 'ERRSIG':
+            f = args.split(' ')
+            sig['keyid'] = f[0]
+            if len(f) >= 6:
+                sig['pubkey_algo'], sig['hash_algo'] = int(f[1]), int(f[2])
+                sig['timestamp'], sig['error_code'] = f[4], int(f[5])
+            if len(f) >= 7 and f[6] != '-':
+                sig['fingerprint'] = f[6]
+        else:
+            keyid, _, uid = args.partition(' ')
+            sig['keyid'], sig['uid'] = keyid, unescape(uid) or None
+    
+    
+    def on_validsig(self, args):
+        sig = self._sig or self._new_sig()
+        if len(args) >= 8:
+            sig['fingerprint'] = args[0]
+            sig['timestamp'] = args[2]
+            sig['expires'] = None if args[3] == '0' else args[3]
+            sig['pubkey_algo'], sig['hash_algo'] = int(args[6]), int(args[7])
+    
+    
+    def on_sig_created(self, args):
+        if len(args) >= 6:
+            self.result.created.append(dict(
+                sig_type=args[0], pubkey_algo=int(args[1]), hash_algo=int(args[2]),
+                sig_class=args[3], timestamp=args[4], fingerprint=args[5]))
+    
+    
+    #-------------------------------------------------------------- DECRYPTION
+    
+    def on_enc_to(self, args):
+        if args:
+            self.result.recipients.append(args[0])
+    
+    
+    def on_no_seckey(self, args):
+        if args:
+            self.result.missing_keys.append(args[0])
+    
+    
+    def on_decryption_okay(self, args):
+        self.result.decryption = 'ok'
+    
+    
+    def on_decryption_failed(self, args):
+        self.result.decryption = 'failed'
+    
+    
+    def on_goodmdc(self, args):
+        self.result.integrity = True
+    
+    
+    def on_badmdc(self, args):
+        self.result.integrity = False
+    
+    
+    def on_bad_passphrase(self, args):
+        self.result.bad_passphrase = True
+    
+    
+    def on_plaintext(self, args):
+        if len(args) >= 3:
+            self.result.filename = unescape(' '.join(args[2:])) or None
+    
+    
+    def on_plaintext_length(self, args):
+        if args:
+            self.result.bytes = int(args[0])
+    
+    
+    #------------------------------------------------------------------- OTHER
+    
+    def on_inv_recp(self, args):
+        if args:
+            self.result.invalid_recipients.append((args[0], ' '.join(args[1:])))
+    
+    
+    def on_progress(self, args):
+        if len(args) >= 3 and args[2].isdigit():
+            self.result.bytes = int(args[2])
+    
+    
+    def on_error(self, args):
+        if len(args) >= 2:
+            self.result.errors.append((args[0], args[1]))
+    
+    on_failure = on_error
+    
+    
+    def on_nodata(self, args):
+        self.result.nodata = True
+
+
+
+def unescape(text):
+    """Undo gpg's %XX escaping."""
+    if '%' not in text:
+        return text
+    return ESCAPED.sub(lambda m: chr(int(m.group(1), 16)), text)
+
+
+def parse(text):
+    """Return a GpgResult for a complete status stream."""
+    parser = StatusParser()
+    parser.feed(text)
+    return parser.close()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+#
+# In-memory index of a public keyring, built from one 'gpg --list-keys
+# --with-colons' listing, for resolving recipient names to fingerprints without
+# making gpg search the whole keyring for each name on every call.
+#
+# Names follow (most of) gpg's rules for specifying a key:
+#
+#   0x1234ABCD, 1234567890ABCDEF, <40-hex fingerprint>   key id or fingerprint
+#   <someone@example.com>   exact email          =Full User ID   exact user id
+#   @example.com            email substring      *text           uid substring
+#
+# anything else is matched as an exact email address first, then as a substring
+# of the user ids, ignoring case.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import re
+
+HEXID = re.compile(r'^(?:0x)?([0-9A-Fa-f]{8}|[0-9A-Fa-f]{16}|[0-9A-Fa-f]{32}|[0-9A-Fa-f]{40})(!?)$')
+EMAIL = re.compile(r'<([^<>]+)>\s*$')
+
+# Key validity letters meaning the key can't be used at all
+UNUSABLE = set('rei')
+
+
+
+class RecipientError(Exception):
+    """Raised when recipients can't all be resolved to usable keys.
+    
+    problems is a list of (name, reason) tuples.
+    
+    """
+    
+    def __init__(self, problems):
+        self.problems = problems
+        Exception.__init__(self, "; ".join("{}: {}".format(n, r) for n, r in problems))
+
+
+
+class KeyIndex():
+    """Public keys by fingerprint, with lookup by key id, email & user id.
+    
+    keys maps each primary key fingerprint to a dict: fingerprint, keyid, uids,
+    emails, caps (gpg's capability letters; upper case == usable by the key as
+    a whole), validity & can_encrypt.
+    
+    """
+    
+    def __init__(self, listing, groups=None):
+        """Build index from gpg --with-colons --with-fingerprint listing text."""
+        self.keys       = {}
+        self.groups     = groups or {}
+        self._fprs      = {}
+        self._ids       = {}
+        self._emails    = {}
+        self._uids      = []
+        key = last = None
+        for line in listing.splitlines():
+            f = line.split(':')
+            if f[0] in {'pub', 'sub'} and len(f) > 11:
+                last = dict(keyid=f[4].upper(), validity=f[1], caps=f[11])
+                if f[0] == 'pub':
+                    key = last
+                    key.update(fingerprint=None, uids=[], emails=[])
+            elif f[0] == 'fpr' and last is not None and len(f) > 9:
+                last['fingerprint'] = f[9].upper()
+                if last is key:
+                    self._add_key(key)
+                elif key and key['fingerprint']:
+                    # Subkey: its ids lead to the primary key
+                    self._fprs[last['fingerprint']] = key['fingerprint']
+                    self._add_id(last['keyid'], key['fingerprint'])
+                last = None
+            elif f[0] == 'uid' and key and key['fingerprint'] and len(f) > 9:
+                self._add_uid(key, unescape_colons(f[9]))
+    
+    
+    def _add_key(self, key):
+        fpr = key['fingerprint']
+        key['can_encrypt'] = ('E' in key['caps'] and 'D' not in key['caps'] and
+                              key['validity'] not in UNUSABLE)
+        self.keys[fpr] = key
+        self._fprs[fpr] = fpr
+        self._add_id(key['keyid'], fpr)
+    
+    
+    def _add_id(self, keyid, fpr):
+        # Short (8-hex) ids can collide, so every id maps to a set
+        for k in keyid, keyid[-8:]:
+            self._ids.setdefault(k, set()).add(fpr)
+    
+    
+    def _add_uid(self, key, uid):
+        key['uids'].append(uid)
+        m = EMAIL.search(uid)
+        email = (m.group(1) if m else uid if '@' in uid else '').strip().lower()
+        if email:
+            key['emails'].append(email)
+            self._emails.setdefault(email, set()).add(key['fingerprint'])
+        self._uids.append((uid.lower(), key['fingerprint']))
+    
+    
+    def lookup(self, name):
+        """Return list of key dicts matching name (see top of module for the rules)."""
+        name = name.strip()
+        m = HEXID.match(name)
+        if m:
+            hexid = m.group(1).upper()
+            if len(hexid) == 40:
+                fpr = self._fprs.get(hexid)
+                fprs = [fpr] if fpr else []
+            else:
+                fprs = self._ids.get(hexid, ())
+        elif name.startswith('<'):
+            fprs = self._emails.get(name.strip('<>').lower(), ())
+        elif name.startswith('='):
+            uid = name[1:].lower()
+            fprs = set(f for u, f in self._uids if u == uid)
+        elif name.startswith('@') or name.startswith('*'):
+            fprs = self._search(name[1:].lower())
+        else:
+            fprs = self._emails.get(name.lower()) or self._search(name.lower())
+        return [self.keys[f] for f in sorted(fprs)]
+    
+    
+    def _search(self, text):
+        return set(f for u, f in self._uids if text in u)
+    
+    
+    def resolve(self, names, _seen=()):
+        """Return list of fingerprints (in order, no duplicates) to encrypt to for names.
+        
+        Names may be gpg group names (see groups), which may themselves contain
+        groups. Raise RecipientError for names that match no key, only keys that
+        can't encrypt, or more than one usable key, and for groups that contain
+        themselves. A key id ending in '!' (exact subkey) is passed through as given.
+        
+        """
+        result, problems = [], []
+        
+        def add(item):
+            if item not in result:
+                result.append(item)
+        
+        for name in names:
+            if name in self.groups:
+                if name in _seen:
+                    problems.append((name, "group contains itself"))
+                    continue
+                try:
+                    for fpr in self.resolve(self.groups[name], _seen + (name,)):
+                        add(fpr)
+                except RecipientError as e:
+                    problems.extend(e.problems)
+                continue
+            matches = self.lookup(name)
+            usable = [k for k in matches if k['can_encrypt']]
+            if not matches:
+                problems.append((name, "no public key found"))
+            elif not usable:
+                problems.append((name, "key can't be used for encryption "
+                                       "(revoked, expired, disabled or sign-only)"))
+            elif len(usable) > 1:
+                problems.append((name, "ambiguous; matches {}".format(
+                    ", ".join(k['keyid'] for k in usable))))
+            elif name.endswith('!'):
+                add(name)
+            else:
+                add(usable[0]['fingerprint'])
+        if problems:
+            raise RecipientError(problems)
+        return result
+
+
+
+def unescape_colons(text):
+    """Undo the \\xNN escaping gpg applies to --with-colons user ids."""
+    if '\\' not in text:
+        return text
+    return re.sub(r'\\x([0-9A-Fa-f]{2})', lambda m: chr(int(m.group(1), 16)), text)
+
+
+def read_groups(path):
+    """Return {group name: [members]} from 'group' lines of a gpg.conf (if it exists)."""
+    groups = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line.startswith('group ') or '=' not in line:
+                    continue
+                name, _, members = line[6:].partition('=')
+                groups.setdefault(name.strip(), []).extend(members.split())
+    except IOError:
+        pass
+    return groups
@@ -77,6 +77,12 @@ MESSAGE_DICT = dict(
             "<i>Input File For Direct Operation </i> chooser button.</b>"),
         INFO, WARNING, 8),
     
+    txtview_largefile_filemode = msg(
+        ("<b>File too large for the Message area ({customtext}); opened in direct-file mode.</b>\n"
+            "<small>Showing a read-only preview of:\n"
+            "<i><tt>{filename}</tt></i></small>"),
+        INFO, INFO, 8),
+    
     txtview_save_success = msg(
         ("<b>Saved contents of Message area to file:\n"
             "<i><tt><small>{filename}</small></tt></i></b>"),
@@ -86,7 +92,7 @@ MESSAGE_DICT = dict(
         ("<b>Error. Could not save to file:\n"
             "<i><tt><small>{filename}</small></tt></i></b>"),
         WARNING, ERROR),
-
+    
     txtview_copyall_success = msg(
         ("<b>Copied contents of Message area to clipboard.</b>"),
         INFO, SUCCESS, 3),
@@ -119,7 +125,7 @@ MESSAGE_DICT = dict(
     x_canceled_textmode = msg(
         ("<b>{customtext} operation canceled.</b>"),
         INFO, WARNING, 4),
-
+    
     x_opensslenc_success_filemode = msg(
         ("<b>OpenSSL encrypted input file with {customtext} cipher;\n"
             "saved output to file:\n"
@@ -167,6 +173,11 @@ MESSAGE_DICT = dict(
             "to your <i><tt>gpg.conf</tt></i> file.</small>"),
         WARNING, QUESTION, 0),
     
+    x_bad_recip = msg(
+        ("<b>Can't encrypt to the recipients given.</b>\n"
+            "<small>{customtext}</small>"),
+        WARNING, ERROR, 0),
+    
     x_generic_failed_filemode = msg(
         ("<b>Problem {customtext}ing file.</b>\n"
             "<small>See<i> Task Status </i> for details. Try a different passphrase or <i>Cancel</i>.</small>"),
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+from sys import stderr
+from os import urandom, write, close, fstat
+from hashlib import sha256
+from binascii import b2a_base64, a2b_base64, Error as Base64Error
+from ctypes import CDLL, c_void_p, c_char_p, c_int, byref, create_string_buffer
+from ctypes.util import find_library
+from threading import Lock
+# Custom Modules:
+import crypt_interface
+
+# Key & IV lengths (bytes) for each openssl cipher name in OPENSSL_CIPHERS
+KEY_IV_LENGTHS = {
+    'aes-128-cbc':      (16, 16),
+    'aes-192-cbc':      (24, 16),
+    'aes-256-cbc':      (32, 16),
+    'camellia-128-cbc': (16, 16),
+    'camellia-192-cbc': (24, 16),
+    'camellia-256-cbc': (32, 16),
+    'des-ede3-cbc':     (24, 8),
+    'cast5-cbc':        (16, 8),
+    'bf-cbc':           (16, 8)}
+
+MAGIC = 'Salted__'
+
+_libcrypto = None
+_libcrypto_lock = Lock()
+
+
+
+def load_libcrypto():
+    """Return ctypes handle to libcrypto, raising OSError if it can't be found."""
+    global _libcrypto
+    with _libcrypto_lock:
+        if _libcrypto:
+            return _libcrypto
+        name = find_library('crypto')
+        if not name:
+            raise OSError("libcrypto not found on your system")
+        lib = CDLL(name)
+        lib.EVP_get_cipherbyname.restype    = c_void_p
+        lib.EVP_get_cipherbyname.argtypes   = [c_char_p]
+        lib.EVP_CIPHER_CTX_new.restype      = c_void_p
+        lib.EVP_CIPHER_CTX_free.argtypes    = [c_void_p]
+        lib.EVP_CipherInit_ex.argtypes      = [c_void_p, c_void_p, c_void_p, c_char_p, c_char_p, c_int]
+        lib.EVP_CipherUpdate.argtypes       = [c_void_p, c_char_p, c_void_p, c_char_p, c_int]
+        lib.EVP_CipherFinal_ex.argtypes     = [c_void_p, c_char_p, c_void_p]
+        # OpenSSL < 1.1 needs its cipher table populated before lookups by name
+        if hasattr(lib, 'OPENSSL_add_all_algorithms_noconf'):
+            lib.OPENSSL_add_all_algorithms_noconf()
+        if hasattr(lib, 'OpenSSL_version'):
+            lib.OpenSSL_version.restype = c_char_p
+            lib.version = lib.OpenSSL_version(0)
+        else:
+            lib.SSLeay_version.restype = c_char_p
+            lib.version = lib.SSLeay_version(0)
+        _libcrypto = lib
+        return lib
+
+
+def bytes_to_key(passwd, salt, keylen, ivlen):
+    """Derive (key, iv) from passwd + salt as EVP_BytesToKey does w/sha256, 1 iteration.
+    
+    This is exactly what 'openssl enc -md sha256' does when not given -pbkdf2.
+    
+    """
+    d = di = ''
+    while len(d) < keylen + ivlen:
+        di = sha256(di + passwd + salt).digest()
+        d += di
+    return d[:keylen], d[keylen:keylen+ivlen]
+
+
+def b64encode_chunks(chunks):
+    """Yield base64 text for a stream of data, in openssl's 64-column lines."""
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        n = len(pending) - len(pending) % 48
+        if n:
+            yield ''.join(b2a_base64(pending[i:i+48]) for i in xrange(0, n, 48))
+            pending = pending[n:]
+    if pending:
+        yield b2a_base64(pending)
+
+
+def b64decode_chunks(chunks):
+    """Yield data decoded from a stream of (line-wrapped) base64 text."""
+    pending = ''
+    for chunk in chunks:
+        pending += ''.join(chunk.split())
+        n = len(pending) - len(pending) % 4
+        if n:
+            yield a2b_base64(pending[:n])
+            pending = pending[n:]
+    if pending:
+        yield a2b_base64(pending)
+
+
+
+class CipherContext():
+    """Thin wrapper around an EVP_CIPHER_CTX."""
+    
+    
+    def __init__(self, lib, cipher, key, iv, encrypt):
+        self.lib = lib
+        evp_cipher = lib.EVP_get_cipherbyname(cipher)
+        if not evp_cipher:
+            raise ValueError("{}: unsupported cipher".format(cipher))
+        self.ctx = lib.EVP_CIPHER_CTX_new()
+        if not lib.EVP_CipherInit_ex(self.ctx, evp_cipher, None, key, iv, int(encrypt)):
+            self.free()
+            raise ValueError("{}: cipher not available in this libcrypto".format(cipher))
+    
+    
+    def update(self, data):
+        out = create_string_buffer(len(data) + 32)
+        outlen = c_int(0)
+        if not self.lib.EVP_CipherUpdate(self.ctx, out, byref(outlen), data, len(data)):
+            raise ValueError("cipher update failed")
+        return out.raw[:outlen.value]
+    
+    
+    def final(self):
+        out = create_string_buffer(32)
+        outlen = c_int(0)
+        if not self.lib.EVP_CipherFinal_ex(self.ctx, out, byref(outlen)):
+            raise ValueError("bad decrypt")
+        return out.raw[:outlen.value]
+    
+    
+    def free(self):
+        if self.ctx:
+            self.lib.EVP_CIPHER_CTX_free(self.ctx)
+            self.ctx = None
+
+
+
+def encrypt_chunks(lib, chunks, passwd, cipher):
+    """Yield 'Salted__' + salt + ciphertext for a stream of plaintext chunks."""
+    keylen, ivlen = KEY_IV_LENGTHS[cipher]
+    salt = urandom(8)
+    key, iv = bytes_to_key(passwd, salt, keylen, ivlen)
+    ctx = CipherContext(lib, cipher, key, iv, True)
+    try:
+        yield MAGIC + salt
+        for chunk in chunks:
+            yield ctx.update(chunk)
+        yield ctx.final()
+    finally:
+        ctx.free()
+
+
+def decrypt_chunks(lib, chunks, passwd, cipher):
+    """Yield plaintext for a stream of 'Salted__' + salt + ciphertext chunks."""
+    keylen, ivlen = KEY_IV_LENGTHS[cipher]
+    chunks = iter(chunks)
+    header = ''
+    for chunk in chunks:
+        header += chunk
+        if len(header) >= 16:
+            break
+    if header[:8] != MAGIC or len(header) < 16:
+        raise ValueError("bad magic number")
+    key, iv = bytes_to_key(passwd, header[8:16], keylen, ivlen)
+    ctx = CipherContext(lib, cipher, key, iv, False)
+    try:
+        yield ctx.update(header[16:])
+        for chunk in chunks:
+            yield ctx.update(chunk)
+        yield ctx.final()
+    finally:
+        ctx.free()
+
+
+
+def counted(chunks, progress, source, infile=None):
+    """Yield chunks, counting them in progress (whose total is set from source/infile)."""
+    total = None
+    if infile:
+        total = fstat(infile.fileno()).st_size
+    elif isinstance(source, basestring):
+        total = len(source)
+    progress.begin(total)
+    for chunk in chunks:
+        progress.add(len(chunk))
+        yield chunk
+
+
+
+class Finished():
+    """Stands in for a Popen instance so callers can check returncode as usual."""
+    
+    def __init__(self, returncode):
+        self.returncode = returncode
+    
+    def send_signal(self, sig):
+        pass
+    
+    def terminate(self):
+        pass
+    
+    def wait(self):
+        return self.returncode
+
+
+
+class NativeOpenssl(crypt_interface.Openssl):
+    """In-process drop-in for Openssl, using libcrypto via ctypes.
+    
+    Produces & consumes the same format as 'openssl CIPHER -md sha256 -salt [-a]'
+    (i.e., Salted__ header, EVP_BytesToKey key derivation) for every cipher in
+    OPENSSL_CIPHERS, so files are interchangeable with the Openssl backend --
+    but without a fork/exec per operation.
+    
+    Same io dict as Openssl, including streaming. There is no child process, so
+    childprocess is set to a Finished instance once openssl() returns; error
+    messages are written to io['stderr'][1] like openssl would, and that fd is
+    closed at the end just the same.
+    
+    """
+    
+    
+    def __init__(self, show_version=True):
+        """Confirm we can load libcrypto."""
+        
+        try:
+            self.lib = load_libcrypto()
+        except OSError:
+            stderr.write("libcrypto not found on your system.\n\n")
+            raise
+        
+        # To show or not to show version info
+        if show_version:
+            stderr.write("{} (in-process)\n".format(self.lib.version))
+        
+        # I/O dictionary obj
+        self.io = dict(
+            stdin='',   # Stores input text (or readable file obj/iterator) for subprocess
+            stdout='',  # Stores stdout stream from subprocess (or writable file obj)
+            stderr=0,   # Stores tuple of r/w file descriptors for stderr stream
+            infile=0,   # Input filename for subprocess
+            outfile=0)  # Output filename for subprocess
+        
+        self.childprocess = None
+        self.progress = None
+    
+    
+    def openssl(
+        self,
+        action,         # One of: enc, dec
+        passwd,         # Passphrase for symmetric
+        base64=True,    # Base64-encode/decode ciphertext (like openssl's '-a')?
+        cipher=None,    # Cipher in gpg-format; None = use aes256
+        job=None,       # Job holding io etc for this run; None == use self
+        ):
+        """En/decrypt io['stdin'] or io['infile'] in-process, saving output appropriately."""
+        
+        job = job or self
+        if job.io['infile'] and job.io['infile'] == job.io['outfile']:
+            stderr.write("Same file for both input and output, eh? Is it going "
+                         "to work? ... NOPE. Chuck Testa.\n")
+            raise Exception("infile, outfile must be different")
+        
+        cipher = crypt_interface.openssl_cipher(cipher)
+        # openssl reads only the first line from '-pass fd:N'
+        passwd = passwd.split('\n', 1)[0]
+        job.childprocess = None
+        infile = outfile = collected = None
+        returncode = 0
+        
+        try:
+            if cipher not in KEY_IV_LENGTHS:
+                raise ValueError("{}: unsupported cipher".format(cipher))
+            
+            # Input
+            if job.io['infile']:
+                infile = open(job.io['infile'], 'rb')
+                source = infile
+            else:
+                source = job.io['stdin']
+            chunks = crypt_interface.iter_chunks(source)
+            if job.progress:
+                chunks = counted(chunks, job.progress, source, infile)
+            
+            # Output
+            collected = None
+            if job.io['outfile']:
+                outfile = open(job.io['outfile'], 'wb')
+                sink = outfile.write
+            elif hasattr(job.io['stdout'], 'write'):
+                sink = job.io['stdout'].write
+            else:
+                collected = []
+                sink = collected.append
+            
+            if action in 'enc':
+                chunks = encrypt_chunks(self.lib, chunks, passwd, cipher)
+                if base64:
+                    chunks = b64encode_chunks(chunks)
+            elif action in 'dec':
+                if base64:
+                    chunks = b64decode_chunks(chunks)
+                chunks = decrypt_chunks(self.lib, chunks, passwd, cipher)
+            for chunk in chunks:
+                sink(chunk)
+        
+        except (ValueError, Base64Error, IOError) as e:
+            write(job.io['stderr'][1], "{}\n".format(e))
+            returncode = 1
+        
+        finally:
+            for f in infile, outfile:
+                if f:  f.close()
+        
+        # Save output for later (like openssl, whatever was produced before an error)
+        if collected is not None:
+            job.io['stdout'] = ''.join(collected)
+        
+        # Clear stdin from our dictionary asap, in case it's huge
+        job.io['stdin'] = ''
+        
+        if job.progress:
+            job.progress.finish(returncode == 0)
+        job.childprocess = Finished(returncode)
+        close(job.io['stderr'][1])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+from os import fstat
+from mmap import mmap, ACCESS_READ
+
+# Files bigger than this aren't loaded into the Message area; they're opened in
+#   direct-file mode with a paged preview instead
+LARGE_FILE      = 16 * 1024 * 1024
+# Bytes per page of preview
+PAGESIZE        = 256 * 1024
+# Max number of pages in the Message area at once
+WINDOW_PAGES    = 4
+
+
+
+class FilePager():
+    """Read-only, page-at-a-time access to a (huge) file through mmap.
+    
+    Nothing is read until a page is asked for, and then only that page is
+    touched, so opening a multi-GB file costs next to nothing. Pages end at a
+    newline where possible (pages of one giant line are cut at PAGESIZE), and
+    are returned as unicode, so they can go straight into a GtkTextBuffer.
+    
+    """
+    
+    def __init__(self, filename, pagesize=PAGESIZE):
+        self.filename   = filename
+        self.pagesize   = pagesize
+        self._file      = open(filename, 'rb')
+        self.size       = fstat(self._file.fileno()).st_size
+        # mmap can't map empty files
+        self._map       = mmap(self._file.fileno(), 0, access=ACCESS_READ) if self.size else ''
+        self.npages     = max(1, -(-self.size // pagesize))
+    
+    
+    def page_start(self, n):
+        """Return byte offset where page n starts."""
+        if n <= 0:
+            return 0
+        if n >= self.npages:
+            return self.size
+        pos = n * self.pagesize
+        newline = self._map.find('\n', pos, min(self.size, pos + self.pagesize))
+        return pos if newline == -1 else newline + 1
+    
+    
+    def page(self, n):
+        """Return text of page n (unicode; undecodable bytes & NULs replaced)."""
+        data = self._map[self.page_start(n):self.page_start(n + 1)]
+        return data.decode('utf-8', 'replace').replace(u'\0', u'\ufffd')
+    
+    
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
@@ -69,12 +69,14 @@ class Preferences:
                 enctoself=False,
                 cipher=1,
                 addsig=False,
+                compress=0,
                 # Mode-Independent
                 digest=0,
                 defkey=False,
                 defkeytxt='',
                 txtoutput=0,
                 expander=False,
+                fastpath=False,
                 # Sign/Verify Mode
                 svoutfiles=False,
                 text_sigmode=1,
@@ -108,8 +110,8 @@ class Preferences:
         # Find the needed dictionary inside our message dict, by id
         MSG = MESSAGE_DICT[id]
         # Use value from MSG type & icon to lookup Gtk constant, e.g. gtk.MESSAGE_INFO
-        msgtype = cfg.MSGTYPES[ MSG['type'] ]
-        imgtype = cfg.IMGTYPES[ MSG['icon'] ]
+        msgtype = cfg.gtk_constant(cfg.MSGTYPES[ MSG['type'] ])
+        imgtype = cfg.gtk_constant(cfg.IMGTYPES[ MSG['icon'] ])
         # Replace variables in message text & change text color
         message = ("<span foreground='#2E2E2E'>" +
                    MSG['text'].format(filename=filename, customtext=customtext) +
@@ -152,12 +154,14 @@ class Preferences:
         self.tg_enctoself   = builder.get_object('tg_enctoself')
         self.cb_cipher      = builder.get_object('cb_cipher')
         self.tg_addsig      = builder.get_object('tg_addsig')
+        self.cb_compress    = builder.get_object('cb_compress')
         # Mode-Independent
         self.cb_digest      = builder.get_object('cb_digest')
         self.tg_defkey      = builder.get_object('tg_defkey')
         self.ent_defkey     = builder.get_object('ent_defkey')
         self.cb_txtoutput   = builder.get_object('cb_txtoutput')
         self.tg_expander    = builder.get_object('tg_expander')
+        self.tg_fastpath    = builder.get_object('tg_fastpath')
         # Sign/Verify Mode
         self.tg_svoutfiles  = builder.get_object('tg_svoutfiles')
         self.cb_text_sigmode= builder.get_object('cb_text_sigmode')
@@ -196,12 +200,14 @@ class Preferences:
         self.tg_enctoself.set_active    (self.p['enctoself'])
         self.cb_cipher.set_active       (self.p['cipher'])
         self.tg_addsig.set_active       (self.p['addsig'])
+        self.cb_compress.set_active     (self.p['compress'])
         # Mode-Independent
         self.cb_digest.set_active       (self.p['digest'])
         self.tg_defkey.set_active       (self.p['defkey'])
         self.ent_defkey.set_text        (self.p['defkeytxt'])
         self.cb_txtoutput.set_active    (self.p['txtoutput'])
         self.tg_expander.set_active     (self.p['expander'])
+        self.tg_fastpath.set_active     (self.p['fastpath'])
         # Sign/Verify Mode
         self.tg_svoutfiles.set_active   (self.p['svoutfiles'])
         self.cb_text_sigmode.set_active (self.p['text_sigmode'])
@@ -231,12 +237,14 @@ class Preferences:
             'enctoself'   : self.tg_enctoself.get_active(),
             'cipher'      : self.cb_cipher.get_active(),
             'addsig'      : self.tg_addsig.get_active(),
+            'compress'    : self.cb_compress.get_active(),
             # Mode-Independent
             'digest'      : self.cb_digest.get_active(),
             'defkey'      : self.tg_defkey.get_active(),
             'defkeytxt'   : self.ent_defkey.get_text(),
             'txtoutput'   : self.cb_txtoutput.get_active(),
             'expander'    : self.tg_expander.get_active(),
+            'fastpath'    : self.tg_fastpath.get_active(),
             # Sign/Verify Mode
             'svoutfiles'  : self.tg_svoutfiles.get_active(),
             'text_sigmode': self.cb_text_sigmode.get_active(),
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+from os import listdir, readlink, lseek, fstat, SEEK_CUR
+from os.path import realpath, getsize
+from stat import S_ISREG
+from threading import Thread, Lock, Event
+from time import time
+
+# How often (seconds) to look at a child's file position & to call callbacks
+INTERVAL = 0.25
+
+
+
+def format_eta(seconds):
+    """Return seconds as H:MM:SS (or M:SS), or '?' if unknown."""
+    if seconds is None:
+        return '?'
+    m, s = divmod(int(round(seconds)), 60)
+    h, m = divmod(m, 60)
+    if h:
+        return "{}:{:02}:{:02}".format(h, m, s)
+    return "{}:{:02}".format(m, s)
+
+
+def describe(snapshot):
+    """Return Progress snapshot as short text, e.g.: '42%  85.3 MB/s  ETA 0:12'."""
+    text = "{:.1f} MB/s".format(snapshot['rate'] / 1e6)
+    if snapshot['fraction'] is not None:
+        return "{:.0%}  {}  ETA {}".format(snapshot['fraction'], text,
+                                           format_eta(snapshot['eta']))
+    return "{:.1f} MB  {}".format(snapshot['bytes'] / 1e6, text)
+
+
+def child_file_position(pid, path):
+    """Return current offset of process pid in its open file path, or None.
+    
+    Linux-only (reads /proc); None whenever it can't be determined.
+    
+    """
+    path = realpath(path)
+    fddir = '/proc/{}/fd'.format(pid)
+    try:
+        for fd in listdir(fddir):
+            try:
+                if readlink('{}/{}'.format(fddir, fd)) != path:
+                    continue
+                with open('/proc/{}/fdinfo/{}'.format(pid, fd)) as f:
+                    for line in f:
+                        if line.startswith('pos:'):
+                            return int(line.split()[1])
+            except (OSError, IOError):
+                continue
+    except OSError:
+        pass
+    return None
+
+
+def fd_position(fd):
+    """Return current offset of (possibly shared) file descriptor fd, or None."""
+    try:
+        return lseek(fd, 0, SEEK_CUR)
+    except OSError:
+        return None
+
+
+def regular_file_size(fd):
+    """Return size of what fd refers to if it's a regular file, else None."""
+    try:
+        st = fstat(fd)
+    except OSError:
+        return None
+    return st.st_size if S_ISREG(st.st_mode) else None
+
+
+
+class Progress():
+    """Byte counter for one engine operation, with throughput, percent & ETA.
+    
+    Give an instance to a job (job.progress = Progress(...)) before launching
+    it. The engine counts input bytes as they're consumed -- by the child or
+    in-process -- and fills in total when it can work it out (input file size).
+    
+    callback, if given, is called with a snapshot() dict from the counting
+    thread at most every interval seconds, and always once more at the end. GUI
+    code should instead (or also) poll snapshot() from its main loop.
+    
+    """
+    
+    def __init__(self, total=None, callback=None, interval=INTERVAL):
+        self.total      = total
+        self.callback   = callback
+        self.interval   = interval
+        self.bytes      = 0
+        self.start      = None
+        self.finished   = False
+        self._lock      = Lock()
+        self._last_call = 0
+    
+    
+    def begin(self, total=None):
+        """Start the clock (called by the engine at launch)."""
+        with self._lock:
+            self.start = self._last_call = time()
+            self.bytes = 0
+            self.finished = False
+            if total is not None:
+                self.total = total
+    
+    
+    def add(self, n):
+        """Count n more bytes consumed."""
+        with self._lock:
+            self.bytes += n
+        self._notify()
+    
+    
+    def set(self, n):
+        """Set bytes consumed so far (e.g., from a file position)."""
+        with self._lock:
+            self.bytes = max(self.bytes, n)
+        self._notify()
+    
+    
+    def finish(self, ok=True):
+        """Mark operation done and make the final callback.
+        
+        If it went ok, all input was consumed, whatever the last count said.
+        
+        """
+        with self._lock:
+            self.finished = True
+            if ok and self.total is not None and self.bytes < self.total:
+                self.bytes = self.total
+        self._notify(force=True)
+    
+    
+    def snapshot(self):
+        """Return dict: bytes, total, fraction, rate (bytes/s), eta (s), elapsed (s), finished.
+        
+        fraction & eta are None while total is unknown; eta is also None until
+        some bytes have gone through.
+        
+        """
+        with self._lock:
+            done, total, start, finished = self.bytes, self.total, self.start, self.finished
+        elapsed = time() - start if start else 0.0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        fraction = eta = None
+        if total:
+            fraction = min(1.0, float(done) / total)
+            if rate > 0:
+                eta = max(0.0, (total - done) / rate)
+        elif total == 0:
+            fraction = 1.0
+        return dict(bytes=done, total=total, fraction=fraction, rate=rate, eta=eta,
+                    elapsed=elapsed, finished=finished)
+    
+    
+    def describe(self):
+        """Return current snapshot as short text (see describe())."""
+        return describe(self.snapshot())
+    
+    
+    def _notify(self, force=False):
+        if not self.callback:
+            return
+        now = time()
+        if not force and now - self._last_call < self.interval:
+            return
+        self._last_call = now
+        self.callback(self.snapshot())
+
+
+
+def watch_child_input(childprocess, io, progress):
+    """Start a thread following how far childprocess has read its input.
+    
+    Handles the input sources the engine itself doesn't see go by: io['infile']
+    (file position read from /proc) and io['stdin'] file objects handed straight
+    to the child (position of the shared descriptor). Returns None if there's
+    nothing to watch -- i.e., input is fed through a pipe and counted by the
+    feeder instead (see crypt_interface.communicate_child()). Otherwise returns
+    an Event; set it once the child has exited to stop the thread. (The thread
+    mustn't poll() the child itself, as that could race with the engine's wait().)
+    
+    """
+    if io['infile']:
+        path = io['infile']
+        try:
+            progress.total = getsize(path)
+        except OSError:
+            pass
+        position = lambda: child_file_position(childprocess.pid, path)
+    elif childprocess.stdin is None and hasattr(io['stdin'], 'fileno'):
+        fd = io['stdin'].fileno()
+        size = regular_file_size(fd)
+        offset = fd_position(fd) or 0
+        if size is not None and progress.total is None:
+            progress.total = size - offset
+        position = lambda: (fd_position(fd) or offset) - offset
+    else:
+        return None
+    
+    stopped = Event()
+    
+    def poll():
+        while not stopped.wait(progress.interval):
+            pos = position()
+            if pos is not None:
+                progress.set(pos)
+    
+    t = Thread(target=poll)
+    t.daemon = True
+    t.start()
+    return stopped
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#
+# Re-encryption (e.g., key rotation) of many files without plaintext ever
+# touching the disk: each file is decrypted by one engine whose output is piped
+# straight into a second engine encrypting it anew. With gpg & the openssl
+# program, the pipe connects the two child processes directly -- Python only
+# sets it up -- so each file costs one read & one write, and a pool of workers
+# keeps every core busy.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import argparse
+import json
+from sys import stdin, stdout, stderr
+from os import fdopen, rename, unlink, chmod, stat, makedirs
+from os.path import dirname, basename, relpath, join, isfile, isdir, abspath
+from tempfile import mkstemp
+from threading import Thread
+from multiprocessing import cpu_count
+from time import time
+# Custom Modules:
+import crypt_interface
+import threadpool
+from batch import (read_manifest, walk_tree, add_engine_arguments, engine_opts,
+                   worker_count, check_engine_arguments)
+
+
+
+class Reencrypt:
+    """Decrypt & re-encrypt many files, each through a pipe, with a pool of workers.
+    
+    dec_opts & enc_opts are the engine keyword args (see crypt_interface.run_engine)
+    for the old & new encryption. Workers share one engine for each, every file
+    getting its own pair of crypt_interface.Jobs. New files are written to a
+    temporary name next to their final one and renamed into place only if both
+    sides succeeded, so a failure never leaves a truncated file behind -- and
+    rotating in place (same name) never loses the original.
+    
+    """
+    
+    
+    def __init__(self, dec_backend, dec_opts, enc_backend, enc_opts,
+                 workers=None, dec_native=False, enc_native=False):
+        if enc_backend == 'openssl' and not enc_opts.get('passwd'):
+            raise ValueError("OpenSSL needs a passphrase to encrypt with")
+        self.dec_backend    = dec_backend
+        self.dec_opts       = dec_opts
+        self.dec_native     = dec_native
+        self.enc_backend    = enc_backend
+        self.enc_opts       = enc_opts
+        self.enc_native     = enc_native
+        self.workers        = workers or cpu_count()
+        self.remove_old     = False
+        # Fail early if either backend is missing
+        self.xdec           = crypt_interface.new_engine(dec_backend, dec_native)
+        self.xenc           = crypt_interface.new_engine(enc_backend, enc_native)
+    
+    
+    def new_name(self, infile):
+        """Return filename for the re-encrypted infile: old extension swapped for the new one."""
+        plain = crypt_interface.default_outfile(infile, 'dec')
+        return crypt_interface.default_outfile(
+            plain, 'enc', self.enc_opts.get('base64', True), self.enc_backend)
+    
+    
+    def run_job(self, job):
+        """Re-encrypt one (infile, outfile) job and return a dict describing the result."""
+        
+        infile, outfile = job
+        outfile = outfile or self.new_name(infile)
+        result = dict(infile=infile, outfile=outfile, action='reencrypt')
+        start = time()
+        if not isfile(infile):
+            result.update(ok=False, seconds=0.0, stderr="No such file: {}".format(infile))
+            return result
+        
+        try:
+            src = open(infile, 'rb')
+            fd, tmpname = mkstemp(dir=dirname(outfile) or '.', suffix='.part',
+                                  prefix='.{}.'.format(basename(outfile)))
+        except (OSError, IOError) as e:
+            result.update(ok=False, seconds=0.0, stderr="{}\n".format(e))
+            return result
+        out = fdopen(fd, 'wb')
+        r, w = crypt_interface.cloexec_pipe()
+        pipe_r, pipe_w = fdopen(r, 'rb'), fdopen(w, 'wb')
+        opdec = crypt_interface.Job(stdin=src, stdout=pipe_w)
+        openc = crypt_interface.Job(stdin=pipe_r, stdout=out)
+        dec = dict(rc=None, err='')
+        error = ''
+        
+        def decrypt():
+            try:
+                dec['rc'], dec['err'] = crypt_interface.run_engine(self.xdec, 'dec', job=opdec,
+                                                                   **self.dec_opts)
+            finally:
+                # Encrypting side sees EOF only once nobody holds the write end
+                pipe_w.close()
+        
+        try:
+            t = Thread(target=decrypt)
+            t.daemon = True
+            t.start()
+            try:
+                enc_rc, enc_err = crypt_interface.run_engine(self.xenc, 'enc', job=openc,
+                                                             **self.enc_opts)
+            finally:
+                # Likewise, a decryptor writing to a dead encryptor gets EPIPE (not stuck)
+                pipe_r.close()
+                t.join()
+            ok = dec['rc'] == 0 and enc_rc == 0
+            try:
+                out.close()
+                if ok:
+                    chmod(tmpname, stat(infile).st_mode & 0o7777)
+                    rename(tmpname, outfile)
+                    if self.remove_old and abspath(outfile) != abspath(infile):
+                        unlink(infile)
+            except (OSError, IOError) as e:
+                # Just this file failed; don't let it end the whole run
+                ok = False
+                error = "{}\n".format(e)
+        finally:
+            src.close()
+            out.close()
+            if isfile(tmpname):
+                unlink(tmpname)
+        
+        result.update(ok=ok, seconds=round(time() - start, 4),
+                      dec_returncode=dec['rc'], enc_returncode=enc_rc,
+                      stderr=dec['err'] + enc_err + error)
+        if opdec.status:
+            result['status'] = opdec.status.as_dict()
+        return result
+    
+    
+    def run(self, jobs, callback):
+        """Run all jobs on the worker pool, calling callback(result) as each finishes.
+        
+        Returns number of jobs that failed.
+        
+        """
+        failed = 0
+        for result in threadpool.imap_unordered(self.run_job, jobs, self.workers):
+            if not result['ok']:
+                failed += 1
+            callback(result)
+        return failed
+
+
+
+def main(argv):
+    """Entry point for 'pyrite reencrypt' subcommand; return exit status."""
+    
+    parser = argparse.ArgumentParser(
+        prog='pyrite reencrypt',
+        description="Headless: decrypt & re-encrypt many files (e.g., to rotate keys), "
+                    "piping each one straight from decryption to encryption so that no "
+                    "plaintext is written to disk. The engine options below are for the "
+                    "new encryption; --from-* ones describe the old.")
+    
+    g1 = parser.add_mutually_exclusive_group(required=True)
+    
+    g1.add_argument('-m', '--manifest', metavar='FILE',
+                    help="file listing one INPUT[<TAB>OUTPUT] per line ('-' for stdin)")
+    
+    g1.add_argument('-D', '--dir', metavar='DIR',
+                    help="process every file under DIR (recursively)")
+    
+    parser.add_argument('-p', '--pattern', default='*',
+                        help="with --dir, only process filenames matching this glob")
+    
+    parser.add_argument('-O', '--output-dir', metavar='DIR',
+                        help="with --dir, write new files to the same places under DIR "
+                             "(default: next to the old ones)")
+    
+    parser.add_argument('--remove-old', action='store_true',
+                        help="delete each old file once its replacement is written (files "
+                             "whose name doesn't change are always replaced)")
+    
+    parser.add_argument('-j', '--workers', type=worker_count, default=cpu_count(),
+                        help="number of files to process at once (default: %(default)s)")
+    
+    parser.add_argument('--from-backend', choices=('gpg2', 'gpg', 'openssl'), default='gpg2',
+                        help="backend the files are encrypted with now (default: %(default)s)")
+    
+    parser.add_argument('--from-native', action='store_true',
+                        help="with --from-backend openssl, decrypt in-process via libcrypto")
+    
+    parser.add_argument('--from-passphrase-file', metavar='FILE',
+                        help="read passphrase the files are (symmetrically) encrypted with "
+                             "from first line of FILE")
+    
+    parser.add_argument('--from-cipher', help="with --from-backend openssl, cipher the files "
+                                              "are encrypted with")
+    
+    parser.add_argument('--from-binary', action='store_true',
+                        help="with --from-backend openssl, files aren't ascii-armored")
+    
+    add_engine_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    check_engine_arguments(parser, args)
+    
+    if args.output_dir and not args.dir:
+        parser.error("--output-dir needs --dir")
+    if args.from_backend == 'openssl' and not args.from_passphrase_file:
+        parser.error("--from-backend openssl needs --from-passphrase-file")
+    
+    passwd = None
+    if args.from_passphrase_file:
+        with open(args.from_passphrase_file) as f:
+            passwd = f.readline().rstrip('\r\n')
+    if args.from_backend == 'openssl':
+        dec_opts = dict(passwd=passwd, base64=not args.from_binary, cipher=args.from_cipher)
+    else:
+        dec_opts = dict(symmetric=bool(passwd), passwd=passwd, alwaystrust=True)
+    
+    try:
+        reencrypt = Reencrypt(args.from_backend, dec_opts, args.backend, engine_opts(args),
+                              args.workers, args.from_native, args.native)
+    except (ValueError, OSError) as e:
+        stderr.write("pyrite reencrypt: {}\n".format(e))
+        return 2
+    
+    reencrypt.remove_old = args.remove_old
+    
+    if args.dir:
+        jobs = walk_tree(args.dir, args.pattern)
+        if args.output_dir:
+            mapped = []
+            for infile, _ in jobs:
+                outfile = reencrypt.new_name(join(args.output_dir, relpath(infile, args.dir)))
+                if not isdir(dirname(outfile)):
+                    makedirs(dirname(outfile))
+                mapped.append((infile, outfile))
+            jobs = mapped
+    elif args.manifest == '-':
+        jobs = list(read_manifest(stdin))
+    else:
+        with open(args.manifest) as f:
+            jobs = list(read_manifest(f))
+    
+    def report(result):
+        stdout.write(json.dumps(result, sort_keys=True) + "\n")
+        stdout.flush()
+    
+    failed = reencrypt.run(jobs, report)
+    stderr.write("pyrite reencrypt: {} files, {} failed\n".format(len(jobs), failed))
+    return 1 if failed else 0
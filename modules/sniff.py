@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+from os import stat
+from math import log
+from threading import Lock
+
+# How much of the start of a file to look at
+SAMPLE_SIZE = 8 * 1024
+
+# Control chars that aren't at home in text files (i.e., all but \t\n\r\f\b & ESC);
+#   more than this fraction of them => binary
+BAD_CONTROLS = ''.join(chr(i) for i in xrange(32) if chr(i) not in '\t\n\r\f\b\x1b')
+MAX_CONTROL_FRACTION = 0.05
+# Real text (even UTF-8 encoded) doesn't get near 8 bits/byte
+MAX_TEXT_ENTROPY = 7.0
+
+# Leading bytes of formats that are already compressed (or encrypted), so that
+#   compressing them again is wasted effort
+COMPRESSED_MAGIC = (
+    '\x1f\x8b',                 # gzip
+    'BZh',                      # bzip2
+    '\xfd7zXZ\x00',             # xz
+    '\x28\xb5\x2f\xfd',         # zstd
+    '\x04\x22\x4d\x18',         # lz4
+    '\x89LZO',                  # lzop
+    'PK\x03\x04',               # zip, jar, docx/xlsx/odt, epub, apk
+    '7z\xbc\xaf\x27\x1c',       # 7-zip
+    'Rar!\x1a\x07',             # rar
+    '\xff\xd8\xff',             # jpeg
+    '\x89PNG\r\n\x1a\n',        # png
+    'GIF8',                     # gif
+    'OggS',                     # ogg/opus/vorbis
+    'fLaC',                     # flac
+    'ID3',                      # mp3
+    '\x1aE\xdf\xa3',            # matroska/webm
+    'Salted__')                 # openssl enc output
+# Compressed & encrypted data are (nearly) 8 bits/byte; below this much, or in
+#   samples too small to tell, gpg's compression is left alone
+MIN_COMPRESSED_ENTROPY = 7.5
+MIN_ENTROPY_SAMPLE = 1024
+
+# Cache size cap; when full, it's simply emptied
+MAX_CACHED = 10000
+
+_cache = {}
+_cache_lock = Lock()
+
+
+
+def entropy(data):
+    """Return Shannon entropy of string data in bits per byte (0.0 - 8.0)."""
+    if not data:
+        return 0.0
+    n = float(len(data))
+    # 256 passes of str.count() beat one pass of Python-level counting by far
+    counts = (data.count(chr(i)) for i in xrange(256))
+    return -sum(k / n * log(k / n, 2) for k in counts if k)
+
+
+def sample_is_binary(data, truncated=False):
+    """Return True if data doesn't look like ASCII/UTF-8 text.
+    
+    truncated means data is only the start of something bigger, so it's
+    allowed to end part way through a multibyte UTF-8 sequence.
+    
+    """
+    if '\0' in data:
+        return True
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Cut-off multibyte char at the very end of the sample is fine
+        if not (truncated and e.start >= len(data) - 3 and e.reason == 'unexpected end of data'):
+            return True
+    controls = len(data) - len(data.translate(None, BAD_CONTROLS))
+    if controls > MAX_CONTROL_FRACTION * len(data):
+        return True
+    return entropy(data) > MAX_TEXT_ENTROPY
+
+
+def sample_is_compressed(data):
+    """Return True if data (the start of something) looks compressed or encrypted."""
+    # MP4/MOV/M4A/HEIC & co. have their 'ftyp' box at offset 4
+    if data.startswith(COMPRESSED_MAGIC) or data[4:8] == 'ftyp':
+        return True
+    return len(data) >= MIN_ENTROPY_SAMPLE and entropy(data) > MIN_COMPRESSED_ENTROPY
+
+
+def is_binary(filename):
+    """Return True if filename looks binary, False if it looks like text.
+    
+    Only the first SAMPLE_SIZE bytes are read. Results are cached by (device,
+    inode, size, mtime), so asking again about an unchanged file costs one stat.
+    Raises OSError/IOError if filename can't be read.
+    
+    """
+    return _sniff_file(filename, 'binary')
+
+
+def is_compressed(filename):
+    """Return True if filename looks already compressed or encrypted (cached as above)."""
+    return _sniff_file(filename, 'compressed')
+
+
+def _sniff_file(filename, question):
+    st = stat(filename)
+    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime, question)
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+    with open(filename, 'rb') as f:
+        data = f.read(SAMPLE_SIZE)
+    if question == 'binary':
+        result = sample_is_binary(data, truncated=st.st_size > len(data))
+    else:
+        result = sample_is_compressed(data)
+    with _cache_lock:
+        if len(_cache) >= MAX_CACHED:
+            _cache.clear()
+        _cache[key] = result
+    return result
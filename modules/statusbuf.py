@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+
+
+# StdLib:
+from collections import deque
+
+# Lines longer than this are split (so one runaway line can't grow unbounded)
+MAX_LINE = 4096
+
+
+
+class StatusBuffer():
+    """Ring buffer of the last maxlines lines of a stream, handed out as increments.
+    
+    feed() takes data in chunks of any size, as read from a pipe; take() returns
+    what arrived since the previous take(), ready to be appended to a display.
+    Memory use stays bounded by maxlines (plus MAX_LINE for an unfinished line)
+    however much is fed in. If more than maxlines lines arrive between two takes,
+    the display can't be caught up by appending, so take() tells the caller to
+    replace what it shows instead.
+    
+    """
+    
+    def __init__(self, maxlines):
+        self.maxlines   = maxlines
+        self.dropped    = 0
+        self._lines     = deque(maxlen=maxlines)
+        self._partial   = ''
+        # Complete lines not yet taken & chars of current line already taken
+        self._new       = 0
+        self._shown     = 0
+        self._overrun   = False
+    
+    
+    def feed(self, data):
+        """Add data (a str of any length) to the end of the buffer."""
+        if not data:
+            return
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        while len(self._partial) > MAX_LINE:
+            lines.append(self._partial[:MAX_LINE])
+            self._partial = self._partial[MAX_LINE:]
+        if not lines:
+            return
+        overflow = len(self._lines) + len(lines) - self.maxlines
+        if overflow > 0:
+            self.dropped += overflow
+        # Only the last maxlines of them can be kept anyway
+        for line in lines[-self.maxlines:]:
+            self._lines.append(line + '\n')
+        self._new += len(lines)
+        if self._new > self.maxlines:
+            self._overrun = True
+    
+    
+    def pending(self):
+        """Return True if there's anything take() would return."""
+        return bool(self._new or self._overrun or len(self._partial) > self._shown)
+    
+    
+    def take(self):
+        """Return (replace, text): text that arrived since last take & whether it's everything.
+        
+        If replace is False, text continues what previous takes returned;
+        otherwise it's the whole (capped) buffer, prefixed by a note of how many
+        lines were dropped, and should replace what's shown.
+        
+        """
+        if self._overrun:
+            text = ''.join(self._lines) + self._partial
+            if self.dropped:
+                text = "[... {} earlier lines not shown ...]\n".format(self.dropped) + text
+            replace = True
+        else:
+            new = list(self._lines)[len(self._lines) - self._new:] if self._new else []
+            text = (''.join(new) + self._partial)[self._shown:]
+            replace = False
+        self._new = 0
+        self._overrun = False
+        self._shown = len(self._partial)
+        return replace, text
+    
+    
+    def getvalue(self):
+        """Return the whole (capped) buffer as a string."""
+        return ''.join(self._lines) + self._partial
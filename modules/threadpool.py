@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#
+# Minimal stand-in for multiprocessing.pool.ThreadPool's imap/imap_unordered.
+# Our jobs spend their time waiting on child processes, so threads are all we
+# need -- and unlike ThreadPool, this doesn't cost ~20ms to import or make every
+# run (and interpreter exit) wait out its 100ms housekeeping sleep.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+from sys import exc_info
+from threading import Thread
+from Queue import Queue
+from multiprocessing import cpu_count
+
+_DONE = object()
+
+
+
+def imap(func, iterable, workers=None, ordered=True):
+    """Yield func(item) for each item of iterable, computed by up to workers threads.
+    
+    Results come back in input order if ordered, else as soon as they're ready.
+    iterable is consumed lazily, from a helper thread, so it may block (e.g., to
+    limit how much work is in flight). If func raises, the exception is re-raised
+    here; remaining queued items are then skipped.
+    
+    """
+    workers = workers or cpu_count()
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    tasks = Queue(workers)
+    results = Queue()
+    state = dict(stop=False)
+    
+    def feed():
+        try:
+            for task in enumerate(iterable):
+                if state['stop']:
+                    break
+                tasks.put(task)
+        except Exception:
+            results.put((None, False, exc_info()))
+        for i in xrange(workers):
+            tasks.put(_DONE)
+    
+    def work():
+        while True:
+            task = tasks.get()
+            if task is _DONE:
+                results.put(_DONE)
+                return
+            i, item = task
+            if state['stop']:
+                continue
+            try:
+                results.put((i, True, func(item)))
+            except Exception:
+                results.put((i, False, exc_info()))
+    
+    threads = [Thread(target=feed)] + [Thread(target=work) for i in xrange(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    
+    pending = {}
+    next_index = 0
+    running = workers
+    try:
+        while running:
+            r = results.get()
+            if r is _DONE:
+                running -= 1
+                continue
+            i, ok, value = r
+            if not ok:
+                raise value[0], value[1], value[2]
+            if not ordered:
+                yield value
+                continue
+            pending[i] = value
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+    finally:
+        state['stop'] = True
+
+
+def imap_unordered(func, iterable, workers=None):
+    """Like imap(), but yield results as soon as they're ready."""
+    return imap(func, iterable, workers, ordered=False)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#
+# Incremental tree encryption: encrypt every file under a source directory
+# into the same places under a destination directory, remembering in a manifest
+# what each output was made from (size, mtime & sha256 of the input, sha256 of
+# the output, and the recipients/cipher/etc used). The next run encrypts only
+# files that are new, whose content changed, or whose encryption settings
+# changed. The manifest is appended to as each file is done, so a run that's
+# interrupted picks up where it left off.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import argparse
+import json
+from sys import stdout, stderr
+from os import stat, close, rename, unlink, makedirs, fdopen
+from os.path import join, dirname, basename, relpath, abspath, isdir
+from glob import glob
+from hashlib import sha256
+from tempfile import mkstemp
+from multiprocessing import cpu_count
+from time import time
+# Custom Modules:
+import crypt_interface
+import threadpool
+from batch import (Batch, walk_tree, add_engine_arguments, engine_opts,
+                   worker_count, check_engine_arguments)
+from keyindex import RecipientError
+
+# Manifest filename, kept in the destination directory
+MANIFEST = '.pyrite-manifest'
+
+
+
+def file_digest(path, chunksize=crypt_interface.CHUNKSIZE):
+    """Return hex sha256 of the contents of file path."""
+    h = sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), ''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+
+class TreeCrypt:
+    """Encrypt a tree of files into another, skipping files encrypted by an earlier run.
+    
+    Each manifest entry (one JSON object per line; the last line for a path
+    wins) records: path (relative to srcdir), size, mtime & sha256 of the input;
+    output (relative to destdir), output_size & output_sha256; and params, the
+    encryption settings (see params_for()). A file is encrypted again if it's
+    not in the manifest, its params changed, its output is missing or has the
+    wrong size, or its content changed -- size & mtime are compared first, and
+    only if they differ is the file hashed, so that merely touched files cost a
+    read but no encryption.
+    
+    Outputs are written to a temporary name & renamed into place, and a file's
+    entry is only appended once its output is in place; killing a run loses at
+    most the files being worked on. The manifest is rewritten without stale
+    entries at the end of each run; with delete set, outputs of files that
+    have disappeared from srcdir are removed then too.
+    
+    A changed passphrase (symmetric mode) isn't noticed: nothing derived from it
+    is stored.
+    
+    """
+    
+    def __init__(self, srcdir, destdir, backend='gpg2', workers=None, native=False, **opts):
+        if not isdir(srcdir):
+            raise OSError("{} is not a directory".format(srcdir))
+        self.batch      = Batch('enc', backend, workers, native, **opts)
+        self.srcdir     = abspath(srcdir)
+        self.destdir    = abspath(destdir)
+        self.manifest   = join(self.destdir, MANIFEST)
+        self.pattern    = '*'
+        self.delete     = False
+        self.entries    = {}
+        self.params     = self.encryption_params()
+    
+    
+    def encryption_params(self):
+        """Return dict of the settings that go into every output (less the passphrase)."""
+        opts = self.batch.opts
+        params = dict(backend=self.batch.backend, cipher=opts.get('cipher'))
+        if self.batch.backend == 'openssl':
+            params.update(symmetric=True)
+            return params
+        session = self.batch.x.session
+        recipients = []
+        if opts.get('recip'):
+            recipients.extend(session.resolve_recipients(opts['recip']))
+        if opts.get('enctoself'):
+            recipients.append(opts.get('localuser') or session.default_key())
+        params.update(symmetric=bool(opts.get('symmetric')),
+                      recipients=sorted(set(recipients)),
+                      sign=bool(opts.get('encsign')), digest=opts.get('digest'))
+        return params
+    
+    
+    def params_for(self, infile):
+        """Return encryption params for infile (armor can differ per file; see Batch.auto_armor)."""
+        return dict(self.params, armor=self.batch.file_opts(infile).get('base64', True))
+    
+    
+    def outfile(self, path, params):
+        """Return output path (relative to destdir) for input path (relative to srcdir)."""
+        return crypt_interface.default_outfile(path, 'enc', params['armor'], params['backend'])
+    
+    
+    #---------------------------------------------------------------- MANIFEST
+    
+    def load_manifest(self):
+        """Read entries from the manifest, if there is one."""
+        self.entries = {}
+        try:
+            f = open(self.manifest)
+        except IOError:
+            return
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Cut short by a crash
+                self.entries[entry['path']] = entry
+    
+    
+    def save_manifest(self, paths):
+        """Rewrite the manifest with just the entries for paths."""
+        fd, tmpname = mkstemp(dir=self.destdir, prefix=MANIFEST + '.', suffix='.part')
+        with fdopen(fd, 'w') as f:
+            for path in sorted(paths):
+                if path in self.entries:
+                    f.write(json.dumps(self.entries[path], sort_keys=True) + "\n")
+        rename(tmpname, self.manifest)
+    
+    
+    #------------------------------------------------------------------- FILES
+    
+    def needs_work(self, path):
+        """Return True if path (relative to srcdir) may have to be encrypted."""
+        entry = self.entries.get(path)
+        if not entry:
+            return True
+        infile = join(self.srcdir, path)
+        if entry['params'] != self.params_for(infile):
+            return True
+        try:
+            st = stat(join(self.destdir, entry['output']))
+            if st.st_size != entry['output_size']:
+                return True
+            st = stat(infile)
+        except OSError:
+            return True
+        # Size & mtime unchanged: taken to be the same file (as rsync does)
+        return (st.st_size, st.st_mtime) != (entry['size'], entry['mtime'])
+    
+    
+    def run_job(self, path):
+        """Encrypt path (relative to srcdir) unless its content is unchanged; return result dict.
+        
+        result['entry'] is the new manifest entry; result['skipped'] is True if the
+        file only looked changed.
+        
+        """
+        infile = join(self.srcdir, path)
+        params = self.params_for(infile)
+        output = self.outfile(path, params)
+        outfile = join(self.destdir, output)
+        result = dict(infile=infile, outfile=outfile, action='enc', returncode=None,
+                      ok=False, skipped=False, seconds=0.0, stderr='')
+        start = time()
+        tmpname = None
+        try:
+            # Stat before hashing: if the file changes meanwhile, next run notices
+            st = stat(infile)
+            entry = dict(path=path, size=st.st_size, mtime=st.st_mtime,
+                         sha256=file_digest(infile), output=output, params=params)
+            
+            old = self.entries.get(path)
+            if old and old['params'] == params and old['sha256'] == entry['sha256']:
+                try:
+                    if stat(join(self.destdir, old['output'])).st_size == old['output_size']:
+                        # Just touched; remember the new mtime so it isn't hashed again
+                        entry.update(output_size=old['output_size'],
+                                     output_sha256=old['output_sha256'])
+                        result.update(ok=True, skipped=True, entry=entry, returncode=0,
+                                      seconds=round(time() - start, 4))
+                        return result
+                except OSError:
+                    pass
+            
+            if not isdir(dirname(outfile)):
+                try:
+                    makedirs(dirname(outfile))
+                except OSError:
+                    if not isdir(dirname(outfile)):
+                        raise
+            # Temporary files left by a run that was killed partway
+            for stale in glob(join(dirname(outfile), '.{}.*.part'.format(basename(outfile)))):
+                try:
+                    unlink(stale)
+                except OSError:
+                    pass
+            fd, tmpname = mkstemp(dir=dirname(outfile), suffix='.part',
+                                  prefix='.{}.'.format(basename(outfile)))
+            close(fd)
+            result.update(self.batch.run_job((infile, tmpname)))
+            result.update(outfile=outfile, skipped=False, seconds=round(time() - start, 4))
+            if result['ok']:
+                entry.update(output_size=stat(tmpname).st_size,
+                             output_sha256=file_digest(tmpname))
+                rename(tmpname, outfile)
+                tmpname = None
+                result['entry'] = entry
+                # Armor changed, so the name did; don't leave the old output behind
+                if old and old['output'] != output:
+                    try:
+                        unlink(join(self.destdir, old['output']))
+                    except OSError:
+                        pass
+        except (OSError, IOError) as e:
+            result.update(ok=False, stderr=result['stderr'] + "{}\n".format(e))
+        finally:
+            if tmpname:
+                try:
+                    unlink(tmpname)
+                except OSError:
+                    pass
+        return result
+    
+    
+    def run(self, callback):
+        """Bring destdir up to date, calling callback(result) for each file looked at.
+        
+        Returns dict of counts: encrypted, unchanged, failed & removed.
+        
+        """
+        if not isdir(self.destdir):
+            makedirs(self.destdir)
+        self.load_manifest()
+        
+        # Don't descend into destdir if it's under srcdir
+        paths = [relpath(infile, self.srcdir) for infile, _ in walk_tree(self.srcdir, self.pattern)
+                 if not (infile + '/').startswith(self.destdir + '/')]
+        todo = [p for p in paths if self.needs_work(p)]
+        counts = dict(encrypted=0, unchanged=len(paths) - len(todo), failed=0, removed=0)
+        
+        log = open(self.manifest, 'a')
+        try:
+            for result in threadpool.imap_unordered(self.run_job, todo, self.batch.workers):
+                entry = result.pop('entry', None)
+                if entry:
+                    self.entries[entry['path']] = entry
+                    log.write(json.dumps(entry, sort_keys=True) + "\n")
+                    log.flush()
+                if not result['ok']:
+                    counts['failed'] += 1
+                elif result['skipped']:
+                    counts['unchanged'] += 1
+                else:
+                    counts['encrypted'] += 1
+                callback(result)
+        finally:
+            log.close()
+        
+        # Files gone from srcdir
+        for path in set(self.entries) - set(paths):
+            if self.delete:
+                try:
+                    unlink(join(self.destdir, self.entries[path]['output']))
+                    counts['removed'] += 1
+                except OSError:
+                    pass
+            del self.entries[path]
+        self.save_manifest(paths)
+        return counts
+
+
+
+def main(argv):
+    """Entry point for 'pyrite treecrypt' subcommand; return exit status."""
+    
+    parser = argparse.ArgumentParser(
+        prog='pyrite treecrypt',
+        description="Headless: encrypt every file under SRC into the same place under "
+                    "DEST, skipping files that haven't changed since the last run (per a "
+                    "manifest kept in DEST). Prints one JSON result per file encrypted.")
+    
+    parser.add_argument('srcdir', metavar='SRC', help="directory tree to encrypt")
+    
+    parser.add_argument('destdir', metavar='DEST', help="where encrypted files go")
+    
+    parser.add_argument('-p', '--pattern', default='*',
+                        help="only encrypt filenames matching this glob")
+    
+    parser.add_argument('--delete', action='store_true',
+                        help="remove outputs of files no longer in SRC")
+    
+    parser.add_argument('-j', '--workers', type=worker_count, default=cpu_count(),
+                        help="number of gpg/openssl processes to run at once "
+                             "(default: %(default)s)")
+    
+    parser.add_argument('-A', '--auto-armor', action='store_true',
+                        help="ascii-armor output only for input files that look like "
+                             "text (binary output for the rest)")
+    
+    add_engine_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    check_engine_arguments(parser, args)
+    
+    try:
+        tree = TreeCrypt(args.srcdir, args.destdir, args.backend, args.workers, args.native,
+                         **engine_opts(args))
+    except (ValueError, OSError, RecipientError) as e:
+        stderr.write("pyrite treecrypt: {}\n".format(e))
+        return 2
+    
+    tree.batch.auto_armor = args.auto_armor
+    tree.pattern = args.pattern
+    tree.delete = args.delete
+    
+    def report(result):
+        if not result['skipped']:
+            stdout.write(json.dumps(result, sort_keys=True) + "\n")
+            stdout.flush()
+    
+    try:
+        counts = tree.run(report)
+    except (OSError, IOError) as e:
+        stderr.write("pyrite treecrypt: {}\n".format(e))
+        return 1
+    stderr.write("pyrite treecrypt: {encrypted} encrypted, {unchanged} unchanged, "
+                 "{failed} failed, {removed} removed\n".format(**counts))
+    return 1 if counts['failed'] else 0
@@ -0,0 +1,498 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Last file mod: 2013/09/15
+# Latest version at <http://github.com/ryran/pyrite>
+# Copyright 2012, 2013 Ryan Sawhill Aroha <rsaw@redhat.com>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#
+# Watch-folder mode: encrypt or sign every file dropped into a spool directory
+# as soon as whoever is writing it has finished. Changes are learned of from
+# the kernel with inotify (via ctypes, so no extra modules are needed) or, where
+# that isn't available, by listing the directory every so often. A file is
+# taken to be complete once it has been closed (or moved in) and then left
+# alone for a moment; a pool of workers then runs the engine on it, writing to
+# a temporary name that's renamed into place only on success.
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import argparse
+import json
+import struct
+from sys import stdout, stderr
+from os import listdir, stat, read, close, rename, unlink
+from os.path import join, basename, abspath, isdir
+from signal import signal, SIGTERM
+from stat import S_ISREG
+from fnmatch import fnmatch
+from select import poll, POLLIN
+from ctypes import CDLL, c_int, c_char_p, c_uint32, get_errno
+from ctypes.util import find_library
+from tempfile import mkstemp
+from threading import Thread, Lock
+from Queue import Queue
+from multiprocessing import cpu_count
+from time import time, sleep
+# Custom Modules:
+import crypt_interface
+from batch import (Batch, add_engine_arguments, engine_opts,
+                   worker_count, check_engine_arguments)
+
+# Actions that make an output file out of each dropped file
+ACTIONS = ('enc', 'embedsign', 'clearsign', 'detachsign')
+
+# Extensions of the files those actions write (see crypt_interface.default_outfile)
+OUTPUT_EXTENSIONS = ('.asc', '.gpg', '.sig', '.enc')
+
+# Seconds a closed file must go unmodified before it's processed
+SETTLE = 0.2
+
+# Seconds between directory listings when polling instead of using inotify
+POLL_INTERVAL = 0.5
+
+# Seconds between sweeps of files that have gone from spooldir out of Watch.done
+PRUNE_INTERVAL = 10.0
+
+# From <sys/inotify.h>
+IN_MODIFY       = 0x00000002
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE_SELF  = 0x00000400
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+IN_ONLYDIR      = 0x01000000
+IN_CLOEXEC      = 0o2000000
+EVENT_HEADER    = struct.Struct('iIII')
+
+_libc = None
+_libc_lock = Lock()
+
+
+
+def load_inotify():
+    """Return ctypes handle to libc's inotify functions, raising OSError if there are none."""
+    global _libc
+    with _libc_lock:
+        if _libc:
+            return _libc
+        name = find_library('c')
+        if not name:
+            raise OSError("libc not found on your system")
+        lib = CDLL(name, use_errno=True)
+        if not hasattr(lib, 'inotify_init1'):
+            raise OSError("inotify not supported on your system")
+        lib.inotify_init1.argtypes      = [c_int]
+        lib.inotify_add_watch.argtypes  = [c_int, c_char_p, c_uint32]
+        _libc = lib
+        return lib
+
+
+def signature(path):
+    """Return (size, mtime) of path if it's a regular file, else None."""
+    try:
+        st = stat(path)
+    except OSError:
+        return None
+    if not S_ISREG(st.st_mode):
+        return None
+    return st.st_size, st.st_mtime
+
+
+
+class InotifySource:
+    """Files changed in a directory, as reported by the kernel (Linux inotify)."""
+    
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_ONLYDIR
+    
+    
+    def __init__(self, path):
+        lib = load_inotify()
+        self.path = path
+        self.fd = lib.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(get_errno(), "inotify_init1 failed")
+        if lib.inotify_add_watch(self.fd, path, self.MASK) < 0:
+            errno = get_errno()
+            close(self.fd)
+            raise OSError(errno, "can't watch {}".format(path))
+        self.poller = poll()
+        self.poller.register(self.fd, POLLIN)
+    
+    
+    def wait(self, timeout):
+        """Wait up to timeout seconds for changes; return list of (name, closed) tuples.
+        
+        closed is True if the file was closed after writing or moved in, i.e.,
+        whoever was writing it may be done.
+        
+        """
+        if not self.poller.poll(timeout * 1000):
+            return []
+        data = read(self.fd, 65536)
+        changes = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = data[pos:pos+length].rstrip('\0')
+            pos += length
+            if mask & (IN_DELETE_SELF | IN_IGNORED):
+                raise OSError("{} is gone".format(self.path))
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; have everything looked at again
+                changes.extend((n, True) for n in listdir(self.path))
+            elif name:
+                changes.append((name, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+        return changes
+    
+    
+    def close(self):
+        close(self.fd)
+
+
+
+class PollSource:
+    """Files changed in a directory, found by listing it every interval seconds."""
+    
+    def __init__(self, path, interval=POLL_INTERVAL):
+        self.path       = path
+        self.interval   = interval
+        self.last       = self.scan()
+    
+    
+    def scan(self):
+        return dict((name, signature(join(self.path, name))) for name in listdir(self.path))
+    
+    
+    def wait(self, timeout):
+        """Wait up to timeout seconds (as for InotifySource); every change counts as closed."""
+        sleep(min(timeout, self.interval))
+        if not isdir(self.path):
+            raise OSError("{} is gone".format(self.path))
+        current = self.scan()
+        changes = [(name, True) for name, sig in current.iteritems()
+                   if sig != self.last.get(name)]
+        self.last = current
+        return changes
+    
+    
+    def close(self):
+        pass
+
+
+
+class Watch:
+    """Run an engine operation on each file dropped into spooldir, with a pool of workers.
+    
+    Output goes to outdir (default: spooldir itself) under the name the GUI would
+    suggest (see crypt_interface.default_outfile), written to a hidden temporary
+    file first and renamed into place only if the engine succeeded. Hidden files
+    are never picked up, nor -- when output goes to spooldir -- files with one of
+    the output extensions. A file whose output is already newer than it is taken
+    to be done, so restarting the watch doesn't redo work; nor is a file that
+    failed tried again until it changes. Subdirectories aren't watched.
+    
+    opts etc are as for batch.Batch; set auto_armor on self.batch. If remove is
+    set, each input file is deleted once its output is in place.
+    
+    """
+    
+    def __init__(self, spooldir, action, backend='gpg2', workers=None, native=False, **opts):
+        if action not in ACTIONS:
+            raise ValueError("action must be one of: {}".format(', '.join(ACTIONS)))
+        if not isdir(spooldir):
+            raise OSError("{} is not a directory".format(spooldir))
+        self.batch      = Batch(action, backend, workers, native, **opts)
+        self.spooldir   = abspath(spooldir)
+        self.outdir     = self.spooldir
+        self.pattern    = '*'
+        self.settle     = SETTLE
+        self.polling    = False
+        self.interval   = POLL_INTERVAL
+        self.remove     = False
+        self.stopped    = False
+        self.lock       = Lock()
+        self.busy       = set()
+        self.done       = {}
+        self.seen       = {}
+    
+    
+    def outfile(self, infile, opts):
+        """Return final output path for infile."""
+        name = crypt_interface.default_outfile(
+            infile, self.batch.action, opts.get('base64', True), self.batch.backend)
+        return join(self.outdir, basename(name))
+    
+    
+    def ignored(self, name):
+        """Return True if file name in spooldir isn't for us."""
+        if name.startswith('.') or not fnmatch(name, self.pattern):
+            return True
+        return self.outdir == self.spooldir and name.endswith(OUTPUT_EXTENSIONS)
+    
+    
+    def up_to_date(self, infile, sig):
+        """Return True if infile's output exists & is no older than infile."""
+        out = signature(self.outfile(infile, self.batch.file_opts(infile)))
+        return out is not None and out[1] >= sig[1]
+    
+    
+    def prune(self):
+        """Forget files that are done & no longer in spooldir, so done doesn't grow forever."""
+        with self.lock:
+            for path in self.done.keys():
+                if path not in self.busy and signature(path) is None:
+                    del self.done[path]
+    
+    
+    def ready(self, source):
+        """Yield paths of files in spooldir as they're done being written (until stop())."""
+        
+        pending = {}  # path -> [deadline, signature, closed]
+        
+        def mark(name, closed):
+            if self.ignored(name):
+                return
+            path = join(self.spooldir, name)
+            sig = signature(path)
+            if sig is None:
+                pending.pop(path, None)
+                with self.lock:
+                    self.seen.pop(path, None)
+                    self.done.pop(path, None)
+                return
+            if path in pending:
+                closed = closed or (pending[path][2] and pending[path][1] == sig)
+            pending[path] = [time() + self.settle, sig, closed]
+            with self.lock:
+                self.seen.setdefault(path, time())
+        
+        for name in listdir(self.spooldir):
+            mark(name, True)
+        next_prune = time() + PRUNE_INTERVAL
+        
+        while not self.stopped:
+            # Wake up for the next file due to settle, or every second to check for stop()
+            timeout = 1.0
+            if pending:
+                timeout = max(0.0, min(timeout, min(p[0] for p in pending.itervalues()) - time()))
+            for name, closed in source.wait(timeout):
+                mark(name, closed)
+            now = time()
+            for path, (deadline, sig, closed) in pending.items():
+                if deadline > now or not closed:
+                    continue
+                del pending[path]
+                current = signature(path)
+                if current is None:
+                    continue
+                if current != sig or path in self.busy:
+                    # Still changing (or still being processed); look again later
+                    pending[path] = [now + self.settle, current, current == sig]
+                    continue
+                if self.done.get(path) == current or self.up_to_date(path, current):
+                    with self.lock:
+                        self.seen.pop(path, None)
+                    continue
+                with self.lock:
+                    self.busy.add(path)
+                    self.done[path] = current
+                yield path
+            if now >= next_prune:
+                self.prune()
+                next_prune = now + PRUNE_INTERVAL
+    
+    
+    def run_job(self, infile):
+        """Process infile and return a dict describing the result (as batch.Batch does)."""
+        
+        outfile = self.outfile(infile, self.batch.file_opts(infile))
+        result = dict(infile=infile, outfile=outfile, action=self.batch.action,
+                      returncode=None, ok=False, seconds=0.0, stderr='')
+        tmpname = None
+        try:
+            fd, tmpname = mkstemp(dir=self.outdir, suffix='.part',
+                                  prefix='.{}.'.format(basename(outfile)))
+            close(fd)
+            result = self.batch.run_job((infile, tmpname))
+            result['outfile'] = outfile
+            if result['ok']:
+                rename(tmpname, outfile)
+                tmpname = None
+                if self.remove:
+                    unlink(infile)
+                    with self.lock:
+                        self.done.pop(infile, None)
+        except (OSError, IOError) as e:
+            result.update(ok=False, stderr=result['stderr'] + "{}\n".format(e))
+        finally:
+            if tmpname:
+                try:
+                    unlink(tmpname)
+                except OSError:
+                    pass
+            with self.lock:
+                self.busy.discard(infile)
+                first_seen = self.seen.pop(infile, None)
+        
+        if first_seen:
+            result['latency'] = round(time() - first_seen, 4)
+        return result
+    
+    
+    def run(self, callback):
+        """Watch spooldir until stop() is called or the directory goes away.
+        
+        Each file's result is passed to callback(result), from the worker thread
+        that processed it (but never two at once).
+        
+        """
+        if self.polling:
+            source = PollSource(self.spooldir, self.interval)
+        else:
+            try:
+                source = InotifySource(self.spooldir)
+            except OSError as e:
+                stderr.write("pyrite watch: {}; polling instead\n".format(e))
+                source = PollSource(self.spooldir, self.interval)
+        
+        queue = Queue()
+        report = Lock()
+        
+        def work():
+            while True:
+                infile = queue.get()
+                if infile is None:
+                    return
+                result = self.run_job(infile)
+                with report:
+                    callback(result)
+        
+        workers = [Thread(target=work) for i in xrange(self.batch.workers)]
+        for t in workers:
+            t.daemon = True
+            t.start()
+        try:
+            for infile in self.ready(source):
+                queue.put(infile)
+        finally:
+            source.close()
+            # Let files already handed out finish
+            for t in workers:
+                queue.put(None)
+            for t in workers:
+                t.join()
+    
+    
+    def stop(self):
+        """Make run() return (within a second), once files being processed are done."""
+        self.stopped = True
+
+
+
+def main(argv):
+    """Entry point for 'pyrite watch' subcommand; return exit status."""
+    
+    parser = argparse.ArgumentParser(
+        prog='pyrite watch',
+        description="Headless: encrypt or sign each file dropped into a directory as "
+                    "soon as it's been written, printing one JSON result per file to "
+                    "stdout. Runs until interrupted.")
+    
+    parser.add_argument('action', choices=ACTIONS,
+                        help="operation to perform on each file")
+    
+    parser.add_argument('spooldir', metavar='DIR', help="directory to watch")
+    
+    parser.add_argument('-o', '--output-dir', metavar='DIR',
+                        help="write output files here (default: DIR itself, in which case "
+                             "files with output extensions like .gpg are left alone)")
+    
+    parser.add_argument('-p', '--pattern', default='*',
+                        help="only process filenames matching this glob")
+    
+    parser.add_argument('--remove', action='store_true',
+                        help="delete each input file once its output is written")
+    
+    parser.add_argument('--settle', type=float, default=SETTLE, metavar='SECONDS',
+                        help="how long a closed file must stay unmodified before it's "
+                             "processed (default: %(default)s)")
+    
+    parser.add_argument('--poll', type=float, nargs='?', const=POLL_INTERVAL,
+                        metavar='SECONDS',
+                        help="list DIR every SECONDS (default: {}) instead of using inotify "
+                             "(needed e.g. for network filesystems)".format(POLL_INTERVAL))
+    
+    parser.add_argument('-j', '--workers', type=worker_count, default=cpu_count(),
+                        help="number of gpg/openssl processes to run at once "
+                             "(default: %(default)s)")
+    
+    parser.add_argument('-A', '--auto-armor', action='store_true',
+                        help="ascii-armor output only for input files that look like "
+                             "text (binary output for the rest)")
+    
+    add_engine_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    check_engine_arguments(parser, args)
+    
+    try:
+        watch = Watch(args.spooldir, args.action, args.backend, args.workers, args.native,
+                      **engine_opts(args))
+    except (ValueError, OSError) as e:
+        stderr.write("pyrite watch: {}\n".format(e))
+        return 2
+    
+    if args.output_dir:
+        if not isdir(args.output_dir):
+            stderr.write("pyrite watch: {} is not a directory\n".format(args.output_dir))
+            return 2
+        watch.outdir = abspath(args.output_dir)
+    watch.pattern = args.pattern
+    watch.remove = args.remove
+    watch.settle = args.settle
+    watch.batch.auto_armor = args.auto_armor
+    if args.poll is not None:
+        watch.polling = True
+        watch.interval = args.poll
+    
+    counts = dict(ok=0, failed=0)
+    
+    def report(result):
+        counts['ok' if result['ok'] else 'failed'] += 1
+        stdout.write(json.dumps(result, sort_keys=True) + "\n")
+        stdout.flush()
+    
+    # Stop (letting files being processed finish) on SIGTERM just like on Ctrl-C
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+    signal(SIGTERM, interrupt)
+    
+    try:
+        watch.run(report)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        stderr.write("pyrite watch: {}\n".format(e))
+        return 1
+    stderr.write("pyrite watch: {ok} files processed, {failed} failed\n".format(**counts))
+    return 0
@@ -34,7 +34,12 @@
 
 import argparse
 from sys import argv
-import modules.core
+
+# Headless subcommands don't need (or load) GTK+
+if len(argv) > 1 and argv[1] in {'batch', 'bench', 'chunked', 'daemon', 'fanout', 'reencrypt',
+                                      'treecrypt', 'watch'}:
+    from importlib import import_module
+    exit(import_module('modules.' + argv[1]).main(argv[2:]))
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(
@@ -79,6 +84,9 @@ args = parser.parse_args()
 # If no cmdline options specified, let's save some cycles later
 if len(argv) == 1:  args = None
 
+# Only now load GTK+ (so that '--help' & bad args don't have to wait for it)
+import modules.core
+
 
 if __name__ == "__main__":
     
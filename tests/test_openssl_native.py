@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pyrite.
+# Latest version at <http://github.com/ryran/pyrite>
+#
+# License:
+#
+#    Pyrite is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Pyrite is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Pyrite.  If not, see <http://gnu.org/licenses/gpl.html>.
+#
+#------------------------------------------------------------------------------
+#
+# Interop tests: the in-process openssl engine (openssl_native) must decrypt
+# what the openssl binary encrypts and vice versa, for every cipher in
+# OPENSSL_CIPHERS, with and without base64. Run from the top of the tree:
+#
+#   python2 -m unittest discover -s tests
+#
+#------------------------------------------------------------------------------
+
+# StdLib:
+import sys
+import unittest
+from os import urandom
+from os.path import join, dirname, abspath
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'modules'))
+# Custom Modules:
+import crypt_interface
+
+PASSPHRASE = 'interop test'
+
+try:
+    BINARY = crypt_interface.new_engine('openssl')
+    NATIVE = crypt_interface.new_engine('openssl', native=True)
+except OSError:
+    BINARY = NATIVE = None
+
+
+
+def crypt(x, action, data, base64, cipher):
+    """Run action over data on engine x; return (returncode, output)."""
+    job = crypt_interface.Job(stdin=data)
+    returncode = crypt_interface.run_engine(x, action, job=job, passwd=PASSPHRASE,
+                                            base64=base64, cipher=cipher)[0]
+    return returncode, job.io['stdout']
+
+
+
+@unittest.skipIf(BINARY is None, "need both the openssl binary and libcrypto")
+class InteropTest(unittest.TestCase):
+    """One pair of tests per cipher & armor mode; see make_tests()."""
+    
+    payload = urandom(100000)
+    
+    
+    def encrypt_with_binary(self, base64, cipher):
+        returncode, data = crypt(BINARY, 'enc', self.payload, base64, cipher)
+        if returncode != 0:
+            # e.g., cast5 & blowfish are only in OpenSSL 3's legacy provider
+            self.skipTest("{} unavailable in this OpenSSL".format(cipher))
+        return data
+    
+    
+    def check_native_to_binary(self, base64, cipher):
+        # Don't let a cipher missing from the binary pass as a failure
+        self.encrypt_with_binary(base64, cipher)
+        returncode, data = crypt(NATIVE, 'enc', self.payload, base64, cipher)
+        self.assertEqual(returncode, 0)
+        self.assertEqual(crypt(BINARY, 'dec', data, base64, cipher), (0, self.payload))
+    
+    
+    def check_binary_to_native(self, base64, cipher):
+        data = self.encrypt_with_binary(base64, cipher)
+        self.assertEqual(crypt(NATIVE, 'dec', data, base64, cipher), (0, self.payload))
+    
+    
+    def test_wrong_passphrase(self):
+        data = self.encrypt_with_binary(True, None)
+        job = crypt_interface.Job(stdin=data)
+        returncode = crypt_interface.run_engine(NATIVE, 'dec', job=job, passwd='wrong',
+                                                base64=True, cipher=None)[0]
+        self.assertNotEqual(returncode, 0)
+
+
+
+def make_tests():
+    """Add test_<cipher>_<mode>_<direction> methods to InteropTest."""
+    for cipher in crypt_interface.OPENSSL_CIPHERS:
+        for base64 in True, False:
+            for direction in 'native_to_binary', 'binary_to_native':
+                check = getattr(InteropTest, 'check_' + direction)
+                name = 'test_{}_{}_{}'.format(cipher or 'default', 'armor' if base64 else
+                                              'binary', direction)
+                setattr(InteropTest, name,
+                        lambda self, check=check, b=base64, c=cipher: check(self, b, c))
+
+make_tests()
+
+
+if __name__ == '__main__':
+    unittest.main()